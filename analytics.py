@@ -0,0 +1,81 @@
+from datetime import date, timedelta
+
+import numpy as np
+
+from storage import CATEGORIES
+
+# ----------------------------------------------------------
+# 統計分析用索引
+# ----------------------------------------------------------
+
+
+class PrefixSumIndex:
+    """
+    每日 × 分類 的前綴和 (cumulative sum) 陣列
+    - cum[i, c] = 第 0 ~ i-1 天分類 c 的累計金額
+    - 任意日期區間的各分類合計 = cum[end] - cum[start]，只需兩次查表
+    """
+
+    def __init__(self, first_day, categories, cum):
+        self.first_day = first_day
+        self.categories = categories
+        self.cum = cum
+
+    @classmethod
+    def from_daily_totals(cls, daily_totals):
+        """由 {日期: {分類: 金額}} (儲存層的每日彙總) 建立索引"""
+        categories = list(CATEGORIES)
+        for totals in daily_totals.values():
+            for cat in totals:
+                if cat not in categories:
+                    categories.append(cat)
+
+        if not daily_totals:
+            return cls(None, categories, np.zeros((1, len(categories))))
+
+        days = sorted(daily_totals)
+        first_day = date.fromisoformat(days[0])
+        n_days = (date.fromisoformat(days[-1]) - first_day).days + 1
+        col = {cat: i for i, cat in enumerate(categories)}
+
+        dense = np.zeros((n_days + 1, len(categories)))
+        for d, totals in daily_totals.items():
+            row = (date.fromisoformat(d) - first_day).days + 1
+            for cat, amount in totals.items():
+                dense[row, col[cat]] = amount
+        return cls(first_day, categories, np.cumsum(dense, axis=0))
+
+    @property
+    def last_day(self):
+        if self.first_day is None:
+            return None
+        return self.first_day + timedelta(days=len(self.cum) - 2)
+
+    def _row(self, day):
+        """日期 → 前綴和列號 (超出範圍則夾在頭尾)"""
+        offset = (day - self.first_day).days
+        return min(max(offset, 0), len(self.cum) - 1)
+
+    def range_vector(self, start=None, end=None):
+        """日期在 [start, end) 的各分類合計 (順序同 self.categories)"""
+        if self.first_day is None:
+            return np.zeros(len(self.categories))
+        lo = 0 if start is None else self._row(start)
+        hi = len(self.cum) - 1 if end is None else self._row(end)
+        if hi <= lo:
+            return np.zeros(len(self.categories))
+        return self.cum[hi] - self.cum[lo]
+
+    def range_totals(self, start=None, end=None):
+        """日期在 [start, end) 的各分類合計 {分類: 金額}，省略為 0 的分類"""
+        # 四捨五入去掉浮點累加誤差
+        vector = np.round(self.range_vector(start, end), 6)
+        return {cat: _to_number(v) for cat, v in zip(self.categories, vector) if v}
+
+    def total(self, start=None, end=None):
+        return _to_number(np.round(self.range_vector(start, end).sum(), 6))
+
+
+def _to_number(value):
+    value = float(value)
+    return int(value) if value.is_integer() else value
@@ -1,9 +1,11 @@
 import streamlit as st
 import os
-from datetime import date, datetime, timedelta
+from datetime import date, timedelta
 from audiorecorder import audiorecorder
 from pydub import AudioSegment
+import hashlib
 import shutil
+import time
 
 # 設定 ffmpeg 路徑 (將 Scripts 加入 PATH，讓 pydub 找得到 ffmpeg/ffprobe)
 ffmpeg_dir = r"C:\Users\cwe93\anaconda3\envs\EE\Scripts"
@@ -15,7 +17,35 @@ import json
 import os
 import pandas as pd
 from dotenv import load_dotenv
-from google.genai import Client, types
+from analytics import PrefixSumIndex
+from audio_utils import preprocess_segment
+from gemini_client import (
+    SCAN_MAX_WORKERS,
+    call_gemini_stream,
+    extract_line_items_gemini,
+    extract_receipt_gemini,
+    extract_receipts_concurrently,
+    get_analysis_cache,
+    get_parse_cache,
+    get_pool,
+    get_scan_cache,
+    parse_item_amount_gemini,
+    parse_items_batch_gemini,
+    parse_stats,
+    transcribe_audio_gemini,
+    voice_to_record_gemini,
+)
+from image_utils import (
+    IMAGE_FORMATS,
+    RECEIPT_MAX_EDGE,
+    RECEIPT_QUALITY,
+    dhash,
+    group_similar_hashes,
+    preprocess_receipt_image,
+)
+from ledger import load_ledger
+from local_parser import CONFIDENCE_THRESHOLD, LocalParser, split_entries
+from storage import CATEGORIES, ConflictError, month_range, open_store, to_amount
 
 # ----------------------------------------------------------
 # 讀取 .env
@@ -29,97 +59,152 @@ st.set_page_config(page_title="AI 記帳工具", layout="wide")
 
 DATA_PATH = "data/records.json"
 BUDGET_PATH = "data/budget.json"
+SQLITE_PATH = "data/records.db"
+RECORD_COLUMNS = ["品項", "分類", "金額", "日期", "備註"]
+
+# 儲存後端：json (預設，records.json + 日誌)、sqlite 或 sharded (data/shards/ 依月份分片)
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "json").strip().lower()
+# json 後端另存欄式快照 (data/records.arrow，需要 pyarrow)：開啟時不必解析 JSON，頁面只讀需要的欄位
+ARROW_SNAPSHOT = os.getenv("ARROW_SNAPSHOT", "0").strip() == "1"
 
 # 確保 data 資料夾存在
 os.makedirs("data", exist_ok=True)
 
-# 若 JSON 不存在就建立
-if not os.path.exists(DATA_PATH):
-    with open(DATA_PATH, "w", encoding="utf-8") as f:
-        json.dump([], f, ensure_ascii=False, indent=4)
+# 記帳資料改由儲存層管理，跨 session 共用同一個物件
+@st.cache_resource
+def get_store():
+    return open_store(STORAGE_BACKEND, DATA_PATH, BUDGET_PATH, SQLITE_PATH, arrow=ARROW_SNAPSHOT)
 
-# ----------------------------------------------------------
-# Gemini API Key 輪替邏輯 & 解析函式
-# ----------------------------------------------------------
-def call_gemini_rotated(contents, model_name="gemini-2.5-flash"):
+store = get_store()
+
+
+@st.cache_data(show_spinner=False, max_entries=64)
+def _load_records_df(version, start, end, keyed, columns):
+    # version 只用來當快取 key：資料有變動時 version 不同，才會重新解析
+    # 欄式表示：分類 / 品項 / 備註 為 Categorical、金額為整數欄 (大量資料時省記憶體)
+    return load_ledger(store, start, end, keyed, columns).to_frame()
+
+
+def load_records_df(start=None, end=None, keyed=False, columns=None):
     """
-    自動輪替 GEMINI_API_KEY_A ~ H
-    若遇到 429 錯誤則切換下一組 Key
+    所有頁面共用的資料載入：回傳已轉好型別的 DataFrame (日期為 datetime、金額為數字，
+    分類 / 品項 / 備註 為 Categorical，見 ledger.py)
+    跨 rerun / session 快取，只有儲存層版本改變時才重新讀檔與解析
+    keyed=True 時多一個 key 欄位 (紀錄的 id)，可直接給 store.get / update / delete 使用
+    columns 可只取部分欄位 (有欄式快照時不會讀到其他欄位)
     """
-    # 載入 A~H 的 Keys
-    keys = [os.getenv(f"GEMINI_API_KEY_{c}") for c in "ABCDEFGH"]
-    # 過濾掉沒設定的空值
-    keys = [k for k in keys if k]
-
-    if not keys:
-        return None, "未設定任何 API Key (GEMINI_API_KEY_A~H)"
-
-    last_error = ""
-
-    for i, key in enumerate(keys):
-        try:
-            client = Client(api_key=key)
-            response = client.models.generate_content(
-                model=model_name,
-                contents=contents
-            )
-            # 成功就回傳
-            # 為了讓使用者知道現在用第幾組 Key (Debug用，可拿掉)
-            # print(f"Success with Key Index {i}")
-            return response, None
-
-        except Exception as e:
-            error_msg = str(e)
-            last_error = error_msg
-            # 如果是 429 (Resource Exhausted) 就繼續迴圈試下一個
-            if "429" in error_msg or "RESOURCE_EXHAUSTED" in error_msg:
-                print(f"Key {i} (Index {i}) 額度耗盡，切換下一組...")
-                continue
-            else:
-                # 其他錯誤 (如 500, 400) 直接拋出，不輪替
-                return None, f"API Error: {error_msg}"
-
-    # 迴圈跑完都沒成功
-    return None, f"所有 API Key 額度皆已耗盡或失敗。Last Error: {last_error}"
-
-
-def parse_item_amount_gemini(text: str) -> dict:
-    prompt = f"""
-你是一個拆解句子的助理。
-你會收到一段生活化的文字，請先理解語意，解析出：
-1. 品項 item
-2. 金額 amount
-3. 自動分類 category（例如：餐飲食品, 交通運輸, 居家生活, 服飾購物, 休閒娛樂, 醫療保健, 投資儲蓄, 其他）
-
-⚠️ 回覆格式要求：
-- 僅回傳 JSON，不能有多餘文字
-- 格式如下：
-{{
-  "item": "...",
-  "amount": 數字,
-  "category": "..."
-}}
-
-請解析以下文字：
-{text}
-"""
-    # 使用輪替函式
-    response, error = call_gemini_rotated(contents=prompt, model_name="gemini-2.5-flash")
+    return _load_records_df(store.version(), start, end, keyed, tuple(columns or ()))
+
+
+@st.cache_data(show_spinner=False, max_entries=4)
+def _load_prefix_index(version):
+    return PrefixSumIndex.from_daily_totals(store.daily_totals())
+
 
+def load_prefix_index():
+    """每日 × 分類 前綴和索引 (任意日期區間合計只需兩次查表)，資料變動時才重建"""
+    return _load_prefix_index(store.version())
+
+
+@st.cache_resource
+def get_local_parser():
+    # 以既有紀錄學習 品項 → 分類，之後每次新增再增量學習
+    return LocalParser(store.load())
+
+
+def parse_expense_text(text):
+    """先用本機規則解析 (免連網)，信心度不足才呼叫 Gemini"""
+    local_result = get_local_parser().parse(text)
+    if local_result["confidence"] >= CONFIDENCE_THRESHOLD:
+        return local_result
+    return parse_item_amount_gemini(text)
+
+
+def parse_expense_batch(text):
+    """
+    批次解析多筆支出：每段都能由本機解析就不呼叫 Gemini，
+    否則整段文字只發一次 Gemini 請求
+    """
+    local_results = [get_local_parser().parse(seg) for seg in split_entries(text)]
+    if local_results and all(r["confidence"] >= CONFIDENCE_THRESHOLD for r in local_results):
+        return {"items": local_results, "source": "local"}
+    return parse_items_batch_gemini(text)
+
+
+def voice_to_record(audio_data, combined=True):
+    """
+    錄音 (WAV bytes) → {"transcript", "item", "amount", "category", "mode"}，失敗時含 "error"
+    combined 時一次呼叫完成聽打 + 解析；失敗才退回 STT → parse_expense_text 兩段式
+    """
+    if combined:
+        result = voice_to_record_gemini(audio_data, "audio/wav")
+        if not result.get("error"):
+            return dict(result, mode="一次呼叫")
+
+    transcript, error = transcribe_audio_gemini(audio_data, "audio/wav")
     if error:
-        return {"item": "", "amount": 0, "error": error}
-    
-    try:
-        raw = response.text.strip()
-        cleaned = (
-            raw.replace("```json", "")
-               .replace("```", "")
-               .replace("'", '"')
-               .strip()
-        )
-        return json.loads(cleaned)
-    except Exception as e:
-        return {"item": "", "amount": 0, "error": f"JSON Parsing Error: {str(e)}"}
+        return {"transcript": "", "error": error}
+    if not transcript:
+        return {"transcript": "", "error": "沒有聽到任何內容"}
+    return dict(parse_expense_text(transcript), transcript=transcript, mode="聽打 + 解析")
+
+
+def save_record(record):
+    """新增一筆支出並讓本機解析器學習這筆的分類"""
+    store.add(record)
+    get_local_parser().learn_one(record)
+
+
+def receipt_rows(file_name, result, cached=False):
+    """把一張照片的辨識結果 (單筆或逐項明細) 轉成確認表的列；cached 表示沿用先前的辨識結果"""
+    error = result.get("error")
+    lines = [] if error else (result["items"] if "items" in result else [result])
+    if not lines:
+        # 辨識失敗或沒有任何品項：留一列說明 (預設不新增)，確認表才看得到這張照片
+        return [{
+            "新增": False, "檔案": file_name, "品項": "", "分類": "其他", "金額": 0,
+            "日期": str(date.today()), "備註": "[掃描辨識]", "狀態": f"❌ {error or '沒有辨識出任何品項'}"
+        }]
+
+    rows = []
+    for line in lines:
+        receipt_note = f" 收據{line['receipt']}" if line.get("receipt") else ""
+        rows.append({
+            "新增": True,
+            "檔案": file_name,
+            "品項": line.get("item", ""),
+            "分類": line.get("category") if line.get("category") in CATEGORIES else "其他",
+            "金額": to_amount(line.get("amount", 0)),
+            "日期": line.get("date") or str(date.today()),
+            "備註": f"[掃描辨識{receipt_note}]",
+            "狀態": "♻️ 沿用先前辨識" if cached else "✅"
+        })
+    return rows
+
+
+def flag_duplicate_rows(scan_df):
+    """確認表中與既有紀錄「同日期、同金額」的列標示為可能重複，並預設不新增"""
+    candidates = scan_df["新增"].astype(bool)
+    if not candidates.any():
+        return scan_df
+    dates = pd.to_datetime(scan_df["日期"])
+    existing = load_records_df(str(dates.min().date()), str((dates.max() + timedelta(days=1)).date()),
+                               columns=["日期", "金額"])
+    seen = set(zip(existing["日期"].dt.date, existing["金額"]))
+
+    duplicate = candidates & pd.Series(
+        [(d.date(), to_amount(a)) in seen for d, a in zip(dates, scan_df["金額"])],
+        index=scan_df.index
+    )
+    scan_df.loc[duplicate, "新增"] = False
+    scan_df.loc[duplicate, "狀態"] = "⚠️ 可能重複（已有同日同金額紀錄）"
+    return scan_df
+
+
+def save_records(records):
+    """一次寫入多筆支出 (單次儲存操作)"""
+    store.add_many(records)
+    get_local_parser().learn(records)
 
 
 # ----------------------------------------------------------
@@ -148,6 +233,34 @@ with st.sidebar:
     )
     
     st.markdown("---")
+
+    # API Key 用量監控 (剩餘 RPM / RPD 額度與冷卻狀態)
+    with st.expander("🔑 API Key 狀態", expanded=False):
+        pool = get_pool()
+        if pool.keys:
+            df_keys = pd.DataFrame(pool.bucket_levels()).merge(pd.DataFrame(pool.status()), on="key")
+            df_keys["key"] = [f"Key {i + 1}" for i in df_keys["key"]]
+            df_keys["cooldown"] = df_keys["cooldown"].round(0)
+            st.dataframe(df_keys, hide_index=True, use_container_width=True)
+        else:
+            st.caption("未設定任何 API Key")
+
+    # 對話式記帳解析結果快取 (命中時不需呼叫 Gemini)
+    with st.expander("⚡ 解析快取", expanded=False):
+        cache_stats = get_parse_cache().stats()
+        st.caption(
+            f"命中率 {cache_stats['hit_rate']:.0%}｜記憶體命中 {cache_stats['memory_hits']}｜"
+            f"磁碟命中 {cache_stats['disk_hits']}｜未命中 {cache_stats['misses']}"
+        )
+        scan_stats = get_scan_cache().stats()
+        st.caption(f"收據快取命中 {scan_stats['hits']}｜未命中 {scan_stats['misses']}")
+        structured_stats = parse_stats.stats()
+        st.caption(
+            f"結構化輸出 {structured_stats['requests']} 次｜"
+            f"首次解析失敗率 {structured_stats['first_try_failure_rate']:.1%}｜"
+            f"重試後仍失敗 {structured_stats['failure_rate']:.1%}"
+        )
+
     st.caption("AI 記帳工具 v1.2KL")
 
 
@@ -160,31 +273,17 @@ with st.sidebar:
 # ----------------------------------------------------------
 if selected_page == "總覽&記帳":
     # --- 計算並顯示 本週/本月 總開銷 ---
-    with open(DATA_PATH, "r", encoding="utf-8") as f:
-        records_overview = json.load(f)
-    
-    total_week = 0
-    total_month = 0
-    
-    if records_overview:
-        df_ov = pd.DataFrame(records_overview)
-        df_ov["日期"] = pd.to_datetime(df_ov["日期"])
-        # 確保金額是數字
-        df_ov["金額"] = pd.to_numeric(df_ov["金額"], errors='coerce').fillna(0)
-        
-        today = pd.Timestamp(date.today())
-        start_of_week = today - timedelta(days=7)
-        start_of_month = today.replace(day=1) # 簡單用當月1號
-        
-        # 本週 (近7天)
-        total_week = df_ov[df_ov["日期"] >= start_of_week]["金額"].sum()
-        
-        # 本月 (這個月)
-        # 注意：這裡使用 "與今天同一月份" 的邏輯
-        total_month = df_ov[
-            (df_ov["日期"].dt.year == today.year) & 
-            (df_ov["日期"].dt.month == today.month)
-        ]["金額"].sum()
+    # 直接讀取儲存層維護的 日 / 月 × 分類 彙總，不需掃描紀錄
+    today = date.today()
+    start_of_week = today - timedelta(days=7)
+
+    # 本週 (近7天)
+    total_week = sum(store.category_totals(start=str(start_of_week)).values())
+
+    # 本月 (這個月) 各分類實際花費
+    # 注意：這裡使用 "與今天同一月份" 的邏輯
+    actual_spend = store.month_category_totals(today.strftime("%Y-%m"))
+    total_month = sum(actual_spend.values())
 
     st.header("💲近期總覽")
     
@@ -198,25 +297,11 @@ if selected_page == "總覽&記帳":
 
     with col_budget_table:
         # 讀取預算並製作比較表
-        if os.path.exists(BUDGET_PATH):
-            with open(BUDGET_PATH, "r", encoding="utf-8") as f:
-                budget_data = json.load(f)
-        else:
-            budget_data = {}
-
-        if records_overview:
-            # 計算本月各分類實際花費 (已經在上面濾出 df_ov，但需要精確過濾本月)
-            df_this_month = df_ov[
-                (df_ov["日期"].dt.year == today.year) & 
-                (df_ov["日期"].dt.month == today.month)
-            ]
-            actual_spend = df_this_month.groupby("分類")["金額"].sum().to_dict()
-        else:
-            actual_spend = {}
+        budget_data = store.load_budget()
 
         # 整合資料
         comparison_list = []
-        categories_list = ["餐飲食品", "交通運輸", "居家生活", "服飾購物", "休閒娛樂", "醫療保健", "投資儲蓄", "其他"]
+        categories_list = CATEGORIES
         
         for cat in categories_list:
             budget = budget_data.get(cat, 5000) # 若沒設定預設 5000 (但顯示時可標註未設)
@@ -259,52 +344,124 @@ if selected_page == "總覽&記帳":
     # 對話式記帳（Gemini）
     # ------------------------------------------------------
     with add_tabs[0]:
-        st.write("輸入一句自然語言描述，我會自動解析品項與金額")
+        batch_mode = st.toggle("📋 批次模式（一次輸入多筆）", key="batch_mode")
 
-        user_text = st.text_area(
-            "請輸入：",
-            placeholder="例如：我買了珍奶50元",
-            height=100
-        )
+        if batch_mode:
+            st.write("一次輸入多筆消費（可用換行、頓號或逗號分隔），只需一次解析即可全部新增")
 
-        if st.button("解析並新增", type="primary"):
-            if user_text.strip() == "":
-                st.error("❌ 請輸入描述文字")
-            else:
-                result = parse_item_amount_gemini(user_text)
+            batch_text = st.text_area(
+                "請輸入：",
+                placeholder="例如：早餐 45、捷運 25、午餐 80、手搖 55",
+                height=120,
+                key="batch_text"
+            )
 
-                if "error" in result and result["error"]:
-                    st.error(f"AI 解析失敗：{result['error']}")
+            if st.button("解析全部", type="primary"):
+                if batch_text.strip() == "":
+                    st.error("❌ 請輸入描述文字")
                 else:
-                    item = result.get("item", "")
-                    amount = result.get("amount", 0)
+                    batch_result = parse_expense_batch(batch_text)
+                    if batch_result.get("error"):
+                        st.error(f"AI 解析失敗：{batch_result['error']}")
+                    elif not batch_result["items"]:
+                        st.warning("沒有解析出任何消費")
+                    else:
+                        st.session_state["batch_items"] = pd.DataFrame([
+                            {
+                                "品項": r.get("item", ""),
+                                "分類": r.get("category") if r.get("category") in CATEGORIES else "其他",
+                                "金額": to_amount(r.get("amount", 0)),
+                                "日期": date.today(),
+                                "備註": "[批次輸入]"
+                            }
+                            for r in batch_result["items"]
+                        ])
+
+            # 預覽並可直接修改，確認後一次寫入
+            if st.session_state.get("batch_items") is not None:
+                st.caption("請確認解析結果，可直接在表格中修改或刪除列")
+                edited_batch = st.data_editor(
+                    st.session_state["batch_items"],
+                    num_rows="dynamic",
+                    use_container_width=True,
+                    hide_index=True,
+                    column_config={
+                        "分類": st.column_config.SelectboxColumn("分類", options=CATEGORIES, required=True),
+                        "金額": st.column_config.NumberColumn("金額", min_value=0),
+                        "日期": st.column_config.DateColumn("日期", format="YYYY-MM-DD"),
+                    },
+                    key="batch_editor"
+                )
 
-                    with open(DATA_PATH, "r", encoding="utf-8") as f:
-                        records = json.load(f)
+                # 品項空白的列 (表格新增後沒填) 不存
+                batch_rows = edited_batch[edited_batch["品項"].fillna("").astype(str).str.strip() != ""]
 
-                    category_ai = result.get("category", "其他")
+                if st.button(f"💾 全部新增（{len(batch_rows)} 筆）", type="primary", disabled=batch_rows.empty):
+                    new_records = [
+                        {
+                            "品項": row["品項"],
+                            "分類": row["分類"],
+                            "金額": to_amount(row["金額"]),
+                            # 表格新增的列可能沒填日期 / 備註
+                            "日期": pd.Timestamp(row["日期"]).strftime("%Y-%m-%d") if pd.notna(row["日期"]) else str(date.today()),
+                            "備註": row["備註"] if isinstance(row["備註"], str) else ""
+                        }
+                        for row in batch_rows.to_dict("records")
+                    ]
+                    save_records(new_records)
+                    del st.session_state["batch_items"]
+                    st.success(f"✅ 已新增 {len(new_records)} 筆支出！")
+                    st.rerun()
 
-                    new_record = {
-                        "品項": item,
-                        "分類": category_ai,
-                        "金額": amount,
-                        "日期": str(date.today()),
-                        "備註": user_text
-                    }
+        else:
+            st.write("輸入一句自然語言描述，我會自動解析品項與金額")
 
-                    records.append(new_record)
+            user_text = st.text_area(
+                "請輸入：",
+                placeholder="例如：我買了珍奶50元",
+                height=100
+            )
+
+            if st.button("解析並新增", type="primary"):
+                if user_text.strip() == "":
+                    st.error("❌ 請輸入描述文字")
+                else:
+                    result = parse_expense_text(user_text)
 
-                    with open(DATA_PATH, "w", encoding="utf-8") as f:
-                        json.dump(records, f, ensure_ascii=False, indent=4)
+                    if "error" in result and result["error"]:
+                        st.error(f"AI 解析失敗：{result['error']}")
+                    else:
+                        item = result.get("item", "")
+                        amount = result.get("amount", 0)
+
+                        category_ai = result.get("category", "其他")
 
-                    st.success(f"新增成功：{item} - {amount} 元")
+                        new_record = {
+                            "品項": item,
+                            "分類": category_ai,
+                            "金額": amount,
+                            "日期": str(date.today()),
+                            "備註": user_text
+                        }
+
+                        save_record(new_record)
+
+                        source_note = "（本機解析）" if result.get("source") == "local" else ""
+                        st.success(f"新增成功：{item} - {amount} 元{source_note}")
 
     # ------------------------------------------------------
     # 手動輸入
     # ------------------------------------------------------
     with add_tabs[1]:
         item_name = st.text_input("品項名稱（例如：珍奶 / 公車票 / 優格）")
-        category = st.selectbox("分類", ["餐飲食品", "交通運輸", "居家生活", "服飾購物", "休閒娛樂", "醫療保健", "投資儲蓄", "其他"])
+        # 依品項名稱由本機分類器建議預設分類
+        suggested_category = get_local_parser().suggest_category(item_name)
+        category = st.selectbox(
+            "分類",
+            CATEGORIES,
+            index=CATEGORIES.index(suggested_category) if suggested_category in CATEGORIES else 0,
+            help="已依品項名稱自動建議分類，可自行修改"
+        )
         amount = st.number_input("金額（NT$）", min_value=0, value=0)
         date_input = st.date_input("日期", value=date.today())
         note = st.text_input("備註", "")
@@ -313,9 +470,6 @@ if selected_page == "總覽&記帳":
             if item_name.strip() == "":
                 st.error("❌ 請輸入品項名稱")
             else:
-                with open(DATA_PATH, "r", encoding="utf-8") as f:
-                    records = json.load(f)
-
                 new_record = {
                     "品項": item_name,
                     "分類": category,
@@ -324,10 +478,7 @@ if selected_page == "總覽&記帳":
                     "備註": note
                 }
 
-                records.append(new_record)
-
-                with open(DATA_PATH, "w", encoding="utf-8") as f:
-                    json.dump(records, f, ensure_ascii=False, indent=4)
+                save_record(new_record)
 
                 st.success("✅ 成功新增支出！")
 
@@ -337,6 +488,12 @@ if selected_page == "總覽&記帳":
     with add_tabs[2]:
         st.write("🎙️ 請點擊下方按鈕開始錄音，說完後再點一次結束")
         
+        combined_voice = st.toggle(
+            "⚡ 一次完成聽打與解析（較快、省額度；失敗時自動改用聽打 + 解析兩段式）",
+            value=True,
+            key="voice_combined"
+        )
+
         audio = audiorecorder("按此開始錄音", "錄音中...按此結束")
 
         if len(audio) > 0:
@@ -344,83 +501,68 @@ if selected_page == "總覽&記帳":
             
             # 使用 spinner 顯示處理中
             with st.spinner("AI 正在分析您的語音..."):
-                # 1. 將音訊存檔
-                timestamp = int(datetime.now().timestamp())
-                temp_filename = f"temp_voice_{timestamp}.mp3"
-                audio.export(temp_filename, format="mp3")
-
+                voice_start = time.perf_counter()
                 try:
-                    # 2. 呼叫 Gemini 進行語音轉文字 (STT) + 理解 (使用自動輪替)
-                    with open(temp_filename, "rb") as audio_file:
-                        audio_data = audio_file.read()
+                    # 1. 在記憶體中前處理：去頭尾靜音、轉單聲道 16 kHz，再包成 WAV (不寫暫存檔)
+                    audio_data, audio_stats = preprocess_segment(audio)
+
+                    # 2. 呼叫 Gemini 聽打 + 解析；同一段錄音 (例如按下確認後重跑) 不重複呼叫
+                    voice_key = (hashlib.sha1(audio_data).hexdigest(), combined_voice)
+                    if st.session_state.get("voice_key") != voice_key:
+                        result = voice_to_record(audio_data, combined_voice)
+                        if not result.get("error"):
+                            st.session_state["voice_key"] = voice_key
+                            st.session_state["voice_result"] = result
+                    else:
+                        result = st.session_state["voice_result"]
 
-                    stt_prompt = "請準確聽打這段錄音的內容，直接輸出繁體中文文字，不要任何其他說明。"
-                    
-                    # 使用輪替函式
-                    response_stt, error = call_gemini_rotated(
-                        model_name="gemini-2.5-flash",
-                        contents=[
-                            stt_prompt,
-                            types.Part.from_bytes(data=audio_data, mime_type="audio/mp3")
-                        ]
-                    )
+                    transcribed_text = result.get("transcript", "")
+                    if transcribed_text:
+                        st.info(f"👂 AI 聽到： **「{transcribed_text}」**")
 
-                    if error:
-                         st.error(f"語音處理失敗：{error}")
-                         if os.path.exists(temp_filename):
-                             os.remove(temp_filename)
+                    # 3. 顯示解析結果
+                    if "error" in result and result["error"]:
+                        st.error(f"語音處理失敗：{result['error']}")
                     else:
-                        transcribed_text = response_stt.text.strip()
-                        st.info(f"👂 AI 聽到： **「{transcribed_text}」**")
+                        st.caption(
+                            f"上傳音訊 {audio_stats['original_bytes'] / 1024:.0f} KB → {audio_stats['bytes'] / 1024:.0f} KB"
+                            f"（省 {audio_stats['saved_ratio']:.0%}，{audio_stats['original_seconds']:.1f} 秒 → "
+                            f"{audio_stats['seconds']:.1f} 秒）｜前處理 {audio_stats['elapsed_ms']:.0f} ms｜"
+                            f"{result.get('mode', '')} 總耗時 {time.perf_counter() - voice_start:.1f} 秒"
+                        )
 
-                    # 3. 解析內容
-                    if transcribed_text:
-                        result = parse_item_amount_gemini(transcribed_text)
+                        item = result.get("item", "")
+                        amount = result.get("amount", 0)
+                        cat = result.get("category", "其他")
+
+                        # 顯示預覽
+                        st.markdown(
+                            f"""
+                            <div style="background:#e8f5e9;padding:10px;border-radius:5px;border:1px solid #c8e6c9;">
+                                <b>預覽新增：</b><br>
+                                品項：{item}<br>
+                                分類：{cat}<br>
+                                金額：{amount}
+                            </div>
+                            """, 
+                            unsafe_allow_html=True
+                        )
                         
-                        if "error" in result and result["error"]:
-                            st.error(f"解析失敗：{result['error']}")
-                        else:
-                            item = result.get("item", "")
-                            amount = result.get("amount", 0)
-                            cat = result.get("category", "其他")
-
-                            # 顯示預覽
-                            st.markdown(
-                                f"""
-                                <div style="background:#e8f5e9;padding:10px;border-radius:5px;border:1px solid #c8e6c9;">
-                                    <b>預覽新增：</b><br>
-                                    品項：{item}<br>
-                                    分類：{cat}<br>
-                                    金額：{amount}
-                                </div>
-                                """, 
-                                unsafe_allow_html=True
-                            )
+                        if st.button("✅ 確認並新增此筆支出", key="confirm_voice_add"):
+                            new_record = {
+                                "品項": item,
+                                "分類": cat,
+                                "金額": amount,
+                                "日期": str(date.today()),
+                                "備註": f"[語音] {transcribed_text}"
+                            }
+                            save_record(new_record)
                             
-                            if st.button("✅ 確認並新增此筆支出", key="confirm_voice_add"):
-                                with open(DATA_PATH, "r", encoding="utf-8") as f:
-                                    records = json.load(f)
-
-                                new_record = {
-                                    "品項": item,
-                                    "分類": cat,
-                                    "金額": amount,
-                                    "日期": str(date.today()),
-                                    "備註": f"[語音] {transcribed_text}"
-                                }
-                                records.append(new_record)
-                                
-                                with open(DATA_PATH, "w", encoding="utf-8") as f:
-                                    json.dump(records, f, ensure_ascii=False, indent=4)
-                                
-                                st.success("已儲存！")
-                                os.remove(temp_filename)
-                                st.rerun()
+                            st.success("已儲存！")
+                            st.rerun()
 
                 except Exception as e:
                     st.error(f"語音處理失敗：{e}")
-                    if os.path.exists(temp_filename):
-                        os.remove(temp_filename)
 
 
     # ------------------------------------------------------
@@ -428,111 +570,155 @@ if selected_page == "總覽&記帳":
     # ------------------------------------------------------
     with add_tabs[3]:
         st.write("📷 上傳發票或收據照片，AI 自動辨識內容")
-        
-        uploaded_file = st.file_uploader("選擇照片...", type=["jpg", "jpeg", "png"])
-        
-        if uploaded_file is not None:
+
+        line_item_mode = st.toggle(
+            "🧾 逐項明細模式（每個品項各記一筆，一張照片可含多張收據）",
+            key="scan_line_item_mode"
+        )
+
+        with st.expander("⚙️ 圖片壓縮設定（送出辨識前縮圖並重新壓縮）", expanded=False):
+            img_col1, img_col2 = st.columns(2)
+            with img_col1:
+                scan_max_edge = st.slider("長邊最大像素", 800, 3200, RECEIPT_MAX_EDGE, step=100, key="scan_max_edge")
+                scan_format = st.selectbox("壓縮格式", list(IMAGE_FORMATS), key="scan_format")
+            with img_col2:
+                scan_quality = st.slider("壓縮品質", 40, 95, RECEIPT_QUALITY, step=5, key="scan_quality")
+                scan_grayscale = st.checkbox("轉為灰階", value=False, key="scan_grayscale")
+
+        uploaded_files = st.file_uploader(
+            "選擇照片（可多選，會同時辨識）...",
+            type=["jpg", "jpeg", "png"],
+            accept_multiple_files=True,
+            key="scan_files"
+        )
+
+        if uploaded_files:
             # 顯示圖片預覽
-            st.image(uploaded_file, caption="上傳的圖片", width=300)
-            
-            if st.button("🚀 開始辨識"):
-                with st.spinner("AI 正在仔細看這張圖..."):
-                    try:
-                        # 讀取圖片 bytes
-                        image_bytes = uploaded_file.getvalue()
-                        
-                        prompt_vision = """
-                        請辨識這張圖片中的收據或發票內容，提取以下資訊：
-                        1. 品項 (Summarize main item or describe the expense. If text is blurry or missing, describe it as "未知品項")
-                        2. 金額 (Total amount, integer only)
-                        3. 日期 (Format: YYYY-MM-DD, if not found use today's date)
-                        4. 分類 (Choose from: 餐飲食品, 交通運輸, 居家生活, 服飾購物, 休閒娛樂, 醫療保健, 投資儲蓄, 其他)
-                        
-                        ⚠️ Important: If the item name is missing, unclear, or you are not 100% sure about the category, you MUST set "category" to "其他". Do not guess random categories.
+            st.image(uploaded_files, caption=[f.name for f in uploaded_files], width=150)
 
-                        Output JSON format only:
-                        {
-                            "item": "...",
-                            "amount": 0,
-                            "date": "YYYY-MM-DD",
-                            "category": "..."
-                        }
-                        """
-                        
-                        # 呼叫輪替機制 (支援傳入 Part 物件)
-                        response_vision, error = call_gemini_rotated(
-                            model_name="gemini-2.5-flash",
-                            contents=[
-                                prompt_vision,
-                                types.Part.from_bytes(data=image_bytes, mime_type=uploaded_file.type)
-                            ]
-                        )
-                        
-                        if error:
-                            st.error(f"辨識失敗：{error}")
-                        else:
-                            # 解析 JSON
-                            raw = response_vision.text.strip()
-                            cleaned = raw.replace("```json", "").replace("```", "").replace("'", '"').strip()
-                            result_json = json.loads(cleaned)
-                            
-                            # 存入 Session State 供確認區塊使用
-                            st.session_state["scan_result"] = result_json
-                            
+            rescan = st.checkbox("略過快取，重新辨識（上次辨識結果不正確時使用）", key="scan_rescan")
+
+            if st.button(f"🚀 開始辨識（{len(uploaded_files)} 張）"):
+                scan_cache = get_scan_cache()
+                scan_kind = "line_items" if line_item_mode else "receipt"
+                rows_by_image = [None] * len(uploaded_files)
+                hashes = [None] * len(uploaded_files)
+                for i, f in enumerate(uploaded_files):
+                    try:
+                        hashes[i] = dhash(f.getvalue())
                     except Exception as e:
-                        st.error(f"發生錯誤：{e}")
+                        # 損毀或不是圖片的檔案：這張顯示錯誤，其他照片照常辨識
+                        rows_by_image[i] = receipt_rows(f.name, {"error": f"無法讀取圖片：{e}"})
+
+                # 先查感知雜湊快取：同一張收據重新上傳時直接沿用上次結果，不再呼叫 API
+                pending = []
+                for i, f in enumerate(uploaded_files):
+                    if hashes[i] is None:
+                        continue
+                    cached = None if rescan else scan_cache.get(hashes[i], scan_kind)
+                    # 舊版可能快取過空的明細，當作沒有快取重新辨識
+                    if cached is not None and cached.get("items", True):
+                        rows_by_image[i] = receipt_rows(f.name, cached, cached=True)
+                    else:
+                        pending.append(i)
+
+                # 同一批中重複的照片 (雜湊相近，規則同快取) 只壓縮、辨識一次
+                groups = group_similar_hashes([hashes[i] for i in pending], scan_cache.max_distance)
+                prepared = {}  # 組 → (image_bytes, mime_type) 或錯誤訊息
+                dispatched, images, keys = [], [], []
+                original_bytes = compressed_bytes = 0
+                for i, group in zip(pending, groups):
+                    if group not in prepared:
+                        try:
+                            image_bytes, mime_type, image_stats = preprocess_receipt_image(
+                                uploaded_files[i].getvalue(), uploaded_files[i].type,
+                                max_edge=scan_max_edge, grayscale=scan_grayscale,
+                                image_format=scan_format, quality=scan_quality
+                            )
+                        except Exception as e:
+                            prepared[group] = f"無法讀取圖片：{e}"
+                        else:
+                            prepared[group] = (image_bytes, mime_type)
+                            original_bytes += image_stats["original_bytes"]
+                            compressed_bytes += image_stats["bytes"]
+                    if isinstance(prepared[group], str):
+                        rows_by_image[i] = receipt_rows(uploaded_files[i].name, {"error": prepared[group]})
+                    else:
+                        dispatched.append(i)
+                        images.append(prepared[group])
+                        keys.append(group)
+
+                if dispatched:
+                    st.caption(
+                        f"上傳圖片 {original_bytes / 1024:.0f} KB → {compressed_bytes / 1024:.0f} KB"
+                        f"（省 {1 - compressed_bytes / max(original_bytes, 1):.0%}）｜"
+                        f"沿用快取 {sum(h is not None for h in hashes) - len(pending)} 張｜"
+                        f"重複照片 {len(dispatched) - len(set(keys))} 張"
+                    )
+                    extract = extract_line_items_gemini if line_item_mode else extract_receipt_gemini
+                    progress = st.progress(0.0, text="AI 正在仔細看這些圖...")
+                    live_table = st.empty()
+
+                    # 多張照片同時辨識，依完成順序逐筆顯示，不必等全部辨識完
+                    for done, (j, result) in enumerate(
+                        extract_receipts_concurrently(images, max_workers=SCAN_MAX_WORKERS, extract=extract, keys=keys), 1
+                    ):
+                        i = dispatched[j]
+                        # 失敗或沒有辨識出品項的結果不快取，重新上傳時再辨識一次
+                        if not result.get("error") and result.get("items", True):
+                            scan_cache.set(hashes[i], scan_kind, result)
+                        rows_by_image[i] = receipt_rows(uploaded_files[i].name, result)
+                        progress.progress(done / len(images), text=f"已完成 {done} / {len(images)} 張")
+                        live_table.dataframe(
+                            pd.DataFrame([row for rows in rows_by_image if rows for row in rows]),
+                            use_container_width=True,
+                            hide_index=True
+                        )
 
-        # 顯示確認表單 (若有辨識結果)
-        if "scan_result" in st.session_state and st.session_state["scan_result"]:
-            res = st.session_state["scan_result"]
+                    live_table.empty()
+
+                scan_df = pd.DataFrame([row for rows in rows_by_image for row in rows])
+                if scan_df.empty:
+                    st.warning("沒有辨識出任何品項")
+                else:
+                    scan_df["日期"] = pd.to_datetime(scan_df["日期"], errors="coerce").dt.date.fillna(date.today())
+                    st.session_state["scan_items"] = flag_duplicate_rows(scan_df)
+
+        # 確認表：可直接修改，勾選要新增的列後一次寫入
+        if st.session_state.get("scan_items") is not None:
             st.markdown("---")
             st.subheader("✅ 確認辨識結果")
-            
-            with st.form(key="confirm_scan_form"):
-                col_scan1, col_scan2 = st.columns(2)
-                
-                with col_scan1:
-                    c_item = st.text_input("品項", res.get("item", ""))
-                    c_category = st.selectbox(
-                        "分類",
-                        ["餐飲食品", "交通運輸", "居家生活", "服飾購物", "休閒娛樂", "醫療保健", "投資儲蓄", "其他"],
-                        index=["餐飲食品", "交通運輸", "居家生活", "服飾購物", "休閒娛樂", "醫療保健", "投資儲蓄", "其他"]
-                        .index(res.get("category", "其他")) if res.get("category") in ["餐飲食品", "交通運輸", "居家生活", "服飾購物", "休閒娛樂", "醫療保健", "投資儲蓄", "其他"] else 7
-                    )
-                
-                with col_scan2:
-                    c_amount = st.number_input("金額", value=int(res.get("amount", 0)))
-                    
-                    # 日期處理 (防呆)
-                    try:
-                        def_date = datetime.strptime(res.get("date", str(date.today())), "%Y-%m-%d").date()
-                    except:
-                        def_date = date.today()
-                        
-                    c_date = st.date_input("日期", value=def_date)
-
-                submit_scan = st.form_submit_button("💾 確認並新增", type="primary")
-                
-                if submit_scan:
-                    with open(DATA_PATH, "r", encoding="utf-8") as f:
-                        records = json.load(f)
-                        
-                    new_record = {
-                        "品項": c_item,
-                        "分類": c_category,
-                        "金額": int(c_amount),
-                        "日期": str(c_date),
-                        "備註": "[掃描辨識]"
+            edited_scan = st.data_editor(
+                st.session_state["scan_items"],
+                use_container_width=True,
+                hide_index=True,
+                num_rows="dynamic",
+                disabled=["檔案", "狀態"],
+                column_config={
+                    "新增": st.column_config.CheckboxColumn("新增", default=True),
+                    "分類": st.column_config.SelectboxColumn("分類", options=CATEGORIES, required=True),
+                    "金額": st.column_config.NumberColumn("金額", step=1),
+                    "日期": st.column_config.DateColumn("日期", format="YYYY-MM-DD"),
+                },
+                key="scan_editor"
+            )
+            approved = edited_scan[edited_scan["新增"].fillna(False).astype(bool)].dropna(subset=["品項"])
+
+            if st.button(f"💾 確認並新增（{len(approved)} 筆）", type="primary", disabled=approved.empty):
+                save_records([
+                    {
+                        "品項": row["品項"],
+                        "分類": row["分類"],
+                        "金額": to_amount(row["金額"]),
+                        "日期": pd.Timestamp(row["日期"]).strftime("%Y-%m-%d") if pd.notna(row["日期"]) else str(date.today()),
+                        "備註": row["備註"] if isinstance(row["備註"], str) else "[掃描辨識]"
                     }
-                    records.append(new_record)
-                    
-                    with open(DATA_PATH, "w", encoding="utf-8") as f:
-                         json.dump(records, f, ensure_ascii=False, indent=4)
-                    
-                    st.success("已儲存！")
-                    # 清除狀態並重整
-                    del st.session_state["scan_result"]
-                    st.rerun()
+                    for row in approved.to_dict("records")
+                ])
+                st.success(f"已儲存 {len(approved)} 筆！")
+                # 清除狀態並重整
+                del st.session_state["scan_items"]
+                st.rerun()
 
     # ------------------------------------------------------
     # 預算設定 (Budget Settings)
@@ -541,34 +727,39 @@ if selected_page == "總覽&記帳":
         st.subheader("⚙️ 各分類每月預算設定")
         st.write("請拖曳滑桿設定每個分類的預算上限 (0 ~ 20,000)")
 
-        # 讀取預算檔
-        if os.path.exists(BUDGET_PATH):
-            with open(BUDGET_PATH, "r", encoding="utf-8") as f:
-                budget_data = json.load(f)
-        else:
-            budget_data = {}
+        # 讀取預算檔，並記下使用者第一次看到的內容 (同記錄管理的 edit_base)：
+        # 只在儲存成功或衝突時更新，儲存時若檔案已與此不同 (其他視窗改過) 就提示，不直接覆蓋
+        slider_keys = {cat: f"budget_slider_{cat}" for cat in CATEGORIES}
+        if "budget_base" not in st.session_state or slider_keys[CATEGORIES[0]] not in st.session_state:
+            st.session_state["budget_base"] = store.load_budget()
+            # 滑桿以 key 保存使用者調整的值，重新執行時不會被檔案內容蓋掉
+            for cat, key in slider_keys.items():
+                st.session_state[key] = int(st.session_state["budget_base"].get(cat, 5000)) # 預設 5000
 
-        categories_list = ["餐飲食品", "交通運輸", "居家生活", "服飾購物", "休閒娛樂", "醫療保健", "投資儲蓄", "其他"]
+        categories_list = CATEGORIES
         new_budget_data = {}
         
         # 建立 2 欄排列
         b_col1, b_col2 = st.columns(2)
         
         for i, cat in enumerate(categories_list):
-            current_val = budget_data.get(cat, 5000) # 預設 5000
-            
             # 分左右欄放
             target_col = b_col1 if i % 2 == 0 else b_col2
             
             with target_col:
-                val = st.slider(f"📌 {cat}", 0, 20000, int(current_val), step=100)
+                val = st.slider(f"📌 {cat}", 0, 20000, step=100, key=slider_keys[cat])
                 new_budget_data[cat] = val
 
         st.markdown("---")
         if st.button("💾 儲存預算設定", type="primary"):
-            with open(BUDGET_PATH, "w", encoding="utf-8") as f:
-                json.dump(new_budget_data, f, ensure_ascii=False, indent=4)
-            st.success("✅ 預算設定已儲存！")
+            try:
+                store.save_budget(new_budget_data, expected=st.session_state["budget_base"])
+                st.session_state["budget_base"] = new_budget_data
+                st.success("✅ 預算設定已儲存！")
+            except ConflictError:
+                # 以目前檔案內容為基準，滑桿保留使用者的值，再按一次儲存即會覆蓋
+                st.session_state["budget_base"] = store.load_budget()
+                st.warning("⚠️ 預算設定已在其他視窗被修改，請確認後再按一次儲存")
 
 
 # ----------------------------------------------------------
@@ -577,30 +768,19 @@ if selected_page == "總覽&記帳":
 elif selected_page == "支出記錄":
     st.header("📋 支出記錄")
 
-    with open(DATA_PATH, "r", encoding="utf-8") as f:
-        records = json.load(f)
+    # 取得所有出現過的月份 (降序排列)
+    available_months = store.months()
 
-    if len(records) == 0:
+    if len(available_months) == 0:
         st.info("目前沒有任何支出紀錄")
     else:
-        df = pd.DataFrame(records)
-        
-        # 轉換日期格式以便處理
-        df["日期"] = pd.to_datetime(df["日期"])
-        
-        # 建立「年月」欄位用來篩選
-        df["Month"] = df["日期"].dt.strftime("%Y-%m")
-        
-        # 取得所有出現過的月份 (降序排列)
-        available_months = sorted(df["Month"].unique().tolist(), reverse=True)
-        
         col1, col2 = st.columns([1, 3])
         with col1:
              # 下拉選單
             selected_month = st.selectbox("請選擇月份", available_months)
         
-        # 篩選資料
-        filtered_df = df[df["Month"] == selected_month].drop(columns=["Month"]).sort_values("日期", ascending=False)
+        # 只讀取選定月份的資料
+        filtered_df = load_records_df(*month_range(selected_month)).sort_values("日期", ascending=False)
         
         st.write(f"顯示 **{selected_month}** 的支出細項，共 {len(filtered_df)} 筆：")
         st.dataframe(filtered_df, use_container_width=True)
@@ -611,29 +791,20 @@ elif selected_page == "支出記錄":
 elif selected_page == "記錄管理":
     st.header("🛠️ 記錄管理（查詢 / 修改 / 刪除）")
 
-    with open(DATA_PATH, "r", encoding="utf-8") as f:
-        records = json.load(f)
+    all_months = store.months()
 
-    if not records:
+    if not all_months:
         st.info("目前沒有任何支出紀錄")
     else:
-        # 1. 為了能修改原始資料，我們需要知道每筆資料在原始 list 中的 index
-        #    因此先將 records 加上 index 資訊打包成 DataFrame
-        #    順便處理日期格式
-        df_all = pd.DataFrame(records)
-        df_all["original_index"] = df_all.index
-        df_all["日期_dt"] = pd.to_datetime(df_all["日期"])
-        df_all["Month"] = df_all["日期_dt"].dt.strftime("%Y-%m")
-
-        # 2. 建立月份篩選器
-        all_months = sorted(df_all["Month"].unique().tolist(), reverse=True)
+        # 1. 建立月份篩選器
         col_filter1, col_filter2 = st.columns([1, 2])
         
         with col_filter1:
             selected_month_manage = st.selectbox("📅 篩選月份", all_months, key="manage_month")
         
-        # 根據月份篩選資料
-        df_filtered = df_all[df_all["Month"] == selected_month_manage].sort_values("日期", ascending=False)
+        # 2. 只讀取該月份資料，並帶出每筆的 id (key 欄位，儲存層用來定位修改 / 刪除)
+        df_filtered = load_records_df(*month_range(selected_month_manage), keyed=True)
+        df_filtered = df_filtered.sort_values("日期", ascending=False)
 
         # 3. 顯示該月列表 (只讀瀏覽用)
         with col_filter2:
@@ -651,26 +822,36 @@ elif selected_page == "記錄管理":
         if df_filtered.empty:
             st.info("本月無資料可編輯")
         else:
-            # 製作選單的選項 list: (original_index, 顯示文字)
-            # 使用 format_func 讓使用者看到易讀的字串，但程式拿回 original_index
-            
-            # 建立一個選項對應字典
-            options_dict = {}
-            for idx, row in df_filtered.iterrows():
-                # 顯示格式： [日期] 品項 ($金額) - 備註
-                label = f"[{row['日期']}] {row['品項']} (${row['金額']}) - {row['備註']}"
-                options_dict[row['original_index']] = label
+            # 選單選項 {id: 顯示文字}，整欄一次組字串 (不逐列 iterrows)
+            # 顯示格式： [日期] 品項 ($金額) - 備註
+            labels = (
+                "[" + df_filtered["日期"].dt.strftime("%Y-%m-%d") + "] "
+                + df_filtered["品項"].astype(str)
+                + " ($" + df_filtered["金額"].map("{:,.0f}".format) + ") - "
+                + df_filtered["備註"].astype(str)
+            )
+            options_dict = dict(zip(df_filtered["key"], labels))
             
-            # 讓使用者選擇
-            selected_idx = st.selectbox(
+            # 讓使用者選擇；程式拿回的是紀錄的 id
+            selected_id = st.selectbox(
                 "👇 請選擇要編輯的消費紀錄：",
                 options=list(options_dict.keys()),
                 format_func=lambda x: options_dict[x]
             )
 
             # 5. 顯示編輯表單
-            if selected_idx is not None:
-                record_to_edit = records[selected_idx]
+            if selected_id is not None:
+                # 以 id 取得紀錄，並記下第一次顯示的內容 (同預算的 budget_base)：
+                # 按下儲存 / 刪除的那次重新執行時，若檔案中的內容已與此不同 (其他視窗改過) 就不執行
+                edit_base = st.session_state.get("edit_base")
+                if edit_base is None or edit_base[0] != selected_id:
+                    try:
+                        edit_base = (selected_id, store.get(selected_id))
+                    except KeyError:
+                        st.error("⚠️ 這筆紀錄已在其他視窗被刪除，請重新整理頁面")
+                        st.stop()
+                    st.session_state["edit_base"] = edit_base
+                record_to_edit = edit_base[1]
                 
                 with st.form(key="edit_form"):
                     col_edit1, col_edit2 = st.columns(2)
@@ -685,11 +866,11 @@ elif selected_page == "記錄管理":
                         )
                     
                     with col_edit2:
-                        new_amount = st.number_input("金額", value=int(record_to_edit["金額"]))
+                        new_amount = st.number_input("金額", value=int(to_amount(record_to_edit["金額"])))
                         # 日期處理
-                        curr_date = datetime.strptime(record_to_edit["日期"], "%Y-%m-%d").date()
+                        curr_date = date.fromisoformat(record_to_edit["日期"][:10])
                         new_date = st.date_input("日期", value=curr_date)
-                        new_note = st.text_input("備註", record_to_edit["備註"])
+                        new_note = st.text_input("備註", record_to_edit.get("備註", ""))
 
                     # 按鈕區
                     col_btn1, col_btn2 = st.columns([1, 1])
@@ -700,27 +881,34 @@ elif selected_page == "記錄管理":
 
                 # 處理儲存
                 if submit_update:
-                    records[selected_idx] = {
-                        "品項": new_name,
-                        "分類": new_category,
-                        "金額": int(new_amount),
-                        "日期": str(new_date),
-                        "備註": new_note
-                    }
-                    with open(DATA_PATH, "w", encoding="utf-8") as f:
-                        json.dump(records, f, ensure_ascii=False, indent=4)
-                    st.success("✅ 修改已儲存！")
-                    st.rerun()
+                    try:
+                        store.update(selected_id, {
+                            "品項": new_name,
+                            "分類": new_category,
+                            "金額": int(new_amount),
+                            "日期": str(new_date),
+                            "備註": new_note
+                        }, expected=record_to_edit)
+                        st.session_state.pop("edit_base", None)
+                        st.success("✅ 修改已儲存！")
+                        st.rerun()
+                    except (ConflictError, KeyError):
+                        # 下次重新執行時改以檔案中的最新內容顯示
+                        st.session_state.pop("edit_base", None)
+                        st.error("⚠️ 這筆紀錄已在其他視窗被修改或刪除，請重新整理頁面後再試")
 
                 # 刪除區塊 (獨立比較安全)
                 with st.expander("🗑️ 刪除此紀錄", expanded=False):
                     st.warning("確定要刪除這筆紀錄嗎？此動作無法復原。")
                     if st.button("確認刪除", type="primary"):
-                        records.pop(selected_idx)
-                        with open(DATA_PATH, "w", encoding="utf-8") as f:
-                            json.dump(records, f, ensure_ascii=False, indent=4)
-                        st.success("✅ 紀錄已刪除！")
-                        st.rerun()
+                        try:
+                            store.delete(selected_id, expected=record_to_edit)
+                            st.session_state.pop("edit_base", None)
+                            st.success("✅ 紀錄已刪除！")
+                            st.rerun()
+                        except (ConflictError, KeyError):
+                            st.session_state.pop("edit_base", None)
+                            st.error("⚠️ 這筆紀錄已在其他視窗被修改或刪除，請重新整理頁面後再試")
 
 # ----------------------------------------------------------
 # PAGE 4：統計分析
@@ -728,25 +916,21 @@ elif selected_page == "記錄管理":
 elif selected_page == "統計分析":
     st.header("📊 消費情形分析")
 
-    with open(DATA_PATH, "r", encoding="utf-8") as f:
-        records = json.load(f)
-    
-    if not records:
-        st.info("目前沒有資料可供分析")
-    else:
-        df = pd.DataFrame(records)
-        df["日期"] = pd.to_datetime(df["日期"])
-        # 確保金額是數字
-        df["金額"] = pd.to_numeric(df["金額"], errors='coerce').fillna(0)
+    # 定義時間範圍
+    today = date.today()
+    last_30_days = today - timedelta(days=30)
+    last_7_days = today - timedelta(days=7)
 
-        # 定義時間範圍
-        today = pd.Timestamp(date.today())
-        last_30_days = today - timedelta(days=30)
-        last_7_days = today - timedelta(days=7)
+    # 各分類合計直接取自儲存層的每日彙總
+    month_totals = store.category_totals(start=str(last_30_days))
+    week_totals = store.category_totals(start=str(last_7_days))
 
-        # 篩選資料
-        df_month = df[df["日期"] >= last_30_days]
-        df_week = df[df["日期"] >= last_7_days]
+    # 只要有任何紀錄就顯示 (近 7 / 30 天沒有消費時各區塊顯示「無資料」，自訂區間仍可查詢較早的資料)
+    if not store.has_records():
+        st.info("目前沒有資料可供分析")
+    else:
+        month_group = pd.DataFrame(list(month_totals.items()), columns=["分類", "金額"])
+        week_group = pd.DataFrame(list(week_totals.items()), columns=["分類", "金額"])
 
         # 定義樣式函數
         def style_dataframe(df_in):
@@ -766,10 +950,9 @@ elif selected_page == "統計分析":
         col1_week, col2_week = st.columns([2, 3])
         
         with col1_week:
-            if df_week.empty:
+            if week_group.empty:
                 st.write("無資料")
             else:
-                week_group = df_week.groupby("分類")["金額"].sum().reset_index()
                 chart_week = alt.Chart(week_group).mark_arc(innerRadius=60).encode(
                     theta=alt.Theta(field="金額", type="quantitative"),
                     color=alt.Color(field="分類", type="nominal"),
@@ -779,9 +962,9 @@ elif selected_page == "統計分析":
                 st.altair_chart(chart_week, use_container_width=True)
 
         with col2_week:
-            if not df_week.empty:
+            if not week_group.empty:
                 st.markdown("#### 📝 詳細列表")
-                week_group_sorted = df_week.groupby("分類")["金額"].sum().reset_index().sort_values("金額", ascending=False)
+                week_group_sorted = week_group.sort_values("金額", ascending=False)
                 st.dataframe(
                     style_dataframe(week_group_sorted),
                     use_container_width=True,
@@ -796,10 +979,9 @@ elif selected_page == "統計分析":
         col1_month, col2_month = st.columns([2, 3])
 
         with col1_month:
-            if df_month.empty:
+            if month_group.empty:
                 st.write("無資料")
             else:
-                month_group = df_month.groupby("分類")["金額"].sum().reset_index()
                 chart_month = alt.Chart(month_group).mark_arc(innerRadius=60).encode(
                     theta=alt.Theta(field="金額", type="quantitative"),
                     color=alt.Color(field="分類", type="nominal"),
@@ -809,9 +991,9 @@ elif selected_page == "統計分析":
                 st.altair_chart(chart_month, use_container_width=True)
 
         with col2_month:
-            if not df_month.empty:
+            if not month_group.empty:
                 st.markdown("#### 📝 詳細列表")
-                month_group_sorted = df_month.groupby("分類")["金額"].sum().reset_index().sort_values("金額", ascending=False)
+                month_group_sorted = month_group.sort_values("金額", ascending=False)
                 st.dataframe(
                     style_dataframe(month_group_sorted),
                     use_container_width=True,
@@ -819,6 +1001,51 @@ elif selected_page == "統計分析":
                     height=300
                 )
 
+        st.markdown("---")
+
+        # --- 區塊 3：自訂區間 (前綴和索引，任意區間皆為兩次查表) ---
+        st.markdown("### 📅 自訂區間消費分析")
+        prefix_index = load_prefix_index()
+        # 預設近 30 天，但不可早於第一筆紀錄 (min_value)，否則使用第一個月時會出錯
+        date_range = st.date_input(
+            "選擇日期區間",
+            value=(max(last_30_days, prefix_index.first_day or last_30_days), today),
+            min_value=prefix_index.first_day,
+            max_value=max(today, prefix_index.last_day or today),
+            key="custom_range"
+        )
+
+        if len(date_range) == 2:
+            range_start, range_end = date_range
+            # date_input 的結束日包含在內，索引區間為 [start, end)
+            custom_totals = prefix_index.range_totals(range_start, range_end + timedelta(days=1))
+            custom_group = pd.DataFrame(list(custom_totals.items()), columns=["分類", "金額"])
+
+            st.metric("區間總開銷", f"${prefix_index.total(range_start, range_end + timedelta(days=1)):,.0f}")
+            col1_custom, col2_custom = st.columns([2, 3])
+
+            with col1_custom:
+                if custom_group.empty:
+                    st.write("無資料")
+                else:
+                    chart_custom = alt.Chart(custom_group).mark_arc(innerRadius=60).encode(
+                        theta=alt.Theta(field="金額", type="quantitative"),
+                        color=alt.Color(field="分類", type="nominal"),
+                        tooltip=["分類", "金額"],
+                        order=alt.Order("金額", sort="descending")
+                    ).properties(height=300)
+                    st.altair_chart(chart_custom, use_container_width=True)
+
+            with col2_custom:
+                if not custom_group.empty:
+                    st.markdown("#### 📝 詳細列表")
+                    st.dataframe(
+                        style_dataframe(custom_group.sort_values("金額", ascending=False)),
+                        use_container_width=True,
+                        hide_index=True,
+                        height=300
+                    )
+
 # ----------------------------------------------------------
 # PAGE 5：AI帳目分析
 # ----------------------------------------------------------
@@ -826,84 +1053,92 @@ elif selected_page == "AI帳目分析":
     st.header("🤖 AI 帳目分析")
     st.caption("讓 AI 幫您檢視本月的消費健康度")
 
-    with open(DATA_PATH, "r", encoding="utf-8") as f:
-        records = json.load(f)
-
     # 為了給 AI 分析，我們先計算本月資料
     today = date.today()
     this_month_str = today.strftime("%Y-%m")
 
-    # 篩選本月資料
-    month_records = [r for r in records if r["日期"].startswith(this_month_str)]
+    # 只讀取本月資料
+    df_month_ai = load_records_df(*month_range(this_month_str))
 
-    if not month_records:
+    if df_month_ai.empty:
         st.info("本月尚無消費紀錄，快去記一筆吧！")
     else:
-        # Session State 控制
-        if "ai_analysis_result" not in st.session_state:
-            st.session_state["ai_analysis_result"] = None
-
-        if st.button("✨ 啟動 AI 顧問分析本月狀況", type="primary", use_container_width=True):
-            with st.spinner("AI 正在分析您的消費行為..."):
-                try:
-                    # 取得專用 KEY
-                    api_key_2 = os.getenv("GEMINI_API_KEY2")
-                    if not api_key_2:
-                        st.error("找不到 GEMINI_API_KEY2，請檢查 .env 設定")
-                    else:
-                        # 準備資料給 AI
-                        total_m = sum(r["金額"] for r in month_records)
-                        cat_summary = {}
-                        for r in month_records:
-                            c = r["分類"]
-                            cat_summary[c] = cat_summary.get(c, 0) + r["金額"]
-                        
-                        sorted_items = sorted(month_records, key=lambda x: x["金額"], reverse=True)[:5]
-                        
-                        # 讀取預算資料加入分析
-                        if os.path.exists(BUDGET_PATH):
-                             with open(BUDGET_PATH, "r", encoding="utf-8") as f:
-                                 budget_data_ai = json.load(f)
-                        else:
-                             budget_data_ai = {}
+        # 讀取預算資料加入分析
+        budget_data_ai = store.load_budget()
+
+        # 分析結果以「本月紀錄 + 預算」的雜湊快取：資料沒變就直接顯示上次的報告
+        # 先依內容排序再雜湊：Arrow 快照 + 日誌載入時修改過的紀錄排在最後 (壓縮後才回到原位)，
+        # 以字串值排序，Categorical 欄位才不受字串表順序影響
+        analysis_cache = get_analysis_cache()
+        analysis_rows = df_month_ai[RECORD_COLUMNS].sort_values(
+            RECORD_COLUMNS, key=lambda col: col.astype(str), ignore_index=True
+        )
+        analysis_key = hashlib.sha1(
+            pd.util.hash_pandas_object(analysis_rows, index=False).values.tobytes()
+            + json.dumps([this_month_str, budget_data_ai], ensure_ascii=False, sort_keys=True).encode("utf-8")
+        ).hexdigest()
+        cached_analysis = analysis_cache.get(analysis_key)
+
+        button_label = "🔄 重新分析" if cached_analysis else "✨ 啟動 AI 顧問分析本月狀況"
+        if st.button(button_label, type="primary", use_container_width=True):
+            try:
+                # 取得專用 KEY
+                api_key_2 = os.getenv("GEMINI_API_KEY2")
+                if not api_key_2:
+                    st.error("找不到 GEMINI_API_KEY2，請檢查 .env 設定")
+                else:
+                    # 準備資料給 AI
+                    total_m = df_month_ai["金額"].sum()
+                    cat_summary = df_month_ai.groupby("分類", observed=True)["金額"].sum().to_dict()
+                    
+                    top_items = df_month_ai.nlargest(5, "金額").copy()
+                    top_items["日期"] = top_items["日期"].dt.strftime("%Y-%m-%d")
+                    sorted_items = top_items[RECORD_COLUMNS].to_dict("records")
 
-                        analysis_prompt = f"""
-                        你是一位專業且貼心的理財顧問。
-                        以下是使用者這個月 ({this_month_str}) 的消費數據概要：
-                        
-                        - 總花費：{total_m} 元
-                        - 各分類花費：{json.dumps(cat_summary, ensure_ascii=False)}
-                        - 預算設定值：{json.dumps(budget_data_ai, ensure_ascii=False)}
-                        - 前 5 筆最高單價項目：{json.dumps(sorted_items, ensure_ascii=False)}
-                        
-                        請根據以上數據進行分析：
-                        1. 判斷花費占比最多的部分是否合理？
-                        2. 觀察是否有明顯的「衝動消費」或「非必要支出」？
-                        3. **本月預算運用情形分析**：請根據「各分類花費」與「預算設定值」進行比對。
-                           - 指出哪些項目已經超支或快要超支？
-                           - 哪些項目控制得很好？
-                           - 給予下個月的預算調整或控管建議。
-                        4. 給予簡短、具體的後續消費或省錢建議。
-                        5. 語氣要像朋友給建議一樣親切自然，不要太說教。
-                        
-                        請直接輸出內容，不需要開頭問候。
-                        """
+                    analysis_prompt = f"""
+                    你是一位專業且貼心的理財顧問。
+                    以下是使用者這個月 ({this_month_str}) 的消費數據概要：
+                    
+                    - 總花費：{total_m} 元
+                    - 各分類花費：{json.dumps(cat_summary, ensure_ascii=False)}
+                    - 預算設定值：{json.dumps(budget_data_ai, ensure_ascii=False)}
+                    - 前 5 筆最高單價項目：{json.dumps(sorted_items, ensure_ascii=False)}
+                    
+                    請根據以上數據進行分析：
+                    1. 判斷花費占比最多的部分是否合理？
+                    2. 觀察是否有明顯的「衝動消費」或「非必要支出」？
+                    3. **本月預算運用情形分析**：請根據「各分類花費」與「預算設定值」進行比對。
+                       - 指出哪些項目已經超支或快要超支？
+                       - 哪些項目控制得很好？
+                       - 給予下個月的預算調整或控管建議。
+                    4. 給予簡短、具體的後續消費或省錢建議。
+                    5. 語氣要像朋友給建議一樣親切自然，不要太說教。
+                    
+                    請直接輸出內容，不需要開頭問候。
+                    """
 
-                        # 使用輪替函式
-                        response_2, error = call_gemini_rotated(
+                    # 串流輸出：邊生成邊顯示，不必等整份報告完成 (使用輪替函式)
+                    with st.spinner("AI 正在分析您的消費行為..."):
+                        stream, error = call_gemini_stream(
                             model_name="gemini-2.5-flash",
                             contents=analysis_prompt
                         )
-                        
-                        if error:
-                             st.error(f"分析失敗：{error}")
-                        else:
-                             st.session_state["ai_analysis_result"] = response_2.text
-                except Exception as e:
-                    st.error(f"分析失敗：{e}")
+
+                    if error:
+                        st.error(f"分析失敗：{error}")
+                    else:
+                        st.markdown("---")
+                        st.markdown("### 📝 分析報告")
+                        analysis_text = st.write_stream(stream)
+                        analysis_cache.set(analysis_key, analysis_text)
+                        # 重新整理，改以下方的報告樣式顯示
+                        st.rerun()
+            except Exception as e:
+                st.error(f"分析失敗：{e}")
 
         # 顯示結果
-        if st.session_state["ai_analysis_result"]:
+        elif cached_analysis:
+            st.caption("此報告依目前的本月紀錄與預算產生；資料有變動時才需要重新分析")
             st.markdown("---")
             st.markdown("### 📝 分析報告")
             st.markdown(
@@ -917,7 +1152,7 @@ elif selected_page == "AI帳目分析":
                     line-height: 1.8;
                     color: #333;
                 ">
-                    {st.session_state["ai_analysis_result"]}
+                    {cached_analysis}
                 </div>
                 """,
                 unsafe_allow_html=True
@@ -0,0 +1,183 @@
+import json
+from datetime import date
+
+try:
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.ipc as ipc
+except ImportError:  # 選用套件：沒有安裝時只使用 records.json
+    pa = None
+
+# ----------------------------------------------------------
+# records.json 的欄式快照 (Arrow IPC 檔)
+# ----------------------------------------------------------
+# - 以記憶體映射 (memory map) 開啟，欄位 buffer 直接指向檔案內容：
+#   只讀 日期 / 分類 / 金額 的頁面不會讀到 品項 / 備註 所在的頁面
+# - 選用 Arrow IPC 而非 Parquet：IPC 不壓縮、不需解碼，才能零複製映射
+# - 各欄存「頁面看到的值」(規則同 ledger.py)；無法由欄位精確還原的紀錄
+#   (多出欄位、金額不是整數、日期格式不同…) 另把原始 JSON 存在 _raw 欄，
+#   匯出再匯入後與 records.json 完全相同 (含 key 順序)
+
+RECORD_KEYS = ["品項", "分類", "金額", "日期", "備註", "id"]
+
+
+def available():
+    return pa is not None
+
+
+def _exact(record):
+    """這筆紀錄能否只由欄位值還原 (key 順序與型別都要相同)"""
+    keys = list(record)
+    if keys != RECORD_KEYS and keys != RECORD_KEYS[:-1]:
+        return False
+    if not all(isinstance(v, str) for k, v in record.items() if k != "金額"):
+        return False
+    if type(record["金額"]) is not int or not -2 ** 63 <= record["金額"] < 2 ** 63:
+        return False
+    try:
+        return str(date.fromisoformat(record["日期"])) == record["日期"]
+    except ValueError:
+        return False
+
+
+def _text(value):
+    return value if isinstance(value, str) else ("" if value is None else str(value))
+
+
+def _number(value):
+    """金額轉成數字 (同 storage.to_amount)"""
+    try:
+        amount = float(value)
+    except (TypeError, ValueError):
+        return 0
+    if amount != amount:  # NaN
+        return 0
+    return int(amount) if amount.is_integer() else amount
+
+
+def _dictionary(values, index_type=None):
+    encoded = pa.array(values, pa.string()).dictionary_encode()
+    return pa.DictionaryArray.from_arrays(encoded.indices.cast(index_type or pa.int32()), encoded.dictionary)
+
+
+def to_ipc_bytes(records, metadata=None):
+    """list of dict → Arrow IPC 檔內容 (bytes)；metadata 為 {str: str}，存在 schema 中"""
+    exact = [_exact(r) for r in records]
+    amounts = [_number(r.get("金額")) for r in records]
+    amount_type = pa.int64() if all(isinstance(a, int) for a in amounts) else pa.float64()
+
+    table = pa.table({
+        "id": pa.array([r.get("id") for r in records], pa.string()),
+        "品項": _dictionary([_text(r.get("品項")) for r in records]),
+        "分類": _dictionary([r.get("分類") if isinstance(r.get("分類"), str) else None for r in records], pa.int16()),
+        "金額": pa.array(amounts, amount_type),
+        "日期": pa.array([date.fromisoformat(str(r["日期"])[:10]) for r in records], pa.date32()),
+        "備註": _dictionary([_text(r.get("備註")) for r in records]),
+        "_raw": pa.array(
+            [None if ok else json.dumps(r, ensure_ascii=False) for r, ok in zip(records, exact)], pa.string()
+        ),
+    })
+    table = table.replace_schema_metadata(metadata or {})
+
+    sink = pa.BufferOutputStream()
+    with ipc.new_file(sink, table.schema) as writer:
+        writer.write_table(table)
+    return sink.getvalue().to_pybytes()
+
+
+def read_metadata(path):
+    """快照的 metadata {str: str}；檔案不存在或損毀時回傳 None"""
+    try:
+        with pa.memory_map(path, "r") as source:
+            raw = ipc.open_file(source).schema.metadata or {}
+    except (OSError, pa.ArrowInvalid):
+        return None
+    return {k.decode("utf-8"): v.decode("utf-8") for k, v in raw.items()}
+
+
+def read_table(path, columns=None, start=None, end=None, exclude_ids=()):
+    """
+    以記憶體映射讀取快照，只取 columns 指定的欄位
+    - start / end：日期在 [start, end) 的列 (字串 YYYY-MM-DD，None 表示不限)
+    - exclude_ids：略過這些 id 的列 (快照之後已被修改 / 刪除的紀錄)
+    回傳的 table 保留檔案的 metadata (同 read_metadata 讀到的內容)
+    """
+    with pa.memory_map(path, "r") as source:
+        table = ipc.open_file(source).read_all()
+    metadata = table.schema.metadata
+    columns = list(columns or RECORD_KEYS)
+    table = table.select(list(dict.fromkeys(columns + ["日期"] * bool(start or end) + ["id"] * bool(exclude_ids))))
+
+    mask = None
+    if start:
+        mask = pc.greater_equal(table["日期"], pa.scalar(date.fromisoformat(start)))
+    if end:
+        before_end = pc.less(table["日期"], pa.scalar(date.fromisoformat(end)))
+        mask = before_end if mask is None else pc.and_(mask, before_end)
+    if exclude_ids:
+        keep = pc.invert(pc.is_in(table["id"], value_set=pa.array(list(exclude_ids), pa.string())))
+        mask = keep if mask is None else pc.and_(mask, keep)
+    if mask is not None:
+        table = table.filter(mask)
+    return table.select(columns).replace_schema_metadata(metadata)
+
+
+def read_columns(path, columns, start=None, end=None, exclude_ids=()):
+    """
+    read_table 的結果轉成 numpy (供 ledger.Ledger.from_columns)，回傳 (欄位, 檔案 metadata)
+    日期 → int32 天數；字典編碼的欄位 → (int32 代碼 (缺值為 -1), 字串表)；id → list
+    檔案可能在呼叫前被其他程序換掉，呼叫端以 metadata 的 snapshot 確認讀到的是哪一份快照
+    """
+    table = read_table(path, columns, start, end, exclude_ids)
+    result = {}
+    for name in table.column_names:
+        column = table[name].combine_chunks()
+        if name == "日期":
+            result[name] = column.cast(pa.int32()).to_numpy()
+        elif pa.types.is_dictionary(column.type):
+            codes = pc.fill_null(column.indices.cast(pa.int32()), -1).to_numpy(zero_copy_only=False)
+            result[name] = (codes, column.dictionary.to_pylist())
+        elif name == "id":
+            result[name] = column.to_pylist()
+        else:
+            result[name] = column.to_numpy(zero_copy_only=False)
+    metadata = {k.decode("utf-8"): v.decode("utf-8") for k, v in (table.schema.metadata or {}).items()}
+    return result, metadata
+
+
+def _pylist(column):
+    """欄位 → Python list；字典編碼的欄位查表展開 (比逐格轉換快)"""
+    column = column.combine_chunks()
+    if pa.types.is_dictionary(column.type):
+        table = column.dictionary.to_pylist() + [None]
+        indices = pc.fill_null(column.indices, -1).to_numpy(zero_copy_only=False).tolist()
+        return [table[i] for i in indices]
+    return column.to_pylist()
+
+
+def read_records(path):
+    """快照 → list of dict (與匯出前的 records.json 內容完全相同)"""
+    table = read_table(path, RECORD_KEYS + ["_raw"])
+    amounts = table["金額"]
+    if pa.types.is_floating(amounts.type):
+        # 有小數金額的紀錄都存在 _raw；其餘 (可精確還原的) 一定是整數
+        amounts = pc.cast(pc.fill_null(amounts, 0), pa.int64(), safe=False)
+    columns = [
+        _pylist(table["品項"]),
+        _pylist(table["分類"]),
+        _pylist(amounts),
+        _pylist(table["日期"].cast(pa.string())),
+        _pylist(table["備註"]),
+    ]
+    ids = _pylist(table["id"])
+
+    records = []
+    for raw, record_id, *values in zip(_pylist(table["_raw"]), ids, *columns):
+        if raw is not None:
+            records.append(json.loads(raw))
+            continue
+        record = dict(zip(RECORD_KEYS, values))
+        if record_id is not None:
+            record["id"] = record_id
+        records.append(record)
+    return records
@@ -0,0 +1,113 @@
+import io
+import time
+import wave
+
+import numpy as np
+
+# ----------------------------------------------------------
+# 語音輸入的音訊處理 (全部在記憶體中完成，不寫暫存檔)
+# ----------------------------------------------------------
+
+
+def pcm_to_wav(raw_data, frame_rate, sample_width, channels):
+    """原始 PCM → WAV bytes (標準庫 wave 模組，不需 ffmpeg)"""
+    buffer = io.BytesIO()
+    with wave.open(buffer, "wb") as wav:
+        wav.setnchannels(channels)
+        wav.setsampwidth(sample_width)
+        wav.setframerate(frame_rate)
+        wav.writeframes(raw_data)
+    return buffer.getvalue()
+
+
+# ----------------------------------------------------------
+# 語音辨識 (STT) 前處理：去頭尾靜音、轉單聲道、降取樣
+# ----------------------------------------------------------
+STT_SAMPLE_RATE = 16000  # 語音辨識用 16 kHz 就足夠
+VAD_FRAME_MS = 30
+VAD_THRESHOLD_DB = -35   # 相對於最大音框能量，低於此視為靜音
+VAD_PADDING_MS = 200     # 保留語音前後的緩衝，避免切掉字頭字尾
+
+
+def pcm_to_array(raw_data, sample_width, channels):
+    """PCM bytes → 單聲道 float 陣列 (範圍約 -1 ~ 1)，多聲道取平均"""
+    if sample_width == 1:
+        samples = (np.frombuffer(raw_data, dtype=np.uint8).astype(np.float32) - 128) / 128
+    elif sample_width == 2:
+        samples = np.frombuffer(raw_data, dtype="<i2").astype(np.float32) / 32768
+    elif sample_width == 4:
+        samples = np.frombuffer(raw_data, dtype="<i4").astype(np.float32) / 2147483648
+    else:
+        raise ValueError(f"不支援的取樣寬度：{sample_width} bytes")
+    if channels > 1:
+        samples = samples[: len(samples) // channels * channels].reshape(-1, channels).mean(axis=1)
+    return samples
+
+
+def array_to_pcm16(samples):
+    return (np.clip(samples, -1, 1) * 32767).astype("<i2").tobytes()
+
+
+def trim_silence(samples, frame_rate, frame_ms=VAD_FRAME_MS,
+                 threshold_db=VAD_THRESHOLD_DB, padding_ms=VAD_PADDING_MS):
+    """
+    以音框能量 (RMS) 判斷語音範圍，去掉頭尾靜音
+    整段都低於門檻 (或太短) 時原樣回傳
+    """
+    frame_len = max(1, int(frame_rate * frame_ms / 1000))
+    n_frames = len(samples) // frame_len
+    if n_frames == 0:
+        return samples
+
+    frames = samples[: n_frames * frame_len].reshape(n_frames, frame_len)
+    rms = np.sqrt((frames ** 2).mean(axis=1))
+    peak = rms.max()
+    if peak <= 0:
+        return samples
+
+    voiced = np.flatnonzero(rms >= peak * 10 ** (threshold_db / 20))
+    padding = int(frame_rate * padding_ms / 1000)
+    start = max(0, voiced[0] * frame_len - padding)
+    end = min(len(samples), (voiced[-1] + 1) * frame_len + padding)
+    return samples[start:end]
+
+
+def resample(samples, src_rate, dst_rate):
+    """降取樣：先以移動平均做簡單低通 (避免混疊)，再線性內插"""
+    if src_rate == dst_rate or len(samples) == 0:
+        return samples
+    if src_rate > dst_rate:
+        width = int(round(src_rate / dst_rate))
+        if width > 1:
+            samples = np.convolve(samples, np.ones(width) / width, mode="same")
+    n_out = int(len(samples) * dst_rate / src_rate)
+    positions = np.arange(n_out) * (src_rate / dst_rate)
+    return np.interp(positions, np.arange(len(samples)), samples).astype(np.float32)
+
+
+def preprocess_for_stt(raw_data, frame_rate, sample_width, channels, target_rate=STT_SAMPLE_RATE):
+    """
+    STT 前處理：轉單聲道 → 去頭尾靜音 → 降到 16 kHz → 16-bit PCM WAV
+    回傳 (wav_bytes, 統計)，統計含前後大小與處理耗時
+    """
+    t0 = time.perf_counter()
+    samples = pcm_to_array(raw_data, sample_width, channels)
+    samples = trim_silence(samples, frame_rate)
+    samples = resample(samples, frame_rate, min(frame_rate, target_rate))
+    out_rate = min(frame_rate, target_rate)
+    wav = pcm_to_wav(array_to_pcm16(samples), out_rate, 2, 1)
+
+    original_bytes = len(raw_data) + 44  # 原始錄音包成 WAV 的大小 (44 bytes 檔頭)
+    return wav, {
+        "original_bytes": original_bytes,
+        "bytes": len(wav),
+        "saved_ratio": 1 - len(wav) / original_bytes,
+        "original_seconds": len(raw_data) / (frame_rate * sample_width * channels),
+        "seconds": len(samples) / out_rate,
+        "elapsed_ms": (time.perf_counter() - t0) * 1000,
+    }
+
+
+def preprocess_segment(segment):
+    """錄音元件的 pydub AudioSegment → (STT 用的 WAV bytes, 統計)"""
+    return preprocess_for_stt(segment.raw_data, segment.frame_rate, segment.sample_width, segment.channels)
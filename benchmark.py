@@ -0,0 +1,910 @@
+import argparse
+import io
+import json
+import multiprocessing
+import os
+import random
+import sqlite3
+import tempfile
+import time
+from contextlib import closing, redirect_stdout
+from datetime import date, timedelta
+
+import numpy as np
+import pandas as pd
+from PIL import Image, ImageDraw
+
+import arrow_snapshot
+from analytics import PrefixSumIndex
+from audio_utils import preprocess_for_stt
+import gemini_client
+from gemini_client import (
+    STT_PROMPT,
+    Expense,
+    KeyPool,
+    ParseStats,
+    ScanCache,
+    extract_receipts_concurrently,
+    generate_structured,
+    transcribe_audio_gemini,
+    voice_to_record_gemini,
+)
+from generate_mock_data import categories as MOCK_CATEGORIES
+from image_utils import dhash, group_similar_hashes, hamming_distance, preprocess_receipt_image
+from ledger import Ledger, load_ledger
+from local_parser import CONFIDENCE_THRESHOLD, CategoryClassifier, LocalParser
+from storage import CATEGORIES, ConflictError, JournalStore, Rollup, ShardedStore, month_range, open_store
+
+# ----------------------------------------------------------
+# 效能 / 正確性檢查 (不需要 API Key)
+# 用法：python benchmark.py <項目> [--n 筆數]
+# ----------------------------------------------------------
+
+
+def expect(condition, message):
+    """正確性檢查：不符時拋出 AssertionError (不用 assert，python -O 時也會檢查)"""
+    if not condition:
+        raise AssertionError(message)
+
+
+def make_records(n, start=date(2022, 1, 1), days=1200, seed=0):
+    """產生 n 筆隨機紀錄 (格式同 records.json)"""
+    rng = random.Random(seed)
+    return [
+        {
+            "品項": f"item{rng.randint(0, 200)}",
+            "分類": rng.choice(CATEGORIES),
+            "金額": rng.randint(5, 3000),
+            "日期": str(start + timedelta(days=rng.randint(0, days - 1))),
+            "備註": "",
+        }
+        for _ in range(n)
+    ]
+
+
+def bench_prefix(n):
+    """前綴和索引 vs pandas groupby：隨機區間結果必須一致，並比較查詢時間"""
+    records = make_records(n)
+    df = pd.DataFrame(records)
+    df["日期"] = pd.to_datetime(df["日期"])
+
+    t0 = time.perf_counter()
+    index = PrefixSumIndex.from_daily_totals(Rollup.from_records(records).day)
+    build_time = time.perf_counter() - t0
+
+    rng = random.Random(1)
+    first, last = date(2021, 12, 1), date(2025, 6, 1)
+    ranges = []
+    for _ in range(200):
+        a = first + timedelta(days=rng.randint(0, (last - first).days))
+        b = a + timedelta(days=rng.randint(0, 400))
+        ranges.append((a, b))
+    ranges += [(None, None), (first, first), (date(2023, 3, 1), date(2023, 4, 1))]
+
+    t0 = time.perf_counter()
+    expected = []
+    for a, b in ranges:
+        mask = pd.Series(True, index=df.index)
+        if a is not None:
+            mask &= df["日期"] >= pd.Timestamp(a)
+        if b is not None:
+            mask &= df["日期"] < pd.Timestamp(b)
+        group = df[mask].groupby("分類")["金額"].sum()
+        expected.append({cat: int(v) for cat, v in group.items() if v})
+    pandas_time = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    actual = [index.range_totals(a, b) for a, b in ranges]
+    index_time = time.perf_counter() - t0
+
+    mismatches = [r for r, e, a in zip(ranges, expected, actual) if e != a]
+    expect(not mismatches, f"前綴和結果與 groupby 不一致：{mismatches[:3]}")
+    print(f"[prefix] {n} records, {len(ranges)} ranges: results match pandas groupby")
+    print(f"  build index : {build_time * 1000:.1f} ms")
+    print(f"  pandas      : {pandas_time / len(ranges) * 1000:.3f} ms / range")
+    print(f"  prefix index: {index_time / len(ranges) * 1000:.3f} ms / range")
+
+
+class FakeResponse:
+    def __init__(self, text):
+        self.text = text
+
+
+class FakeClient:
+    """
+    假的 Gemini Client：不連網，可注入延遲與 429
+    exhausted 為共用的 set，放在裡面的 api_key 會回 RESOURCE_EXHAUSTED
+    """
+
+    instances = 0
+
+    def __init__(self, api_key, exhausted=None, latency=0.0, reply="{}"):
+        FakeClient.instances += 1
+        self.api_key = api_key
+        self.exhausted = exhausted if exhausted is not None else set()
+        self.latency = latency
+        self.reply = reply
+        self.calls = 0
+        self.models = self
+
+    def generate_content(self, model, contents, **kwargs):
+        self.calls += 1
+        time.sleep(self.latency)
+        if self.api_key in self.exhausted:
+            raise RuntimeError("429 RESOURCE_EXHAUSTED. {'retryDelay': '30s'}")
+        reply = self.reply(contents) if callable(self.reply) else self.reply
+        return FakeResponse(reply)
+
+
+def bench_ledger(n):
+    """欄式記帳資料 vs pd.DataFrame(records)：記憶體用量與建立時間，內容須相同"""
+    records = make_records(n)
+    for i, r in enumerate(records[::7]):
+        r["備註"] = f"note{i % 500}"
+
+    t0 = time.perf_counter()
+    df = pd.DataFrame(records)
+    df["日期"] = pd.to_datetime(df["日期"])
+    df["金額"] = pd.to_numeric(df["金額"], errors="coerce").fillna(0)
+    df["品項"] = df["品項"].fillna("")
+    df["備註"] = df["備註"].fillna("")
+    df_time = time.perf_counter() - t0
+    df_bytes = df.memory_usage(deep=True).sum()
+
+    t0 = time.perf_counter()
+    ledger = Ledger.from_records(records)
+    ledger_time = time.perf_counter() - t0
+    t0 = time.perf_counter()
+    frame = ledger.to_frame()
+    frame_time = time.perf_counter() - t0
+    frame_bytes = frame.memory_usage(deep=True).sum()
+
+    # 頁面看到的內容必須與原本的 DataFrame 相同
+    for col in df.columns:
+        expect(frame[col].astype(object).tolist() == df[col].astype(object).tolist(), f"ledger: column {col} differs")
+    expect(frame.groupby("分類", observed=True)["金額"].sum().to_dict() == df.groupby("分類")["金額"].sum().to_dict(),
+           "ledger: category totals differ")
+
+    mb = 1024 * 1024
+    print(f"[ledger] {n} records")
+    print(f"  pd.DataFrame(records): {df_bytes / mb:7.1f} MB, built in {df_time:.2f} s")
+    print(f"  Ledger (numpy)       : {ledger.nbytes / mb:7.1f} MB, built in {ledger_time:.2f} s")
+    print(f"  Ledger.to_frame()    : {frame_bytes / mb:7.1f} MB (+{frame_time * 1000:.0f} ms), "
+          f"{df_bytes / frame_bytes:.1f}x smaller")
+
+
+def bench_pool(n):
+    """Key A 額度耗盡時：舊做法每次都先打 A 再輪替，KeyPool 只會白跑第一次"""
+    n = min(n, 1000)
+    keys = [f"key-{c}" for c in "ABCDEFGH"]
+    exhausted = {"key-A"}
+    latency = 0.002
+
+    # 舊做法：每次呼叫都新建 Client、從 A 開始
+    FakeClient.instances = 0
+    failed_old = 0
+    t0 = time.perf_counter()
+    for _ in range(n):
+        for key in keys:
+            try:
+                FakeClient(key, exhausted, latency).models.generate_content(model="m", contents="x")
+                break
+            except RuntimeError:
+                failed_old += 1
+    old_time = time.perf_counter() - t0
+    old_clients = FakeClient.instances
+
+    FakeClient.instances = 0
+    # 關閉 RPM / RPD 限制，只比較 429 輪替的差異
+    pool = KeyPool(keys, client_factory=lambda api_key: FakeClient(api_key, exhausted, latency), rpm=0, rpd=0)
+    t0 = time.perf_counter()
+    for _ in range(n):
+        response, error = pool.generate("x", "m")
+        expect(error is None, f"pool: unexpected error {error}")
+    pool_time = time.perf_counter() - t0
+    failed_pool = sum(s["failures"] for s in pool.status())
+
+    expect(failed_pool == 1, f"pool: exhausted key should fail once, {pool.status()}")
+    print(f"[pool] {n} calls with key A exhausted ({latency * 1000:.0f} ms per request)")
+    print(f"  per-call Client : {old_time:.2f} s, {failed_old} failed 429 round trips, {old_clients} clients")
+    print(f"  KeyPool         : {pool_time:.2f} s, {failed_pool} failed 429 round trips, {FakeClient.instances} clients")
+    _check_pool_buckets()
+
+
+class FakeClock:
+    """假時鐘：sleep() 只把時間往前推並記下等待秒數"""
+
+    def __init__(self):
+        self.now = 0.0
+        self.sleeps = []
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+def _check_pool_buckets():
+    """RPM / RPD token bucket：連續呼叫分散到各 Key，全部用完時排隊等補充，等太久就不再等"""
+    keys = ["key-A", "key-B", "key-C"]
+    rpm, rpd = 2, 5
+    clock = FakeClock()
+    pool = KeyPool(keys, client_factory=lambda api_key: FakeClient(api_key), rpm=rpm, rpd=rpd,
+                   max_wait=60, clock=clock, sleep=clock.sleep)
+
+    for _ in range(len(keys) * rpm):
+        expect(pool.generate("x", "m")[1] is None, "pool buckets: call failed")
+    calls = [pool.client(k).calls for k in keys]
+    expect(calls == [rpm] * len(keys), f"pool buckets: calls not spread across keys {calls}")
+    expect(not clock.sleeps, f"pool buckets: waited while keys had quota {clock.sleeps}")
+    levels = [(lv["rpm"], lv["rpd"]) for lv in pool.bucket_levels()]
+    expect(levels == [(0.0, rpd - rpm)] * len(keys), f"pool buckets: unexpected levels {levels}")
+
+    # 全部用完：等到最早補充的 Key (RPM=2 → 30 秒補 1 個)，不多等
+    expect(pool.generate("x", "m")[1] is None, "pool buckets: queued call failed")
+    refill = 60 / rpm
+    expect(clock.sleeps and abs(sum(clock.sleeps) - refill) < 1e-6,
+           f"pool buckets: expected to wait {refill} s for a refill, waited {clock.sleeps}")
+    levels = sorted(lv["rpm"] for lv in pool.bucket_levels())
+    expect(levels == [0.0, 1.0, 1.0], f"pool buckets: unexpected levels after refill {levels}")
+
+    # 等待超過 max_wait：不睡，直接交給最健康的 Key (由 API 決定是否 429)
+    clock = FakeClock()
+    pool = KeyPool(keys, client_factory=lambda api_key: FakeClient(api_key), rpm=rpm, rpd=rpd,
+                   max_wait=5, clock=clock, sleep=clock.sleep)
+    for _ in range(len(keys) * rpm):
+        pool.generate("x", "m")
+    first = pool.ordered_keys()[0]
+    before = pool.client(first).calls
+    expect(pool.generate("x", "m")[1] is None, "pool buckets: fallback call failed")
+    expect(not clock.sleeps, f"pool buckets: waited past max_wait {clock.sleeps}")
+    expect(pool.client(first).calls == before + 1, "pool buckets: fallback did not use the healthiest key")
+    print(f"  token buckets   : {len(keys)} keys x RPM {rpm} spread evenly, "
+          f"queued {refill:.0f} s for a refill, no wait beyond max_wait")
+
+
+def bench_arrow(n):
+    """Arrow 欄式快照：與 records.json 精確互轉、開啟時間、只讀 日期 / 分類 / 金額 的頁面"""
+    if not arrow_snapshot.available():
+        print("[arrow] pyarrow 未安裝，略過")
+        return
+    records = make_records(n)
+    # 各種無法只由欄位還原的紀錄也要原樣保留
+    records[1]["金額"] = 12.5
+    records[2]["金額"] = "30"
+    records[3] = {"日期": records[3]["日期"], "品項": "x", "分類": "其他", "金額": 1, "備註": ""}
+    records[4]["分類"] = None
+    records[5]["extra"] = 1
+
+    with tempfile.TemporaryDirectory() as folder:
+        data_path = os.path.join(folder, "records.json")
+        arrow_path = os.path.join(folder, "records.arrow")
+        with open(data_path, "w", encoding="utf-8") as f:
+            json.dump(records, f, ensure_ascii=False, indent=4)
+
+        t0 = time.perf_counter()
+        JournalStore(data_path, arrow_path=arrow_path)  # 第一次開啟：補上 id 並匯出欄式快照
+        export_time = time.perf_counter() - t0
+
+        with open(data_path, "rb") as f:
+            raw = f.read()
+        restored = arrow_snapshot.read_records(arrow_path)
+        expect(json.dumps(restored, ensure_ascii=False, indent=4).encode("utf-8") == raw, "arrow: round trip mismatch")
+
+        t0 = time.perf_counter()
+        plain = JournalStore(data_path)
+        json_open = time.perf_counter() - t0
+        t0 = time.perf_counter()
+        store = JournalStore(data_path, arrow_path=arrow_path)
+        arrow_open = time.perf_counter() - t0
+        expect(store.load() == plain.load(), "arrow: records restored from snapshot differ from JSON")
+
+        # 日誌中還有未壓縮的修改時，欄式讀取也要與 query() 結果相同
+        key, seen = store.query(keyed=True)[10]
+        store.update(key, dict(seen, 金額=7))
+        store.add(dict(records[0], 品項="新"))
+        columns = ["日期", "分類", "金額"]
+        t0 = time.perf_counter()
+        frame = load_ledger(store, columns=columns).to_frame()
+        arrow_read = time.perf_counter() - t0
+        t0 = time.perf_counter()
+        expected = Ledger.from_records(store.query(), columns=columns).to_frame()
+        records_read = time.perf_counter() - t0
+        expect(frame.groupby("分類", observed=True)["金額"].sum().to_dict()
+               == expected.groupby("分類", observed=True)["金額"].sum().to_dict(), "arrow: category totals differ")
+        expect(sorted(frame["日期"]) == sorted(expected["日期"]), "arrow: dates differ")
+
+        # arrow_view 之後、讀取檔案之前被其他程序壓縮：新快照已含日誌中的紀錄，不可重複計入
+        view = store.arrow_view
+        other = JournalStore(data_path, arrow_path=arrow_path)
+
+        def view_then_compact(*args):
+            result = view(*args)
+            other.compact()
+            return result
+
+        store.arrow_view = view_then_compact
+        raced = load_ledger(store, columns=columns).to_frame()
+        store.arrow_view = view
+        expect(len(raced) == len(expected) and raced["金額"].sum() == expected["金額"].sum(),
+               "arrow: journal rows counted twice after a concurrent compaction")
+
+        print(f"[arrow] {n} records: records.json {len(raw) / 1e6:.0f} MB, "
+              f"records.arrow {os.path.getsize(arrow_path) / 1e6:.0f} MB (first open + export {export_time:.2f} s), round trip exact")
+        print(f"  open store      : JSON {json_open:.2f} s, Arrow snapshot {arrow_open:.2f} s")
+        print(f"  日期/分類/金額   : from records {records_read:.2f} s, memory-mapped projection {arrow_read:.3f} s")
+
+
+def bench_classifier(n):
+    """本機分類器準確率：以 generate_mock_data.py 的品項加上變化字詞，80% 訓練 / 20% 測試"""
+    rng = random.Random(2)
+    prefixes = ["", "", "學校", "好吃的", "週末", "路邊"]
+    suffixes = ["", "", "加大", "套餐", "x2", "補貨"]
+    samples = []
+    for _ in range(min(n, 20000)):
+        cat = rng.choice(list(MOCK_CATEGORIES))
+        name = rng.choice(MOCK_CATEGORIES[cat])[0]
+        samples.append({"品項": rng.choice(prefixes) + name + rng.choice(suffixes), "分類": cat})
+
+    # (名稱, 資料, 準確率下限, 信心 >= 0.8 時的正確率下限)；目前實測為 100%/100% 與 98.3%/100%
+    datasets = [("mock variants", samples, 0.95, 0.98)]
+    with open("data/records.json", "r", encoding="utf-8") as f:
+        datasets.append(("data/records.json", json.load(f), 0.95, 0.98))
+
+    for label, records, min_accuracy, min_precision in datasets:
+        records = records[:]
+        rng.shuffle(records)
+        split = int(len(records) * 0.8)
+        train, test = records[:split], records[split:]
+
+        t0 = time.perf_counter()
+        clf = CategoryClassifier()
+        clf.learn(train)
+        train_time = time.perf_counter() - t0
+
+        t0 = time.perf_counter()
+        predictions = [clf.predict(r["品項"]) for r in test]
+        predict_time = time.perf_counter() - t0
+
+        correct = sum(p[0] == r["分類"] for p, r in zip(predictions, test))
+        confident = [(p, r) for p, r in zip(predictions, test) if p[1] >= 0.8]
+        confident_correct = sum(p[0] == r["分類"] for p, r in confident)
+        accuracy = correct / len(test)
+        precision = confident_correct / max(len(confident), 1)
+        expect(accuracy >= min_accuracy, f"classifier: {label} accuracy {accuracy:.1%} < {min_accuracy:.0%}")
+        expect(precision >= min_precision,
+               f"classifier: {label} confidence>=0.8 precision {precision:.1%} < {min_precision:.0%}")
+        print(f"[classifier] {label}: train {len(train)}, test {len(test)}")
+        print(f"  accuracy        : {accuracy:.1%}")
+        print(f"  confidence>=0.8 : {len(confident) / len(test):.1%} of inputs, {precision:.1%} correct")
+        print(f"  train {train_time * 1000:.1f} ms, predict {predict_time / len(test) * 1e6:.0f} us / item")
+
+
+def bench_parser(n):
+    """本機規則式解析：常見句子直接採用；只是部分包含關鍵字 (電飯鍋 ∋ 飯) 的不可略過 Gemini 直接存檔"""
+    parser = LocalParser()
+    confident = {
+        "珍奶50元": ("餐飲食品", 50),
+        "午餐 120元": ("餐飲食品", 120),
+        "麵 60元": ("餐飲食品", 60),
+        "計程車 250元": ("交通運輸", 250),
+        "看醫生 掛號 150元": ("醫療保健", 150),
+        "我今天買了衣服 一千兩百元": ("服飾購物", 1200),
+    }
+    for text, (cat, amount) in confident.items():
+        r = parser.parse(text)
+        expect(r["confidence"] >= CONFIDENCE_THRESHOLD and (r["category"], r["amount"]) == (cat, amount),
+               f"parser: {text!r} should be parsed locally as {cat} {amount}, got {r}")
+
+    # 單字關鍵字 / 部分相符：金額再確定也要低於門檻，交給 Gemini 或使用者確認
+    misleading = ["電飯鍋 1200元", "麵包機 3000元", "飯店住宿 3000元", "書包 500元", "鞋櫃 2000元"]
+    for text in misleading:
+        r = parser.parse(text)
+        expect(r["confidence"] < CONFIDENCE_THRESHOLD,
+               f"parser: {text!r} must not skip Gemini ({r['category']}, confidence {r['confidence']})")
+
+    texts = (list(confident) + misleading) * max(1, min(n, 20000) // 11)
+    t0 = time.perf_counter()
+    for text in texts:
+        parser.parse(text)
+    parse_time = time.perf_counter() - t0
+    print(f"[parser] {len(confident)} sentences parsed locally, {len(misleading)} partial matches sent to Gemini")
+    print(f"  parse: {parse_time / len(texts) * 1e6:.0f} us / sentence ({len(texts)} sentences)")
+
+
+def bench_scan(n):
+    """多張收據併發辨識：假 Client 每次請求延遲 0.2 秒，比較不同併發數的總耗時"""
+    n_images = min(n, 16)
+    latency = 0.2
+    reply = '{"item": "午餐", "amount": 120, "date": "2025-12-01", "category": "餐飲食品"}'
+    keys = [f"key-{c}" for c in "ABCD"]
+    images = [(b"fake-image-bytes", "image/jpeg")] * n_images
+
+    print(f"[scan] {n_images} receipts, {latency * 1000:.0f} ms per request, {len(keys)} keys")
+    baseline = None
+    for workers in (1, 2, 4, 8):
+        pool = KeyPool(keys, client_factory=lambda api_key: FakeClient(api_key, latency=latency, reply=reply), rpm=0, rpd=0)
+        t0 = time.perf_counter()
+        results = list(extract_receipts_concurrently(images, max_workers=workers, pool=pool))
+        elapsed = time.perf_counter() - t0
+        expect(len(results) == n_images and all("error" not in r for _, r in results),
+               f"scan: expected {n_images} successful results")
+        baseline = baseline or elapsed
+        print(f"  workers={workers}: {elapsed:.2f} s ({baseline / elapsed:.1f}x)")
+
+    # 同一批中 key 相同的圖片只送出一次，結果給每一張
+    calls = []
+
+    def extract(image_bytes, mime_type):
+        calls.append(image_bytes)
+        return {"item": "午餐"}
+
+    keys = ["a", "b"] * (n_images // 2) + ["a"] * (n_images % 2)
+    results = dict(extract_receipts_concurrently(images, extract=extract, keys=keys))
+    expect(len(calls) == min(n_images, 2) and sorted(results) == list(range(n_images)),
+           f"scan: duplicate images sent {len(calls)} times")
+    print(f"  duplicates      : {n_images} images with 2 distinct keys, {len(calls)} requests")
+
+
+def make_speech_like_pcm(frame_rate=48000, channels=2, lead=1.0, speech=2.0, tail=1.5, seed=0):
+    """合成測試錄音：前後為微弱底噪，中間是振幅調變的諧波 (模擬說話)，回傳 16-bit PCM bytes"""
+    rng = np.random.default_rng(seed)
+    t = np.arange(int(frame_rate * speech)) / frame_rate
+    voice = sum(np.sin(2 * np.pi * f * t) / k for k, f in enumerate((180, 360, 540, 900), 1))
+    voice *= 0.25 * (1 + np.sin(2 * np.pi * 4 * t)) / 2
+    samples = np.concatenate([
+        rng.normal(0, 0.002, int(frame_rate * lead)),
+        voice,
+        rng.normal(0, 0.002, int(frame_rate * tail)),
+    ])
+    interleaved = np.repeat(samples[:, None], channels, axis=1).ravel()
+    return (np.clip(interleaved, -1, 1) * 32767).astype("<i2").tobytes()
+
+
+def bench_audio(n):
+    """語音前處理：合成錄音去靜音 + 單聲道 16 kHz，檢查長度並比較上傳大小"""
+    lead, speech, tail = 1.0, 2.0, 1.5
+    print(f"[audio] synthetic recording: {lead}s silence + {speech}s speech + {tail}s silence")
+    for frame_rate, channels in ((48000, 2), (44100, 1), (16000, 1)):
+        raw = make_speech_like_pcm(frame_rate, channels, lead, speech, tail)
+        wav, stats = preprocess_for_stt(raw, frame_rate, 2, channels)
+        # 保留的長度應約為語音長度 + 前後緩衝 (各 0.2 秒)，不可切掉語音
+        expect(speech <= stats["seconds"] <= speech + 0.5, f"audio: speech trimmed wrongly {stats}")
+        print(f"  {frame_rate} Hz x{channels}: {stats['original_bytes'] / 1024:.0f} KB -> {stats['bytes'] / 1024:.0f} KB "
+              f"({stats['saved_ratio']:.0%} saved), {stats['original_seconds']:.1f}s -> {stats['seconds']:.2f}s, "
+              f"{stats['elapsed_ms']:.1f} ms")
+
+
+def bench_voice(n):
+    """語音記帳：兩段式 (STT → 解析) vs 一次呼叫，假 Client 每次請求延遲 0.3 秒"""
+    n = min(n, 10)
+    latency = 0.3
+    transcript = "午餐便當一百二十元"
+    expense = '{"item": "午餐便當", "amount": 120, "category": "餐飲食品"}'
+
+    def reply(contents):
+        if isinstance(contents, str):
+            return expense  # 兩段式的第二步：解析逐字稿
+        if contents[0] == STT_PROMPT:
+            return transcript
+        return '{"transcript": "%s", %s' % (transcript, expense[1:])
+
+    pool = KeyPool(["key-A"], client_factory=lambda api_key: FakeClient(api_key, latency=latency, reply=reply), rpm=0, rpd=0)
+    audio = b"fake-wav-bytes"
+
+    t0 = time.perf_counter()
+    for _ in range(n):
+        text, error = transcribe_audio_gemini(audio, "audio/wav", pool=pool)
+        parsed, error = generate_structured(Expense, text, pool=pool)
+        expect(error is None and parsed.amount == 120, f"voice: transcript parse failed ({error})")
+    two_step = (time.perf_counter() - t0) / n
+    two_step_calls = pool.client("key-A").calls
+
+    t0 = time.perf_counter()
+    for _ in range(n):
+        result = voice_to_record_gemini(audio, "audio/wav", pool=pool)
+        expect(result["transcript"] == transcript and result["amount"] == 120, f"voice: combined call failed {result}")
+    combined = (time.perf_counter() - t0) / n
+    combined_calls = pool.client("key-A").calls - two_step_calls
+
+    print(f"[voice] {n} recordings, {latency * 1000:.0f} ms per request")
+    print(f"  STT + parse : {two_step:.2f} s / entry, {two_step_calls / n:.0f} calls / entry")
+    print(f"  single call : {combined:.2f} s / entry, {combined_calls / n:.0f} calls / entry")
+    _check_structured_retry()
+
+
+def _check_structured_retry():
+    """結構化輸出：第一次回覆驗證失敗時附上錯誤重試一次，並計入 parse_stats 的失敗率"""
+    replies = iter(['{"item": "午餐", "amount": "一百二", "category": "餐點"}',
+                    '{"item": "午餐", "amount": 120, "category": "餐飲食品"}'])
+    prompts = []
+
+    def reply(contents):
+        prompts.append(contents)
+        return next(replies)
+
+    pool = KeyPool(["key-A"], client_factory=lambda api_key: FakeClient(api_key, reply=reply), rpm=0, rpd=0)
+    saved, gemini_client.parse_stats = gemini_client.parse_stats, ParseStats()
+    try:
+        parsed, error = generate_structured(Expense, "午餐 一百二", pool=pool)
+        stats = gemini_client.parse_stats.stats()
+    finally:
+        gemini_client.parse_stats = saved
+
+    expect(error is None and (parsed.amount, parsed.category) == (120, "餐飲食品"),
+           f"structured: retry should return the valid reply, got {parsed} / {error}")
+    expect(pool.client("key-A").calls == 2, f"structured: expected 2 calls, got {pool.client('key-A').calls}")
+    expect("驗證錯誤" in prompts[1] and "驗證錯誤" not in prompts[0],
+           "structured: retry prompt should carry the validation error")
+    expect(stats["first_try_failure_rate"] > 0 and stats["failure_rate"] == 0,
+           f"structured: unexpected parse stats {stats}")
+    print(f"  structured retry: invalid first reply fixed on retry, 2 calls, "
+          f"first-try failure rate {stats['first_try_failure_rate']:.0%}, failure rate {stats['failure_rate']:.0%}")
+
+
+def make_receipt_photo(width=4000, height=3000, orientation=6, seed=0):
+    """
+    合成 12MP 手機照片：灰色桌面上一張略為傾斜的收據 (位置、大小、內容隨 seed 變化)，
+    EXIF 標示需旋轉 (orientation 6 = 順時針 90 度)
+    """
+    rng = random.Random(seed)
+    background = Image.linear_gradient("L").resize((width, height)).convert("RGB")
+    img = Image.blend(Image.new("RGB", (width, height), (rng.randint(60, 160),) * 3), background, 0.3)
+
+    receipt = Image.new("RGB", (rng.randint(1600, 2400), rng.randint(1200, 1600)), (245, 245, 240))
+    draw = ImageDraw.Draw(receipt)
+    for y in range(60, receipt.height - 60, 60):
+        draw.text((60, y), f"ITEM {rng.randint(1, 99)}    {rng.randint(10, 500)}    2025-12-01", fill="black")
+    receipt = receipt.rotate(rng.uniform(-8, 8), expand=True, fillcolor=(0, 0, 0))
+    img.paste(receipt, (rng.randint(0, width - receipt.width), rng.randint(0, height - receipt.height)))
+
+    exif = img.getexif()
+    exif[0x0112] = orientation
+    buffer = io.BytesIO()
+    img.save(buffer, format="JPEG", quality=95, exif=exif)
+    return buffer.getvalue()
+
+
+def bench_image(n):
+    """收據照片前處理：12MP 照片縮圖、轉正、重新壓縮後的大小與耗時"""
+    photo = make_receipt_photo()
+    print(f"[image] synthetic 4000x3000 receipt photo, {len(photo) / 1024:.0f} KB")
+    for options in ({}, {"grayscale": True}, {"image_format": "WEBP"}, {"max_edge": 1200, "quality": 70}):
+        data, mime_type, stats = preprocess_receipt_image(photo, **options)
+        # EXIF 轉正後應為直式
+        expect(stats["size"][0] < stats["size"][1], f"image: EXIF orientation not applied {stats}")
+        print(f"  {str(options or 'default'):<34} {mime_type:<10} {stats['size'][0]}x{stats['size'][1]} "
+              f"{stats['bytes'] / 1024:.0f} KB ({stats['saved_ratio']:.0%} saved), {stats['elapsed_ms']:.0f} ms")
+
+
+def bench_dedupe(n):
+    """收據感知雜湊快取：同一張照片重新壓縮 / 縮圖後要命中，不同照片不可誤判，且筆數有上限"""
+    n_photos = min(max(n // 200, 5), 20)
+    photos = [make_receipt_photo(seed=i) for i in range(n_photos)]
+
+    with tempfile.TemporaryDirectory() as folder:
+        cache = ScanCache(os.path.join(folder, "scan_cache.db"), max_entries=n_photos)
+        t0 = time.perf_counter()
+        hashes = [dhash(photo) for photo in photos]
+        hash_time = (time.perf_counter() - t0) / n_photos
+        for i, h in enumerate(hashes):
+            expect(cache.get(h, "receipt") is None, f"dedupe: photo {i} wrongly matched an earlier photo")
+            cache.set(h, "receipt", {"item": f"photo {i}", "amount": i})
+
+        variants = [{"max_edge": 900, "quality": 50}, {"grayscale": True, "image_format": "WEBP"}, {}]
+        distances = []
+        for i, photo in enumerate(photos):
+            for options in variants:
+                h = dhash(preprocess_receipt_image(photo, **options)[0])
+                distances.append(hamming_distance(h, hashes[i]))
+                expect(cache.get(h, "receipt")["amount"] == i, f"dedupe: re-encoded photo {i} not matched")
+        other = min(hamming_distance(a, b) for i, a in enumerate(hashes) for b in hashes[i + 1:])
+
+        # 同一批上傳：重新壓縮的同一張照片歸為同一組，不同照片各自一組
+        reencoded = dhash(preprocess_receipt_image(photos[0], max_edge=900, quality=50)[0])
+        groups = group_similar_hashes([hashes[0], hashes[1], reencoded, None], cache.max_distance)
+        expect(groups == [hashes[0], hashes[1], hashes[0], None], "dedupe: duplicate uploads not grouped")
+
+        cache.set("0" * 64, "receipt", {})
+        with closing(sqlite3.connect(cache.path)) as conn:
+            expect(conn.execute("SELECT COUNT(*) FROM scans").fetchone()[0] == n_photos,
+                   "dedupe: cache exceeded max_entries")
+
+    print(f"[dedupe] {n_photos} synthetic photos, {len(variants)} re-encoded variants each")
+    print(f"  dHash           : {hash_time * 1000:.0f} ms / photo")
+    print(f"  same photo      : max distance {max(distances)} / 256 bits (threshold {cache.max_distance})")
+    print(f"  different photos: min distance {other} / 256 bits")
+
+
+def _open_stress_store(backend, folder):
+    # json 後端一併寫欄式快照 (沒有 pyarrow 時自動略過)，壓縮時與其他程序的讀寫交錯
+    store = open_store(backend, os.path.join(folder, "records.json"),
+                       os.path.join(folder, "budget.json"), os.path.join(folder, "records.db"), arrow=True)
+    if backend in ("json", "sharded"):
+        store.compact_every = 25  # 頻繁壓縮，讓壓縮與其他程序的追加互相交錯
+    return store
+
+
+def to_int(value):
+    return int(float(value))
+
+
+def _stress_worker(args):
+    """壓力測試的子程序：新增、批次新增、搶同一筆紀錄修改、改預算"""
+    backend, folder, worker, count = args
+    store = _open_stress_store(backend, folder)
+    update_conflicts = budget_conflicts = 0
+    for i in range(count):
+        store.add({"品項": f"w{worker}", "分類": CATEGORIES[worker % len(CATEGORIES)],
+                   "金額": i + 1, "日期": f"2025-01-{i % 28 + 1:02d}", "備註": f"{worker}-{i}"})
+        if i % 10 == 0:
+            store.add_many([{"品項": f"w{worker}", "分類": "其他", "金額": 1,
+                             "日期": "2025-02-01", "備註": f"{worker}-{i}-{j}"} for j in range(3)])
+        if i % 5 == 0:
+            # 所有程序搶著修改第 0 筆：看到的內容已過期就要得到 ConflictError，而不是覆蓋
+            key, seen = store.query(keyed=True)[0]
+            try:
+                store.update(key, dict(seen, 金額=to_int(seen["金額"]) + 1), expected=seen)
+            except ConflictError:
+                update_conflicts += 1
+        if i % 20 == 0:
+            budget = store.load_budget()
+            try:
+                store.save_budget(dict(budget, **{f"w{worker}": i}), expected=budget)
+            except ConflictError:
+                budget_conflicts += 1
+    return update_conflicts, budget_conflicts
+
+
+def _check_replay_race(folder):
+    """
+    重播日誌與記下 stat 之間，其他程序剛好追加一筆：
+    這筆不可被當成已套用而略過 (之後的寫入與壓縮都要包含它)
+    """
+    data_path = os.path.join(folder, "records.json")
+    reader, writer = JournalStore(data_path), JournalStore(data_path)
+    reader.add({"品項": "a", "分類": "其他", "金額": 1, "日期": "2025-01-01", "備註": ""})
+
+    replay = reader._replay_from
+
+    def replay_then_append(offset):
+        replay(offset)
+        reader._replay_from = replay
+        writer.add({"品項": "b", "分類": "其他", "金額": 1, "日期": "2025-01-01", "備註": ""})
+
+    writer.add({"品項": "x", "分類": "其他", "金額": 1, "日期": "2025-01-01", "備註": ""})
+    reader._replay_from = replay_then_append
+    reader.load()  # 重播 x 之後，writer 追加 b
+    reader.add({"品項": "c", "分類": "其他", "金額": 1, "日期": "2025-01-01", "備註": ""})
+    reader.compact()
+    items = sorted(r["品項"] for r in JournalStore(data_path).load())
+    expect(items == ["a", "b", "c", "x"], f"replay race: expected a, b, c, x after compaction, got {items}")
+
+
+def _check_stale_budget(backend, folder):
+    """
+    預算頁的情境：A 開啟頁面後，B 儲存了新預算；A 以第一次看到的內容為基準儲存，
+    必須得到 ConflictError，B 的修改不可被覆蓋
+    """
+    a, b = _open_stress_store(backend, folder), _open_stress_store(backend, folder)
+    a.save_budget({"餐飲食品": 5000})
+    base = a.load_budget()  # A 第一次看到的預算
+    b.save_budget({"餐飲食品": 9000}, expected=b.load_budget())
+    try:
+        a.save_budget({"餐飲食品": 1000}, expected=base)
+    except ConflictError:
+        pass
+    else:
+        raise AssertionError(f"{backend}: budget saved over another writer's change with a stale base")
+    expect(b.load_budget() == {"餐飲食品": 9000}, f"{backend}: stale budget save changed the file")
+    # 衝突後以目前檔案內容為基準，再按一次儲存即會覆蓋
+    a.save_budget({"餐飲食品": 1000}, expected=a.load_budget())
+    expect(b.load_budget() == {"餐飲食品": 1000}, f"{backend}: budget not saved after refreshing the base")
+
+
+def bench_stress(n):
+    """多程序同時寫入：不可遺失紀錄、彙總要與紀錄一致、衝突要被偵測而非覆蓋"""
+    with tempfile.TemporaryDirectory() as folder:
+        _check_replay_race(folder)
+    print("[stress] journal appended between replay and stat: no entry skipped")
+
+    for backend in ("json", "sharded", "sqlite"):
+        with tempfile.TemporaryDirectory() as folder:
+            _check_stale_budget(backend, folder)
+    print("[stress] budget saved with a stale base: ConflictError, other writer's budget kept")
+
+    workers = 8
+    count = max(1, min(n // workers, 150))
+    for backend in ("json", "sharded", "sqlite"):
+        with tempfile.TemporaryDirectory() as folder:
+            seed = _open_stress_store(backend, folder)
+            seed.add({"品項": "共用", "分類": "其他", "金額": 0, "日期": "2025-01-01", "備註": "shared"})
+
+            t0 = time.perf_counter()
+            with multiprocessing.Pool(workers) as pool:
+                results = pool.map(_stress_worker, [(backend, folder, w, count) for w in range(workers)])
+            update_conflicts = sum(r[0] for r in results)
+            budget_conflicts = sum(r[1] for r in results)
+            elapsed = time.perf_counter() - t0
+
+            store = _open_stress_store(backend, folder)
+            records = store.load()
+            notes = [r["備註"] for r in records]
+            expected_notes = {"shared"} | {
+                f"{w}-{i}" for w in range(workers) for i in range(count)
+            } | {
+                f"{w}-{i}-{j}" for w in range(workers) for i in range(0, count, 10) for j in range(3)
+            }
+            expect(len(notes) == len(set(notes)) and set(notes) == expected_notes,
+                   f"{backend}: {len(expected_notes - set(notes))} records lost, {len(notes) - len(set(notes))} duplicated")
+
+            shared = next(r for r in records if r["備註"] == "shared")
+            updates = sum(1 for w in range(workers) for i in range(0, count, 5))
+            budget_saves = sum(1 for w in range(workers) for i in range(0, count, 20))
+            # 每次成功的修改都 +1，所以最終金額必須等於成功次數 (沒有被覆蓋掉的更新)
+            expect(to_int(shared["金額"]) == updates - update_conflicts, f"{backend}: lost updates")
+            expect(len(store.load_budget()) <= workers, f"{backend}: unexpected budget entries")
+            expect(store.category_totals() == Rollup.from_records(records).range_totals(), f"{backend}: rollup mismatch")
+
+            writes = len(expected_notes) - 1 + updates + budget_saves
+            print(f"[stress] {backend}: {workers} processes, {writes} writes in {elapsed:.2f} s "
+                  f"({writes / elapsed:.0f} writes/s), no records lost")
+            print(f"  shared record: {updates - update_conflicts} updates applied, {update_conflicts} stale updates rejected; "
+                  f"budget: {budget_saves - budget_conflicts} saves, {budget_conflicts} rejected")
+
+
+def _without_ids(records):
+    return sorted(json.dumps(dict(r, id=None), ensure_ascii=False, sort_keys=True) for r in records)
+
+
+def bench_shards(n):
+    """依月份分片 vs 單一快照：歷史資料變多時，冷啟動的單月查詢與寫入 (含壓縮) 成本"""
+    n_writes = 300
+    month = "2025-06"
+    start, end = month_range(month)
+    for size in (n // 10, n):
+        records = make_records(size, start=date(2021, 7, 1), days=1461)
+        with tempfile.TemporaryDirectory() as folder:
+            data_path = os.path.join(folder, "records.json")
+            shard_dir = os.path.join(folder, "shards")
+            legacy = JournalStore(data_path, compact_every=10 ** 9)
+            legacy.add_many(records)
+            legacy.compact()
+            # 第一次開啟時自動由 records.json 拆成分片
+            sharded = ShardedStore(shard_dir, legacy_path=data_path)
+
+            # 結果必須相同：單月、跨月 30 天、全部、分類合計
+            for a, b in ((start, end), ("2025-05-17", "2025-06-16"), (None, None)):
+                expect(_without_ids(legacy.query(a, b)) == _without_ids(sharded.query(a, b)),
+                       f"shards: records differ for {a}..{b}")
+                expect(legacy.category_totals(a, b) == sharded.category_totals(a, b),
+                       f"shards: category totals differ for {a}..{b}")
+            expect(legacy.months() == sharded.months(), "shards: months differ")
+
+            # 冷啟動 (新的 store 物件) 後讀取單月
+            t0 = time.perf_counter()
+            JournalStore(data_path).query(start, end)
+            legacy_read = time.perf_counter() - t0
+            t0 = time.perf_counter()
+            ShardedStore(shard_dir).query(start, end)
+            sharded_read = time.perf_counter() - t0
+
+            # 連續寫入當月，每 100 筆壓縮一次 (單一快照要重寫全部歷史，分片只重寫當月)
+            new = [dict(r, 日期=f"{month}-{i % 28 + 1:02d}") for i, r in enumerate(make_records(n_writes, seed=1))]
+            write_times = []
+            for store in (JournalStore(data_path, compact_every=100), ShardedStore(shard_dir, compact_every=100)):
+                t0 = time.perf_counter()
+                for r in new:
+                    store.add(r)
+                write_times.append(time.perf_counter() - t0)
+
+            # 修改日期跨月：紀錄搬到新分片，兩個月份的資料與彙總都要正確
+            sharded = ShardedStore(shard_dir)
+            key, seen = sharded.query(start, end, keyed=True)[0]
+            sharded.update(key, dict(seen, 日期="2025-07-03"), expected=seen)
+            suffix = key.split(":", 1)[1]
+            moved = [r["id"] for r in sharded.query(*month_range("2025-07")) if r["id"].endswith(suffix)]
+            expect(moved == [f"2025-07:{suffix}"], "shards: record not moved to the new month")
+            expect(all(r["id"] != key for r in sharded.query(start, end)), "shards: moved record left in the old month")
+            expect(sharded.count() == size + n_writes, "shards: record count mismatch")
+            fresh = ShardedStore(shard_dir)
+            expect(fresh.has_records() and not fresh._shards, "shards: has_records() opened shards")
+            expect(sharded.category_totals() == Rollup.from_records(sharded.load()).range_totals(),
+                   "shards: rollup mismatch")
+
+        print(f"[shards] {size} records over 4 years; cold {month} read + {n_writes} writes to {month}")
+        print(f"  single snapshot : read {legacy_read * 1000:7.1f} ms, write {write_times[0] / n_writes * 1000:.2f} ms / record")
+        print(f"  monthly shards  : read {sharded_read * 1000:7.1f} ms, write {write_times[1] / n_writes * 1000:.2f} ms / record")
+
+
+def bench_ids(n):
+    """以 id 修改 / 刪除：id 索引直接定位 vs 舊做法 (掃描找位置 + list.pop 搬移後面所有紀錄)"""
+    n_ops = min(500, n // 4)
+    records = make_records(n)
+    rng = random.Random(3)
+
+    with tempfile.TemporaryDirectory() as folder:
+        store = JournalStore(os.path.join(folder, "records.json"), compact_every=10 ** 9)
+        store.add_many(records)
+        ids = [record_id for record_id, _ in store.query(keyed=True)]
+        targets = rng.sample(ids, 2 * n_ops)
+
+        t0 = time.perf_counter()
+        for record_id in targets[:n_ops]:
+            store.update(record_id, dict(store.get(record_id), 金額=1))
+        for record_id in targets[n_ops:]:
+            store.delete(record_id)
+        index_time = time.perf_counter() - t0
+
+        remaining = store.load()
+        expect(len(remaining) == n - n_ops, "ids: wrong number of records after deletes")
+        expect(store.category_totals() == Rollup.from_records(remaining).range_totals(), "ids: rollup mismatch")
+
+    # 舊做法：掃描找到 list 位置，再 pop
+    old = [dict(r, id=record_id) for r, record_id in zip(records, ids)]
+    t0 = time.perf_counter()
+    for record_id in targets[:n_ops]:
+        position = next(i for i, r in enumerate(old) if r["id"] == record_id)
+        old[position] = dict(old[position], 金額=1)
+    for record_id in targets[n_ops:]:
+        position = next(i for i, r in enumerate(old) if r["id"] == record_id)
+        old.pop(position)
+    list_time = time.perf_counter() - t0
+
+    print(f"[ids] {n} records, {n_ops} updates + {n_ops} deletes")
+    print(f"  scan + list.pop : {list_time / (2 * n_ops) * 1000:.3f} ms / op")
+    print(f"  id index        : {index_time / (2 * n_ops) * 1000:.3f} ms / op (includes journal fsync)")
+
+
+BENCHMARKS = {
+    "arrow": bench_arrow,
+    "ids": bench_ids,
+    "image": bench_image,
+    "ledger": bench_ledger,
+    "audio": bench_audio,
+    "classifier": bench_classifier,
+    "dedupe": bench_dedupe,
+    "parser": bench_parser,
+    "pool": bench_pool,
+    "prefix": bench_prefix,
+    "scan": bench_scan,
+    "shards": bench_shards,
+    "stress": bench_stress,
+    "voice": bench_voice,
+}
+
+CHECK_N = 2000  # check 模式的資料筆數：只驗證正確性，不看效能數字
+
+
+def run_checks(n=CHECK_N):
+    """以少量資料執行所有項目的正確性檢查 (不輸出效能數字)，有任何失敗就以非 0 結束"""
+    failures = []
+    for name in sorted(BENCHMARKS):
+        output = io.StringIO()
+        try:
+            with redirect_stdout(output):
+                BENCHMARKS[name](n)
+        except Exception as e:  # 每一項都要跑完，最後一併回報
+            failures.append(name)
+            print(f"[check] {name}: FAILED — {type(e).__name__}: {e}")
+            print(output.getvalue(), end="")
+        else:
+            print(f"[check] {name}: ok")
+    if failures:
+        raise SystemExit(f"{len(failures)} check(s) failed: {', '.join(failures)}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="記帳工具效能 / 正確性檢查")
+    parser.add_argument("name", choices=sorted(BENCHMARKS) + ["all", "check"])
+    parser.add_argument("--n", type=int, default=None, help=f"測試資料筆數 (預設 100000，check 為 {CHECK_N})")
+    args = parser.parse_args()
+
+    if args.name == "check":
+        run_checks(args.n or CHECK_N)
+    else:
+        names = sorted(BENCHMARKS) if args.name == "all" else [args.name]
+        for name in names:
+            BENCHMARKS[name](args.n or 100_000)
@@ -0,0 +1,28 @@
+import argparse
+import json
+
+import arrow_snapshot
+from storage import FileLock, JournalStore, atomic_write
+
+# records.json (含日誌) ⇄ records.arrow 欄式快照，兩者內容完全相同
+# export：併入日誌後同時寫出 records.json 與 records.arrow
+# import：由 records.arrow 還原 records.json (原本的日誌會被視為過期而捨棄)
+
+parser = argparse.ArgumentParser(description="records.json 與 Arrow 欄式快照互轉")
+parser.add_argument("command", choices=["export", "import"])
+parser.add_argument("--data", default="data/records.json")
+parser.add_argument("--arrow", default="data/records.arrow")
+args = parser.parse_args()
+
+if not arrow_snapshot.available():
+    raise SystemExit("需要安裝 pyarrow")
+
+if args.command == "export":
+    store = JournalStore(args.data, arrow_path=args.arrow)
+    store.compact()
+    print(f"Exported {store.count()} records to {args.arrow}")
+else:
+    records = arrow_snapshot.read_records(args.arrow)
+    with FileLock(args.data + ".lock"):
+        atomic_write(args.data, json.dumps(records, ensure_ascii=False, indent=4).encode("utf-8"))
+    print(f"Imported {len(records)} records to {args.data}")
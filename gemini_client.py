@@ -0,0 +1,825 @@
+import hashlib
+import itertools
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import closing
+from datetime import date
+from typing import Literal
+
+from google.genai import Client, types
+from pydantic import BaseModel, ValidationError
+
+from image_utils import hamming_distance
+from storage import CATEGORIES
+
+# ----------------------------------------------------------
+# Gemini API Key 輪替 (GEMINI_API_KEY_A ~ H)
+# ----------------------------------------------------------
+# KeyPool 在模組層級保留每組 Key 的 Client (重用連線)，
+# 並記錄哪些 Key 遇到 429 正在冷卻，下次呼叫從最健康的 Key 開始，
+# 不必每次都先在已耗盡的 Key A 上白跑一趟。
+
+DEFAULT_COOLDOWN = 60  # 秒；錯誤訊息沒有 retryDelay 時使用
+
+# 每組 Key 的用量上限 (可在 .env 以 GEMINI_RPM / GEMINI_RPD 調整)，0 表示不限制
+DEFAULT_RPM = 10
+DEFAULT_RPD = 250
+DEFAULT_MAX_WAIT = 5  # 秒；所有 Key 都沒額度時最多排隊等待多久
+
+PARSE_CACHE_PATH = "data/parse_cache.db"
+# 解析提示詞 / 回應格式 (Expense、ExpenseList) 改變時遞增：快取 key 含此版本，舊格式的結果不再沿用
+PARSE_CACHE_VERSION = 2
+SCAN_CACHE_PATH = "data/scan_cache.db"
+ANALYSIS_CACHE_PATH = "data/analysis_cache.db"
+
+# 多張收據同時辨識的預設併發數 (實際上限也受 Key 數量與 RPM 影響)
+SCAN_MAX_WORKERS = 4
+
+
+def is_quota_error(error_msg):
+    return "429" in error_msg or "RESOURCE_EXHAUSTED" in error_msg
+
+
+def parse_retry_delay(error_msg):
+    """從 429 錯誤訊息取出建議的等待秒數 (例如 'retryDelay': '23s')"""
+    match = re.search(r"retryDelay['\"]?\s*[:=]\s*['\"]?(\d+(?:\.\d+)?)s", error_msg)
+    return float(match.group(1)) if match else None
+
+
+class TokenBucket:
+    """
+    Token bucket：容量 capacity，每 per_seconds 秒補滿
+    例如 RPM=10 → 容量 10、每 6 秒補 1 個
+    """
+
+    def __init__(self, capacity, per_seconds, now):
+        self.capacity = capacity
+        self.rate = capacity / per_seconds
+        self.tokens = float(capacity)
+        self.updated = now
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def level(self, now):
+        self._refill(now)
+        return self.tokens
+
+    def wait_time(self, now):
+        """距離有 1 個 token 還要幾秒"""
+        self._refill(now)
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def take(self, now):
+        self._refill(now)
+        self.tokens -= 1
+
+
+class KeyPool:
+    """
+    API Key 池
+    - 每組 Key 只建立一次 Client
+    - 429 後標記冷卻到期時間，期間排到最後
+    - 排序：未冷卻的 Key 依連續失敗次數、最近成功時間；冷卻中的依到期時間
+    - 每組 Key 有 RPM / RPD 兩個 token bucket，呼叫前先分配到還有額度的 Key，
+      全部用完時短暫排隊，避免以 429 才得知額度耗盡 (僅限本程序內的用量)
+    """
+
+    def __init__(self, keys, client_factory=Client, cooldown=DEFAULT_COOLDOWN,
+                 rpm=DEFAULT_RPM, rpd=DEFAULT_RPD, max_wait=DEFAULT_MAX_WAIT,
+                 clock=time.monotonic, sleep=time.sleep):
+        self.keys = list(keys)
+        self.client_factory = client_factory
+        self.cooldown = cooldown
+        self.rpm = rpm
+        self.rpd = rpd
+        self.max_wait = max_wait
+        self.clock = clock
+        self.sleep = sleep
+
+        now = self.clock()
+        self._buckets = {}
+        for k in self.keys:
+            buckets = []
+            if rpm:
+                buckets.append(TokenBucket(rpm, 60, now))
+            if rpd:
+                buckets.append(TokenBucket(rpd, 86400, now))
+            self._buckets[k] = buckets
+
+        self._clients = {}
+        self._cooldown_until = {}
+        self._failures = {k: 0 for k in self.keys}
+        self._last_success = {k: 0.0 for k in self.keys}
+        self._lock = threading.Lock()
+
+    def client(self, key):
+        with self._lock:
+            if key not in self._clients:
+                self._clients[key] = self.client_factory(api_key=key)
+            return self._clients[key]
+
+    def ordered_keys(self):
+        now = self.clock()
+        with self._lock:
+            healthy = [k for k in self.keys if self._cooldown_until.get(k, 0) <= now]
+            cooling = [k for k in self.keys if self._cooldown_until.get(k, 0) > now]
+            healthy.sort(key=lambda k: (self._failures[k], -self._last_success[k]))
+            cooling.sort(key=lambda k: self._cooldown_until[k])
+        return healthy + cooling
+
+    def acquire(self, exclude=()):
+        """
+        分配一組還有額度的 Key 並扣掉 1 次用量
+        - 優先未冷卻、失敗少的 Key，同等級中選剩餘額度比例最高的，讓連續請求分散到各 Key
+        - 都沒有額度時等待最早補充的 Key，超過 max_wait 就直接回傳最健康的 Key
+        """
+        waited = 0.0
+        while True:
+            candidates = [k for k in self.ordered_keys() if k not in exclude]
+            if not candidates:
+                return None
+            with self._lock:
+                now = self.clock()
+                waits = {k: max((b.wait_time(now) for b in self._buckets[k]), default=0.0) for k in candidates}
+                ready = [k for k in candidates if waits[k] == 0]
+                if ready:
+                    best = min(ready, key=lambda k: (
+                        self._cooldown_until.get(k, 0) > now,
+                        self._failures[k],
+                        -min((b.tokens / b.capacity for b in self._buckets[k]), default=1.0),
+                    ))
+                    for b in self._buckets[best]:
+                        b.take(now)
+                    return best
+                wait = min(waits.values())
+            if waited + wait > self.max_wait:
+                return candidates[0]
+            self.sleep(wait)
+            waited += wait
+
+    def bucket_levels(self):
+        """各 Key 目前剩餘的 RPM / RPD 額度 (供監控)"""
+        now = self.clock()
+        with self._lock:
+            levels = []
+            for i, k in enumerate(self.keys):
+                buckets = iter(self._buckets[k])
+                levels.append({
+                    "key": i,
+                    "rpm": round(next(buckets).level(now), 1) if self.rpm else None,
+                    "rpd": round(next(buckets).level(now), 1) if self.rpd else None,
+                })
+            return levels
+
+    def mark_success(self, key):
+        with self._lock:
+            self._failures[key] = 0
+            self._last_success[key] = self.clock()
+            self._cooldown_until.pop(key, None)
+
+    def mark_exhausted(self, key, retry_after=None):
+        with self._lock:
+            self._failures[key] += 1
+            self._cooldown_until[key] = self.clock() + (retry_after or self.cooldown)
+
+    def status(self):
+        """各 Key 的狀態 (供側邊欄監控)，Key 以索引代替避免外洩"""
+        now = self.clock()
+        with self._lock:
+            return [
+                {
+                    "key": i,
+                    "cooldown": max(0.0, self._cooldown_until.get(k, 0) - now),
+                    "failures": self._failures[k],
+                }
+                for i, k in enumerate(self.keys)
+            ]
+
+    def generate(self, contents, model_name, **kwargs):
+        """依健康度依序嘗試各 Key，遇到 429 換下一組；回傳 (response, error)"""
+        return self._rotate(lambda client: client.models.generate_content(
+            model=model_name,
+            contents=contents,
+            **kwargs
+        ))
+
+    def generate_stream(self, contents, model_name, **kwargs):
+        """
+        串流版 generate：回傳 (逐段文字的 iterator, error)
+        先收到第一段才回傳，所以 429 (在第一段之前發生) 仍會換 Key 重試；
+        開始輸出後才發生的錯誤會在迭代時拋出
+        """
+        def start(client):
+            chunks = iter(client.models.generate_content_stream(
+                model=model_name,
+                contents=contents,
+                **kwargs
+            ))
+            first = next(chunks, None)
+            return _stream_text(first, chunks)
+
+        return self._rotate(start)
+
+    def _rotate(self, call):
+        """以 call(client) 依序嘗試各 Key，遇到 429 換下一組；回傳 (結果, error)"""
+        if not self.keys:
+            return None, "未設定任何 API Key (GEMINI_API_KEY_A~H)"
+
+        last_error = ""
+        tried = set()
+        while len(tried) < len(self.keys):
+            key = self.acquire(exclude=tried)
+            tried.add(key)
+            i = self.keys.index(key)
+            try:
+                result = call(self.client(key))
+                self.mark_success(key)
+                return result, None
+
+            except Exception as e:
+                error_msg = str(e)
+                last_error = error_msg
+                # 如果是 429 (Resource Exhausted) 就標記冷卻並試下一個
+                if is_quota_error(error_msg):
+                    self.mark_exhausted(key, parse_retry_delay(error_msg))
+                    print(f"Key {i} (Index {i}) 額度耗盡，切換下一組...")
+                    continue
+                else:
+                    # 其他錯誤 (如 500, 400) 直接回傳，不輪替
+                    return None, f"API Error: {error_msg}"
+
+        # 迴圈跑完都沒成功
+        return None, f"所有 API Key 額度皆已耗盡或失敗。Last Error: {last_error}"
+
+
+def _stream_text(first, rest):
+    """串流回應 → 逐段文字 (略過沒有文字的片段)"""
+    if first is None:
+        return
+    for chunk in itertools.chain([first], rest):
+        if chunk.text:
+            yield chunk.text
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def load_keys():
+    # 載入 A~H 的 Keys，過濾掉沒設定的空值
+    keys = [os.getenv(f"GEMINI_API_KEY_{c}") for c in "ABCDEFGH"]
+    return [k for k in keys if k]
+
+
+def get_pool():
+    """模組層級共用的 KeyPool；.env 的 Key 有變動時重建"""
+    global _pool
+    keys = load_keys()
+    with _pool_lock:
+        if _pool is None or _pool.keys != keys:
+            _pool = KeyPool(
+                keys,
+                rpm=int(os.getenv("GEMINI_RPM", DEFAULT_RPM)),
+                rpd=int(os.getenv("GEMINI_RPD", DEFAULT_RPD)),
+            )
+        return _pool
+
+
+def call_gemini_rotated(contents, model_name="gemini-2.5-flash", **kwargs):
+    """
+    自動輪替 GEMINI_API_KEY_A ~ H
+    若遇到 429 錯誤則切換下一組 Key，並記住該 Key 冷卻中
+    """
+    return get_pool().generate(contents, model_name, **kwargs)
+
+
+def call_gemini_stream(contents, model_name="gemini-2.5-flash", **kwargs):
+    """串流版 call_gemini_rotated，回傳 (逐段文字的 iterator, error)"""
+    return get_pool().generate_stream(contents, model_name, **kwargs)
+
+
+# ----------------------------------------------------------
+# 結構化輸出 (JSON mode + response schema)
+# ----------------------------------------------------------
+# 所有需要 JSON 的呼叫都帶上 response_schema，由模型端限制輸出格式，
+# 再用 pydantic 驗證；驗證失敗時附上錯誤訊息自動重試一次。
+
+Category = Literal[tuple(CATEGORIES)]
+
+
+class Expense(BaseModel):
+    item: str
+    amount: int
+    category: Category
+
+
+class ExpenseList(BaseModel):
+    items: list[Expense]
+
+
+class VoiceExpense(BaseModel):
+    transcript: str
+    item: str
+    amount: int
+    category: Category
+
+
+class ReceiptExpense(Expense):
+    date: date
+
+
+class Receipt(BaseModel):
+    date: date
+    items: list[Expense]
+
+
+class ReceiptList(BaseModel):
+    receipts: list[Receipt]
+
+
+STRUCTURED_RETRY_NOTE = """
+⚠️ 上一次的回覆不符合指定的 JSON 結構，驗證錯誤如下：
+{error}
+請只輸出符合結構的 JSON；category 只能是：{categories}
+"""
+
+
+class ParseStats:
+    """結構化輸出的解析統計 (供側邊欄顯示解析失敗率)"""
+
+    def __init__(self):
+        self.requests = 0
+        self.first_try_failures = 0  # 第一次回覆驗證失敗 (觸發重試)
+        self.failures = 0            # 重試後仍失敗
+        self._lock = threading.Lock()
+
+    def record(self, first_try_ok, ok):
+        with self._lock:
+            self.requests += 1
+            self.first_try_failures += not first_try_ok
+            self.failures += not ok
+
+    def stats(self):
+        with self._lock:
+            total = self.requests or 1
+            return {
+                "requests": self.requests,
+                "first_try_failures": self.first_try_failures,
+                "failures": self.failures,
+                "first_try_failure_rate": self.first_try_failures / total,
+                "failure_rate": self.failures / total,
+            }
+
+
+parse_stats = ParseStats()
+
+
+def _append_note(contents, note):
+    if isinstance(contents, str):
+        return contents + "\n" + note
+    return list(contents) + [note]
+
+
+def generate_structured(schema, contents, model_name="gemini-2.5-flash", pool=None):
+    """
+    以 JSON mode + response schema 呼叫 Gemini，並用 schema (pydantic model) 驗證
+    回傳 (model 實例, error)；驗證失敗會附上錯誤訊息重試一次，API 錯誤不重試
+    """
+    pool = pool or get_pool()
+    config = types.GenerateContentConfig(
+        response_mime_type="application/json",
+        response_schema=schema,
+    )
+
+    first_try_ok = True
+    for attempt in range(2):
+        response, error = pool.generate(contents, model_name, config=config)
+        if error:
+            # API 錯誤 (額度、網路) 不算解析失敗
+            return None, error
+        try:
+            result = schema.model_validate_json(response.text)
+            parse_stats.record(first_try_ok, True)
+            return result, None
+        except (ValidationError, ValueError) as e:
+            first_try_ok = False
+            error = f"JSON Parsing Error: {e}"
+            contents = _append_note(contents, STRUCTURED_RETRY_NOTE.format(
+                error=e, categories=", ".join(CATEGORIES)
+            ))
+
+    parse_stats.record(False, False)
+    return None, error
+
+
+# ----------------------------------------------------------
+# 解析結果快取 (記憶體 LRU + 磁碟 SQLite)
+# ----------------------------------------------------------
+def normalize_text(text):
+    """快取 key 用：全形轉半形、去頭尾空白、合併連續空白、英文轉小寫"""
+    text = unicodedata.normalize("NFKC", text)
+    return " ".join(text.split()).lower()
+
+
+class ResponseCache:
+    """
+    兩層快取
+    - 第一層：記憶體 LRU，最多 max_memory 筆
+    - 第二層：SQLite 檔，最多 max_disk 筆，跨 session / 重啟保留
+    - 超過 ttl 秒的項目視為過期
+    命中 / 未命中次數記在 stats()
+    """
+
+    def __init__(self, path, max_memory=256, max_disk=5000, ttl=30 * 86400, clock=time.time):
+        self.path = path
+        self.max_memory = max_memory
+        self.max_disk = max_disk
+        self.ttl = ttl
+        self.clock = clock
+
+        self._memory = OrderedDict()  # key -> (created, value)
+        self._lock = threading.Lock()
+        self.hits_memory = 0
+        self.hits_disk = 0
+        self.misses = 0
+
+        folder = os.path.dirname(self.path)
+        if folder:
+            os.makedirs(folder, exist_ok=True)
+        with closing(sqlite3.connect(self.path)) as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS cache ("
+                "key TEXT PRIMARY KEY, value TEXT NOT NULL, created REAL NOT NULL, accessed REAL NOT NULL)"
+            )
+
+    @staticmethod
+    def make_key(text, model_name):
+        return hashlib.sha1(f"{model_name}\n{normalize_text(text)}".encode("utf-8")).hexdigest()
+
+    def get(self, key):
+        now = self.clock()
+        with self._lock:
+            item = self._memory.get(key)
+            if item is not None and now - item[0] <= self.ttl:
+                self._memory.move_to_end(key)
+                self.hits_memory += 1
+                return json.loads(item[1])
+            self._memory.pop(key, None)
+
+        with closing(sqlite3.connect(self.path)) as conn, conn:
+            row = conn.execute("SELECT value, created FROM cache WHERE key = ?", (key,)).fetchone()
+            if row is not None and now - row[1] <= self.ttl:
+                conn.execute("UPDATE cache SET accessed = ? WHERE key = ?", (now, key))
+            else:
+                row = None
+
+        with self._lock:
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits_disk += 1
+            self._remember(key, row[1], row[0])
+        return json.loads(row[0])
+
+    def set(self, key, value):
+        now = self.clock()
+        raw = json.dumps(value, ensure_ascii=False)
+        with self._lock:
+            self._remember(key, now, raw)
+        with closing(sqlite3.connect(self.path)) as conn, conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO cache (key, value, created, accessed) VALUES (?, ?, ?, ?)",
+                (key, raw, now, now),
+            )
+            # 清掉過期項目，並只保留最近使用的 max_disk 筆
+            conn.execute("DELETE FROM cache WHERE created < ?", (now - self.ttl,))
+            conn.execute(
+                "DELETE FROM cache WHERE key IN "
+                "(SELECT key FROM cache ORDER BY accessed DESC LIMIT -1 OFFSET ?)",
+                (self.max_disk,),
+            )
+
+    def _remember(self, key, created, raw):
+        self._memory[key] = (created, raw)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_memory:
+            self._memory.popitem(last=False)
+
+    def stats(self):
+        with self._lock:
+            total = self.hits_memory + self.hits_disk + self.misses
+            return {
+                "memory_hits": self.hits_memory,
+                "disk_hits": self.hits_disk,
+                "misses": self.misses,
+                "hit_rate": (self.hits_memory + self.hits_disk) / total if total else 0.0,
+                "memory_size": len(self._memory),
+            }
+
+
+class ScanCache:
+    """
+    收據辨識結果快取，以圖片的感知雜湊 (dHash) 為 key
+    - 同一張收據重新上傳、重新壓縮或縮放後雜湊仍相近，
+      漢明距離在 max_distance 以內就直接回傳上次的辨識結果
+    - 存在 SQLite，跨 session 保留，只保留最近使用的 max_entries 筆
+    - kind 區分辨識模式 (整張收據 / 逐項明細)，兩者結果格式不同
+    """
+
+    def __init__(self, path, max_entries=500, max_distance=12, clock=time.time):
+        self.path = path
+        self.max_entries = max_entries
+        self.max_distance = max_distance
+        self.clock = clock
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+        folder = os.path.dirname(self.path)
+        if folder:
+            os.makedirs(folder, exist_ok=True)
+        with closing(sqlite3.connect(self.path)) as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS scans ("
+                "hash TEXT NOT NULL, kind TEXT NOT NULL, value TEXT NOT NULL, accessed REAL NOT NULL, "
+                "PRIMARY KEY (hash, kind))"
+            )
+
+    def get(self, image_hash, kind):
+        """找雜湊最接近的一筆；距離超過門檻視為未命中"""
+        with closing(sqlite3.connect(self.path)) as conn, conn:
+            rows = conn.execute("SELECT hash, value FROM scans WHERE kind = ?", (kind,)).fetchall()
+            best = min(rows, key=lambda row: hamming_distance(row[0], image_hash), default=None)
+            if best is not None and hamming_distance(best[0], image_hash) <= self.max_distance:
+                conn.execute(
+                    "UPDATE scans SET accessed = ? WHERE hash = ? AND kind = ?",
+                    (self.clock(), best[0], kind),
+                )
+            else:
+                best = None
+
+        with self._lock:
+            if best is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+        return json.loads(best[1])
+
+    def set(self, image_hash, kind, value):
+        with closing(sqlite3.connect(self.path)) as conn, conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO scans (hash, kind, value, accessed) VALUES (?, ?, ?, ?)",
+                (image_hash, kind, json.dumps(value, ensure_ascii=False), self.clock()),
+            )
+            conn.execute(
+                "DELETE FROM scans WHERE rowid IN "
+                "(SELECT rowid FROM scans ORDER BY accessed DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,),
+            )
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / total if total else 0.0,
+            }
+
+
+_parse_cache = None
+_scan_cache = None
+_analysis_cache = None
+
+
+def get_parse_cache():
+    global _parse_cache
+    with _pool_lock:
+        if _parse_cache is None:
+            _parse_cache = ResponseCache(PARSE_CACHE_PATH)
+        return _parse_cache
+
+
+def get_scan_cache():
+    global _scan_cache
+    with _pool_lock:
+        if _scan_cache is None:
+            _scan_cache = ScanCache(SCAN_CACHE_PATH)
+        return _scan_cache
+
+
+def get_analysis_cache():
+    """AI 帳目分析報告的快取 (key 為當月紀錄 + 預算的雜湊，資料沒變就直接重用)"""
+    global _analysis_cache
+    with _pool_lock:
+        if _analysis_cache is None:
+            _analysis_cache = ResponseCache(ANALYSIS_CACHE_PATH, max_memory=16, max_disk=200)
+        return _analysis_cache
+
+
+def parse_item_amount_gemini(text: str, model_name="gemini-2.5-flash") -> dict:
+    """解析一句自然語言為 品項 / 金額 / 分類；相同輸入直接取快取結果"""
+    cache = get_parse_cache()
+    cache_key = cache.make_key(text, f"{model_name}:v{PARSE_CACHE_VERSION}")
+    cached = cache.get(cache_key)
+    if cached is not None:
+        return cached
+
+    prompt = f"""
+你是一個拆解句子的助理。
+你會收到一段生活化的文字，請先理解語意，解析出：
+1. 品項 item
+2. 金額 amount
+3. 自動分類 category（餐飲食品, 交通運輸, 居家生活, 服飾購物, 休閒娛樂, 醫療保健, 投資儲蓄, 其他）
+
+請解析以下文字：
+{text}
+"""
+    parsed, error = generate_structured(Expense, prompt, model_name)
+
+    if error:
+        return {"item": "", "amount": 0, "error": error}
+
+    result = parsed.model_dump(mode="json")
+    # 只快取成功的解析結果
+    cache.set(cache_key, result)
+    return result
+
+
+def parse_items_batch_gemini(text: str, model_name="gemini-2.5-flash") -> dict:
+    """一次解析多筆支出 (一次 API 呼叫)，回傳 {"items": [{"item", "amount", "category"}, ...]}"""
+    cache = get_parse_cache()
+    cache_key = cache.make_key(text, f"{model_name}:batch:v{PARSE_CACHE_VERSION}")
+    cached = cache.get(cache_key)
+    if cached is not None:
+        return {"items": cached}
+
+    prompt = f"""
+你是一個拆解句子的助理。
+你會收到一段生活化的文字，裡面可能包含「多筆」消費，請逐筆解析出：
+1. 品項 item
+2. 金額 amount
+3. 自動分類 category（餐飲食品, 交通運輸, 居家生活, 服飾購物, 休閒娛樂, 醫療保健, 投資儲蓄, 其他）
+每筆消費一個物件，放在 items 陣列中。
+
+請解析以下文字：
+{text}
+"""
+    parsed, error = generate_structured(ExpenseList, prompt, model_name)
+
+    if error:
+        return {"items": [], "error": error}
+
+    items = parsed.model_dump(mode="json")["items"]
+    cache.set(cache_key, items)
+    return {"items": items}
+
+
+# ----------------------------------------------------------
+# 語音記帳
+# ----------------------------------------------------------
+STT_PROMPT = "請準確聽打這段錄音的內容，直接輸出繁體中文文字，不要任何其他說明。"
+
+VOICE_PROMPT = """
+你是一個記帳助理。請先準確聽打這段錄音 (繁體中文)，再從內容解析出一筆消費：
+1. 逐字稿 transcript
+2. 品項 item
+3. 金額 amount
+4. 自動分類 category（餐飲食品, 交通運輸, 居家生活, 服飾購物, 休閒娛樂, 醫療保健, 投資儲蓄, 其他）
+"""
+
+
+def transcribe_audio_gemini(audio_bytes, mime_type, model_name="gemini-2.5-flash", pool=None):
+    """語音轉文字 (STT)，回傳 (逐字稿, error)"""
+    response, error = (pool or get_pool()).generate(
+        [
+            STT_PROMPT,
+            types.Part.from_bytes(data=audio_bytes, mime_type=mime_type)
+        ],
+        model_name
+    )
+    if error:
+        return "", error
+    return response.text.strip(), None
+
+
+def voice_to_record_gemini(audio_bytes, mime_type, model_name="gemini-2.5-flash", pool=None):
+    """
+    一次呼叫完成聽打 + 解析，回傳 {"transcript", "item", "amount", "category"}，失敗時含 "error"
+    (相較先 STT 再解析，少一次往返與一次額度)
+    """
+    parsed, error = generate_structured(
+        VoiceExpense,
+        [
+            VOICE_PROMPT,
+            types.Part.from_bytes(data=audio_bytes, mime_type=mime_type)
+        ],
+        model_name,
+        pool
+    )
+    if error:
+        return {"error": error}
+    return parsed.model_dump(mode="json")
+
+
+# ----------------------------------------------------------
+# 收據 / 發票辨識
+# ----------------------------------------------------------
+RECEIPT_PROMPT = """
+請辨識這張圖片中的收據或發票內容，提取以下資訊：
+1. 品項 (Summarize main item or describe the expense. If text is blurry or missing, describe it as "未知品項")
+2. 金額 (Total amount, integer only)
+3. 日期 (Format: YYYY-MM-DD, if not found use today's date)
+4. 分類 (Choose from: 餐飲食品, 交通運輸, 居家生活, 服飾購物, 休閒娛樂, 醫療保健, 投資儲蓄, 其他)
+
+⚠️ Important: If the item name is missing, unclear, or you are not 100% sure about the category, you MUST set "category" to "其他". Do not guess random categories.
+"""
+
+
+def extract_receipt_gemini(image_bytes, mime_type, model_name="gemini-2.5-flash", pool=None):
+    """辨識一張收據，回傳 {"item", "amount", "date", "category"}，失敗時含 "error" """
+    parsed, error = generate_structured(
+        ReceiptExpense,
+        [
+            RECEIPT_PROMPT,
+            types.Part.from_bytes(data=image_bytes, mime_type=mime_type)
+        ],
+        model_name,
+        pool
+    )
+
+    if error:
+        return {"error": error}
+    return parsed.model_dump(mode="json")
+
+
+LINE_ITEMS_PROMPT = """
+請辨識這張圖片中「所有」收據或發票 (一張圖可能有多張)，並列出每張收據上的「每一個品項」：
+- 品項 item (each line item's name. If text is blurry, describe it as "未知品項")
+- 金額 amount (the line item's price, integer only; discounts as negative numbers)
+- 分類 category (Choose from: 餐飲食品, 交通運輸, 居家生活, 服飾購物, 休閒娛樂, 醫療保健, 投資儲蓄, 其他)
+- 每張收據的日期 date (Format: YYYY-MM-DD, if not found use today's date)
+
+⚠️ Important: If you are not 100% sure about a line item's category, you MUST set "category" to "其他". Do not guess random categories.
+If the line items cannot be read, output one item with the receipt's total amount.
+"""
+
+
+def extract_line_items_gemini(image_bytes, mime_type, model_name="gemini-2.5-flash", pool=None):
+    """
+    一次呼叫辨識圖中所有收據的所有品項
+    回傳 {"items": [{"item", "amount", "date", "category", "receipt"}, ...]}，
+    receipt 為第幾張收據 (從 1 開始)；失敗時含 "error"
+    """
+    parsed, error = generate_structured(
+        ReceiptList,
+        [
+            LINE_ITEMS_PROMPT,
+            types.Part.from_bytes(data=image_bytes, mime_type=mime_type)
+        ],
+        model_name,
+        pool
+    )
+
+    if error:
+        return {"items": [], "error": error}
+
+    items = []
+    for n, receipt in enumerate(parsed.model_dump(mode="json")["receipts"], 1):
+        for line in receipt["items"]:
+            items.append(dict(line, date=receipt["date"], receipt=n))
+    return {"items": items}
+
+
+def extract_receipts_concurrently(images, max_workers=SCAN_MAX_WORKERS, extract=extract_receipt_gemini, keys=None, **kwargs):
+    """
+    同時辨識多張收據 (有上限的執行緒池，請求由 KeyPool 分散到各組 Key)
+    images 為 [(image_bytes, mime_type), ...]；依完成順序 yield (索引, 結果)，
+    呼叫端可以邊收到邊顯示
+    keys (與 images 等長，例如感知雜湊)：key 相同的圖片只辨識一次，結果 yield 給每個索引
+    """
+    groups = {}
+    for i, key in enumerate(keys if keys is not None else range(len(images))):
+        groups.setdefault(key, []).append(i)
+
+    with ThreadPoolExecutor(max_workers=max(1, max_workers)) as executor:
+        futures = {
+            executor.submit(extract, *images[indices[0]], **kwargs): indices
+            for indices in groups.values()
+        }
+        for future in as_completed(futures):
+            try:
+                result = future.result()
+            except Exception as e:
+                result = {"error": str(e)}
+            for i in futures[future]:
+                yield i, result
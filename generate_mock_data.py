@@ -7,6 +7,7 @@ start_date = date(2025, 9, 1)
 end_date = date(2025, 12, 10)
 
 # 分類與對應的常見項目與金額範圍 (min, max)
+# (local_parser.py 也以這些項目作為分類關鍵字的初始字典)
 categories = {
     "餐飲食品": [
         ("早餐蛋餅+紅茶", 35, 50), ("學餐便當", 60, 80), ("校外小吃", 80, 100),
@@ -39,70 +40,71 @@ categories = {
     ]
 }
 
-data = []
+if __name__ == "__main__":
+    data = []
 
-current_date = start_date
-while current_date <= end_date:
-    
-    # 每天隨機產生 1-4 筆消費
-    num_records = random.randint(1, 4)
-    
-    # 周末可能花比較多
-    if current_date.weekday() >= 5: 
-        num_records += random.randint(0, 2)
+    current_date = start_date
+    while current_date <= end_date:
 
-    for _ in range(num_records):
-        # 較高機率是吃的
-        if random.random() < 0.6:
-            cat = "餐飲食品"
-        else:
-            cat = random.choice(list(categories.keys()))
-            
-        item_choice = random.choice(categories[cat])
-        item_name = item_choice[0]
-        amount = random.randint(item_choice[1], item_choice[2])
-        
-        # 稍微調整項目名稱增添變化
-        if cat == "餐飲食品" and amount > 150:
-             note = "偶爾吃好點"
-        else:
-             note = ""
+        # 每天隨機產生 1-4 筆消費
+        num_records = random.randint(1, 4)
 
-        record = {
-            "品項": item_name,
-            "分類": cat,
-            "金額": amount,
-            "日期": str(current_date),
-            "備註": note
-        }
-        data.append(record)
-    
-    # 每月固定支出 (假設每月 5 號)
-    if current_date.day == 5:
-        # 房租
-        data.append({
-            "品項": "房租",
-            "分類": "居家生活",
-            "金額": 5500,
-            "日期": str(current_date),
-            "備註": "固定支出"
-        })
-        # 手機費
-        data.append({
-            "品項": "手機費",
-            "分類": "居家生活",
-            "金額": 499,
-            "日期": str(current_date),
-            "備註": "自動扣款"
-        })
+        # 周末可能花比較多
+        if current_date.weekday() >= 5: 
+            num_records += random.randint(0, 2)
 
-    current_date += timedelta(days=1)
+        for _ in range(num_records):
+            # 較高機率是吃的
+            if random.random() < 0.6:
+                cat = "餐飲食品"
+            else:
+                cat = random.choice(list(categories.keys()))
 
-# Sort by date
-data.sort(key=lambda x: x["日期"])
+            item_choice = random.choice(categories[cat])
+            item_name = item_choice[0]
+            amount = random.randint(item_choice[1], item_choice[2])
 
-file_path = "data/records.json"
-with open(file_path, "w", encoding="utf-8") as f:
-    json.dump(data, f, ensure_ascii=False, indent=4)
+            # 稍微調整項目名稱增添變化
+            if cat == "餐飲食品" and amount > 150:
+                 note = "偶爾吃好點"
+            else:
+                 note = ""
 
-print(f"Generated {len(data)} records to {file_path}")
+            record = {
+                "品項": item_name,
+                "分類": cat,
+                "金額": amount,
+                "日期": str(current_date),
+                "備註": note
+            }
+            data.append(record)
+
+        # 每月固定支出 (假設每月 5 號)
+        if current_date.day == 5:
+            # 房租
+            data.append({
+                "品項": "房租",
+                "分類": "居家生活",
+                "金額": 5500,
+                "日期": str(current_date),
+                "備註": "固定支出"
+            })
+            # 手機費
+            data.append({
+                "品項": "手機費",
+                "分類": "居家生活",
+                "金額": 499,
+                "日期": str(current_date),
+                "備註": "自動扣款"
+            })
+
+        current_date += timedelta(days=1)
+
+    # Sort by date
+    data.sort(key=lambda x: x["日期"])
+
+    file_path = "data/records.json"
+    with open(file_path, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False, indent=4)
+
+    print(f"Generated {len(data)} records to {file_path}")
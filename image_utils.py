@@ -0,0 +1,97 @@
+import io
+import time
+
+from PIL import Image, ImageOps
+
+# ----------------------------------------------------------
+# 收據照片前處理 (送去辨識前縮圖、轉正、重新壓縮)
+# ----------------------------------------------------------
+RECEIPT_MAX_EDGE = 1600  # 長邊像素；收據文字在 1600px 仍清楚可辨
+RECEIPT_QUALITY = 80
+IMAGE_FORMATS = {"JPEG": "image/jpeg", "WEBP": "image/webp"}
+EXIF_ORIENTATION = 0x0112
+
+
+def preprocess_receipt_image(image_bytes, mime_type="image/jpeg", max_edge=RECEIPT_MAX_EDGE,
+                             grayscale=False, image_format="JPEG", quality=RECEIPT_QUALITY):
+    """
+    依 EXIF 轉正 → 長邊縮到 max_edge → (可選) 灰階 → 以 JPEG / WebP 重新壓縮
+    回傳 (image_bytes, mime_type, 統計)；處理後反而變大且不需轉正、縮圖時沿用原檔
+    """
+    t0 = time.perf_counter()
+    with Image.open(io.BytesIO(image_bytes)) as original:
+        original_size = original.size
+        rotated = original.getexif().get(EXIF_ORIENTATION, 1) != 1
+        resized = max(original_size) > max_edge
+
+        if original.format == "JPEG" and resized:
+            # JPEG 可在解碼時直接縮小 (1/2、1/4、1/8)，省下解碼完整 12MP 的時間
+            scale = max_edge / max(original_size)
+            original.draft(original.mode, (int(original_size[0] * scale), int(original_size[1] * scale)))
+        img = ImageOps.exif_transpose(original)
+        img = img.convert("L" if grayscale else "RGB")
+        img.thumbnail((max_edge, max_edge), Image.LANCZOS)
+
+        out = io.BytesIO()
+        img.save(out, format=image_format, quality=quality, optimize=True)
+        data, out_mime = out.getvalue(), IMAGE_FORMATS[image_format]
+        size = img.size
+
+    if len(data) >= len(image_bytes) and not rotated and not resized and not grayscale:
+        data, out_mime, size = image_bytes, mime_type, original_size
+
+    return data, out_mime, {
+        "original_bytes": len(image_bytes),
+        "bytes": len(data),
+        "saved_ratio": 1 - len(data) / len(image_bytes),
+        "original_size": original_size,
+        "size": size,
+        "elapsed_ms": (time.perf_counter() - t0) * 1000,
+    }
+
+
+# ----------------------------------------------------------
+# 感知雜湊 (dHash)：同一張收據重新上傳 / 重新壓縮後雜湊仍相近
+# ----------------------------------------------------------
+DHASH_SIZE = 16  # 16 x 16 = 256 bits
+
+
+def dhash(image_bytes, hash_size=DHASH_SIZE):
+    """
+    差異雜湊：轉正、灰階、縮成 (hash_size + 1) x hash_size，
+    每個像素與右邊比較亮暗得到 1 bit，回傳十六進位字串
+    """
+    with Image.open(io.BytesIO(image_bytes)) as img:
+        if img.format == "JPEG":
+            img.draft("L", (hash_size * 8, hash_size * 8))
+        small = ImageOps.exif_transpose(img).convert("L").resize((hash_size + 1, hash_size), Image.LANCZOS)
+        pixels = list(small.getdata())
+
+    bits = 0
+    for row in range(hash_size):
+        offset = row * (hash_size + 1)
+        for col in range(hash_size):
+            bits = (bits << 1) | (pixels[offset + col] < pixels[offset + col + 1])
+    return f"{bits:0{hash_size * hash_size // 4}x}"
+
+
+def hamming_distance(hash_a, hash_b):
+    """兩個 dHash 相差的 bit 數 (越小越像)"""
+    return bin(int(hash_a, 16) ^ int(hash_b, 16)).count("1")
+
+
+def group_similar_hashes(hashes, max_distance):
+    """
+    每個雜湊對應到第一個與它距離在 max_distance 以內的雜湊 (同一批上傳中的重複照片歸為一組)
+    None (無法讀取的圖片) 原樣保留
+    """
+    leaders, groups = [], []
+    for h in hashes:
+        leader = None
+        if h is not None:
+            leader = next((l for l in leaders if hamming_distance(l, h) <= max_distance), None)
+            if leader is None:
+                leaders.append(h)
+                leader = h
+        groups.append(leader)
+    return groups
@@ -0,0 +1,220 @@
+import sys
+from datetime import date
+
+import numpy as np
+import pandas as pd
+
+import arrow_snapshot
+from storage import CATEGORIES
+
+# ----------------------------------------------------------
+# 欄式 (columnar) 記帳資料
+# ----------------------------------------------------------
+# 儲存層回傳的是 list of dict (每筆都帶中文 key 與 Python 物件)，
+# 直接 pd.DataFrame(records) 會得到 object / 字串欄位，百萬筆時佔用大量記憶體。
+# 這裡把紀錄轉成緊湊的欄式表示，頁面使用的 DataFrame 也由此產生：
+#   日期      → int32 天數 (1970-01-01 起算)
+#   金額      → 全為整數時 int32 / int64，否則 float64
+#   分類      → int8 代碼，對應固定的八個分類 (其他值依出現順序附加在後)
+#   品項 / 備註 → 字典編碼 (int32 代碼 + 不重複字串表)
+# 可以只建立部分欄位 (columns)；儲存層有 Arrow 快照時直接由快照讀取需要的欄位。
+
+EPOCH = date(1970, 1, 1)
+COLUMNS = ["品項", "分類", "金額", "日期", "備註"]
+
+
+def _encode(values, table=()):
+    """字典編碼：回傳 (int32 代碼, 字串表)；table 為預先固定順序的值"""
+    index = {v: i for i, v in enumerate(table)}
+    codes = np.fromiter((index.setdefault(v, len(index)) for v in values), dtype=np.int32, count=len(values))
+    return codes, list(index)
+
+
+def _recode(codes, values, table=()):
+    """把 (代碼, 字串表) 換成只含用到的值、並以 table 開頭的新字串表；-1 (缺值) 保留"""
+    used = np.unique(codes[codes >= 0])
+    new_codes, new_table = _encode([values[i] for i in used], table)
+    mapping = np.full(len(values) + 1, -1, dtype=np.int32)
+    mapping[used] = new_codes
+    return mapping[codes], new_table
+
+
+def _encode_amounts(values):
+    """金額轉成數字陣列 (規則同 pd.to_numeric(errors='coerce').fillna(0))，整數時用最小的整數型別"""
+    array = np.asarray(values)
+    if array.dtype.kind not in "iuf":
+        array = pd.to_numeric(pd.Series(values, dtype=object), errors="coerce").fillna(0).to_numpy()
+    if array.dtype.kind == "f":
+        array = np.nan_to_num(array, nan=0.0)
+        if not np.all(np.mod(array, 1) == 0):
+            return array.astype(np.float64)
+    array = array.astype(np.int64)
+    info = np.iinfo(np.int32)
+    if len(array) == 0 or (array.min() >= info.min and array.max() <= info.max):
+        return array.astype(np.int32)
+    return array
+
+
+def _category_dtype(codes, categories):
+    return codes.astype(np.int8 if len(categories) < 128 else np.int32)
+
+
+class Ledger:
+    """
+    欄式記帳資料 (各欄為 numpy 陣列；沒有讀取的欄位為 None)
+    - from_records() 由儲存層的紀錄建立；keyed=True 時傳入 (id, record) list
+    - from_columns() 由 arrow_snapshot.read_columns() 的結果建立
+    - to_frame() 轉成頁面使用的 DataFrame：分類 / 品項 / 備註 為 Categorical，
+      金額為整數欄，日期為 datetime (供 .dt 操作)
+    """
+
+    def __init__(self, days=None, amounts=None, category_codes=None, categories=None, item_codes=None,
+                 items=None, note_codes=None, notes=None, ids=None):
+        self.days = days
+        self.amounts = amounts
+        self.category_codes = category_codes
+        self.categories = categories
+        self.item_codes = item_codes
+        self.items = items
+        self.note_codes = note_codes
+        self.notes = notes
+        self.ids = ids
+
+    @classmethod
+    def from_records(cls, records, keyed=False, columns=None):
+        columns = columns or COLUMNS
+        ids = None
+        if keyed:
+            ids = np.array([k for k, _ in records], dtype=object)
+            records = [r for _, r in records]
+
+        ledger = cls(ids=ids)
+        if "日期" in columns:
+            # 日期種類遠少於筆數：先編碼再只換算不重複的日期
+            date_codes, date_table = _encode([r.get("日期") for r in records])
+            date_days = np.array(
+                [(date.fromisoformat(str(d)[:10]) - EPOCH).days for d in date_table], dtype=np.int32
+            )
+            ledger.days = date_days[date_codes] if records else np.zeros(0, dtype=np.int32)
+        if "金額" in columns:
+            ledger.amounts = _encode_amounts([r.get("金額") for r in records])
+        if "分類" in columns:
+            codes, categories = _encode([r.get("分類") for r in records], CATEGORIES)
+            # 沒有分類 (None) 的紀錄以 -1 表示 (Categorical 的缺值)
+            if None in categories:
+                missing = categories.index(None)
+                codes[codes == missing] = -1
+                codes[codes > missing] -= 1
+                categories.remove(None)
+            ledger.category_codes = _category_dtype(codes, categories)
+            ledger.categories = categories
+        if "品項" in columns:
+            ledger.item_codes, ledger.items = _encode([r.get("品項") or "" for r in records])
+        if "備註" in columns:
+            ledger.note_codes, ledger.notes = _encode([r.get("備註") or "" for r in records])
+        return ledger
+
+    @classmethod
+    def from_columns(cls, columns, keyed=False):
+        ledger = cls()
+        if keyed:
+            ledger.ids = np.array(columns["id"], dtype=object)
+        if "日期" in columns:
+            ledger.days = columns["日期"].astype(np.int32)
+        if "金額" in columns:
+            ledger.amounts = _encode_amounts(columns["金額"])
+        if "分類" in columns:
+            codes, categories = _recode(*columns["分類"], CATEGORIES)
+            ledger.category_codes = _category_dtype(codes, categories)
+            ledger.categories = categories
+        if "品項" in columns:
+            ledger.item_codes, ledger.items = _recode(*columns["品項"])
+        if "備註" in columns:
+            ledger.note_codes, ledger.notes = _recode(*columns["備註"])
+        return ledger
+
+    @classmethod
+    def concat(cls, first, second):
+        """接在一起 (兩者欄位相同)；字典編碼的欄位合併字串表"""
+        def merge(codes_a, table_a, codes_b, table_b):
+            if codes_a is None:
+                return None, None
+            index = {v: i for i, v in enumerate(table_a)}
+            mapping = np.array([index.setdefault(v, len(index)) for v in table_b] + [-1], dtype=np.int32)
+            return np.concatenate([codes_a.astype(np.int32), mapping[codes_b]]), list(index)
+
+        def join(a, b):
+            return None if a is None else np.concatenate([a, b])
+
+        category_codes, categories = merge(first.category_codes, first.categories,
+                                           second.category_codes, second.categories)
+        item_codes, items = merge(first.item_codes, first.items, second.item_codes, second.items)
+        note_codes, notes = merge(first.note_codes, first.notes, second.note_codes, second.notes)
+        return cls(
+            days=join(first.days, second.days),
+            amounts=join(first.amounts, second.amounts),
+            category_codes=None if category_codes is None else _category_dtype(category_codes, categories),
+            categories=categories,
+            item_codes=item_codes,
+            items=items,
+            note_codes=note_codes,
+            notes=notes,
+            ids=join(first.ids, second.ids),
+        )
+
+    def __len__(self):
+        for column in (self.days, self.amounts, self.category_codes, self.item_codes, self.note_codes, self.ids):
+            if column is not None:
+                return len(column)
+        return 0
+
+    @property
+    def nbytes(self):
+        """陣列 + 字串表 (含 Python 字串物件本身) 佔用的位元組數"""
+        arrays = (self.days, self.amounts, self.category_codes, self.item_codes, self.note_codes)
+        total = sum(a.nbytes for a in arrays if a is not None)
+        for table in (self.categories, self.items, self.notes):
+            total += sum(sys.getsizeof(v) for v in table or ())
+        if self.ids is not None:
+            total += self.ids.nbytes + sum(sys.getsizeof(k) for k in self.ids)
+        return total
+
+    def to_frame(self):
+        """頁面使用的 DataFrame (欄位同 records.json 中有讀取的欄位；keyed 時多一個 key 欄)"""
+        data = {}
+        if self.item_codes is not None:
+            data["品項"] = pd.Categorical.from_codes(self.item_codes, self.items)
+        if self.category_codes is not None:
+            data["分類"] = pd.Categorical.from_codes(self.category_codes, self.categories)
+        if self.amounts is not None:
+            data["金額"] = self.amounts
+        if self.days is not None:
+            data["日期"] = self.days.astype("datetime64[D]").astype("datetime64[s]")
+        if self.note_codes is not None:
+            data["備註"] = pd.Categorical.from_codes(self.note_codes, self.notes)
+        frame = pd.DataFrame(data)
+        if self.ids is not None:
+            frame["key"] = self.ids
+        return frame
+
+
+def load_ledger(store, start=None, end=None, keyed=False, columns=None):
+    """
+    頁面資料的欄式載入
+    儲存層有對應目前快照的 Arrow 快照時，以記憶體映射只讀 columns 需要的欄位，
+    快照之後 (日誌中) 新增 / 修改的紀錄再由 store 補上；否則由 store.query() 建立
+    """
+    columns = [c for c in COLUMNS if c in (columns or COLUMNS)]
+    view = store.arrow_view(start, end, keyed)
+    if view is None:
+        return Ledger.from_records(store.query(start, end, keyed), keyed, columns)
+
+    path, snapshot_hash, stale_ids, changed = view
+    snapshot, metadata = arrow_snapshot.read_columns(path, columns + ["id"] * keyed, start, end, exclude_ids=stale_ids)
+    if metadata.get("snapshot") != snapshot_hash:
+        # arrow_view 之後快照已被壓縮換掉：新檔已含 changed 的紀錄，不能再補上一次
+        return Ledger.from_records(store.query(start, end, keyed), keyed, columns)
+    ledger = Ledger.from_columns(snapshot, keyed)
+    if not changed:
+        return ledger
+    return Ledger.concat(ledger, Ledger.from_records(changed, keyed, columns))
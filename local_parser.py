@@ -0,0 +1,312 @@
+import re
+import threading
+import unicodedata
+from collections import Counter, defaultdict
+
+import numpy as np
+
+from generate_mock_data import categories as MOCK_CATEGORIES
+from storage import CATEGORIES
+
+# ----------------------------------------------------------
+# 本機規則式解析 (不需連網)
+# ----------------------------------------------------------
+# 大部分對話式記帳都是「品項 + 金額」這種簡單句子 (例如：珍奶50元)，
+# 先用規則解析，信心度夠高就不必呼叫 Gemini。
+
+# 補充 generate_mock_data.py 以外的常見關鍵字
+EXTRA_KEYWORDS = {
+    "餐飲食品": ["珍奶", "奶茶", "咖啡", "早餐", "午餐", "晚餐", "宵夜", "便當", "飲料", "麵", "飯",
+             "雞排", "火鍋", "麥當勞", "肯德基", "超商", "全家", "7-11", "點心", "蛋糕", "拉麵"],
+    "交通運輸": ["計程車", "高鐵", "客運", "加油", "停車", "悠遊卡", "機票", "台鐵", "油錢"],
+    "居家生活": ["水費", "電費", "瓦斯", "網路費", "電話費", "洗髮精", "日用品", "家具", "房租"],
+    "服飾購物": ["衣服", "褲子", "鞋", "外套", "包包", "帽子", "襪子", "蝦皮", "網購"],
+    "休閒娛樂": ["電影", "遊戲", "演唱會", "門票", "旅遊", "訂閱", "書", "漫畫", "健身房"],
+    "醫療保健": ["掛號", "看醫生", "藥", "牙醫", "健保", "診所", "保健食品"],
+    "投資儲蓄": ["股票", "基金", "存款", "儲蓄", "定存", "ETF"],
+    "其他": ["影印", "紅包", "捐款", "手續費"],
+}
+
+CHINESE_DIGITS = {"零": 0, "〇": 0, "一": 1, "二": 2, "兩": 2, "两": 2, "三": 3, "四": 4,
+                  "五": 5, "六": 6, "七": 7, "八": 8, "九": 9}
+CHINESE_UNITS = {"十": 10, "百": 100, "千": 1000}
+
+CURRENCY_SUFFIX = r"(?:元|塊錢|塊|块|圓|nt|ntd)"
+CURRENCY_PREFIX = r"(?:\$|nt\$|ntd|nt)"
+
+ARABIC_AMOUNT = re.compile(
+    rf"(?P<prefix>{CURRENCY_PREFIX})?\s*(?P<num>\d[\d,]*(?:\.\d+)?)\s*(?P<suffix>{CURRENCY_SUFFIX})?",
+    re.IGNORECASE,
+)
+# 中文數字容易和品項撞字 (例如：三明治)，只在後面接「元 / 塊」時才視為金額
+CHINESE_AMOUNT = re.compile(rf"(?P<num>[零〇一二兩两三四五六七八九十百千萬万]+)\s*(?P<suffix>{CURRENCY_SUFFIX})")
+
+# 句子中常見、但不屬於品項的字詞
+FILLER_WORDS = ["我今天", "今天", "剛剛", "我買了", "買了", "我花了", "花了", "我付了", "付了",
+                "總共", "一共", "大概", "左右", "吃了", "喝了", "我"]
+
+# 解析結果信心度達此門檻才直接採用，否則交給 Gemini
+CONFIDENCE_THRESHOLD = 0.8
+# 品項只是部分包含關鍵字時的分類信心度上限 (金額信心度 1.0 時合計仍低於門檻)
+PARTIAL_MATCH_MAX = 0.55
+
+# 批次輸入的分隔：換行、頓號、全形逗號、分號，以及後面不是數字的半形逗號 (避免切到 1,200)
+ENTRY_SEPARATOR = re.compile(r"[\n、，；;]|,(?!\d)")
+
+
+def split_entries(text):
+    """把「早餐 45、捷運 25、午餐 80」拆成多段"""
+    return [seg.strip() for seg in ENTRY_SEPARATOR.split(text) if seg.strip()]
+
+
+def char_ngrams(text, n_values=(1, 2, 3)):
+    """字元 n-gram (中文品項沒有空白斷詞，用字元切片最穩定)"""
+    text = _normalize(text).lower().replace(" ", "")
+    grams = []
+    for n in n_values:
+        grams.extend(text[i:i + n] for i in range(len(text) - n + 1))
+    return grams
+
+
+class CategoryClassifier:
+    """
+    品項 → 分類 的本機分類器 (只用 NumPy)
+    - 字元 1~3-gram 的多項式 Naive Bayes，預測時以 IDF 加權
+    - learn_one() 只更新計數，可在每次新增後增量訓練
+    - predict() 回傳 (分類, 信心度)，約數十微秒；
+      Naive Bayes 機率容易過度自信，信心度再乘上「已知 n-gram 的比例」
+      (例如「拿鐵」只認得「鐵」，就不該很有把握地判成交通運輸)
+    """
+
+    def __init__(self, categories=CATEGORIES, alpha=0.1):
+        self.categories = list(categories)
+        self.alpha = alpha
+        self.vocab = {}
+        self.counts = np.zeros((64, len(self.categories)))  # n-gram × 分類 次數 (依需要擴充)
+        self.doc_freq = np.zeros(64)                          # 含此 n-gram 的訓練筆數
+        self.class_docs = np.zeros(len(self.categories))
+        self.n_docs = 0
+
+    def learn(self, records):
+        for r in records:
+            self.learn_one(r.get("品項", ""), r.get("分類"))
+
+    def learn_one(self, item, category):
+        if category not in self.categories or not str(item).strip():
+            return
+        c = self.categories.index(category)
+        grams = char_ngrams(item)
+        for g in grams:
+            idx = self._index(g)
+            self.counts[idx, c] += 1
+        for g in set(grams):
+            self.doc_freq[self.vocab[g]] += 1
+        self.class_docs[c] += 1
+        self.n_docs += 1
+
+    def _index(self, gram):
+        idx = self.vocab.get(gram)
+        if idx is None:
+            idx = len(self.vocab)
+            # 先擴充陣列再登記 n-gram：同時在預測的其他執行緒看到的 vocab 不會超出陣列範圍
+            if idx >= len(self.counts):
+                self.counts = np.vstack([self.counts, np.zeros_like(self.counts)])
+                self.doc_freq = np.concatenate([self.doc_freq, np.zeros_like(self.doc_freq)])
+            self.vocab[gram] = idx
+        return idx
+
+    def predict_proba(self, item):
+        """各分類機率 (順序同 self.categories)；沒有任何已知 n-gram 時回傳 None"""
+        if not self.n_docs:
+            return None
+        idx = [self.vocab[g] for g in char_ngrams(item) if g in self.vocab]
+        if not idx:
+            return None
+
+        n_vocab = len(self.vocab)
+        totals = self.counts[:n_vocab].sum(axis=0)
+        idx = np.array(idx)
+        idf = np.log((1 + self.n_docs) / (1 + self.doc_freq[idx])) + 1
+        log_likelihood = np.log(self.counts[idx] + self.alpha) - np.log(totals + self.alpha * n_vocab)
+        log_prior = np.log((self.class_docs + 1) / (self.n_docs + len(self.categories)))
+
+        scores = log_prior + idf @ log_likelihood
+        scores = np.exp(scores - scores.max())
+        return scores / scores.sum()
+
+    def predict(self, item):
+        proba = self.predict_proba(item)
+        if proba is None:
+            return "其他", 0.0
+        grams = char_ngrams(item)
+        coverage = sum(g in self.vocab for g in grams) / len(grams)
+        best = int(proba.argmax())
+        return self.categories[best], float(proba[best]) * coverage
+
+
+def chinese_to_number(text):
+    """
+    中文數字轉整數：五十 → 50、一百二十 → 120、兩百五 → 250、三千五 → 3500、一萬二 → 12000
+    無法解析時回傳 None
+    """
+    text = text.replace("万", "萬")
+    if "萬" in text:
+        high, _, low = text.partition("萬")
+        high_value = chinese_to_number(high) if high else 1
+        if high_value is None:
+            return None
+        if low and len(low) == 1 and low in CHINESE_DIGITS:
+            # 口語省略單位：一萬二 = 12000
+            return high_value * 10000 + CHINESE_DIGITS[low] * 1000
+        low_value = chinese_to_number(low) if low else 0
+        return None if low_value is None else high_value * 10000 + low_value
+
+    total, digit, last_unit, has_zero = 0, None, None, False
+    for ch in text:
+        if ch in CHINESE_DIGITS:
+            digit = CHINESE_DIGITS[ch]
+            has_zero = has_zero or digit == 0
+        elif ch in CHINESE_UNITS:
+            unit = CHINESE_UNITS[ch]
+            total += (1 if digit is None else digit) * unit
+            digit, last_unit, has_zero = None, unit, False
+        else:
+            return None
+    if digit is not None:
+        if has_zero or not last_unit or last_unit == 10:
+            total += digit
+        else:
+            # 口語省略單位：兩百五 = 250、三千五 = 3500 (一千零五 則是 1005)
+            total += digit * (last_unit // 10)
+    return total
+
+
+class LocalParser:
+    """
+    規則式記帳解析
+    - 金額：阿拉伯數字或中文數字 (需接 元/塊)
+    - 分類：歷史紀錄中完全相同的品項 > 關鍵字字典 > 本機分類器 (CategoryClassifier)
+    - 回傳 confidence (0~1)，由呼叫端決定是否改用 Gemini
+    - 多個 session 共用同一個物件：學習與解析都在鎖內進行
+    """
+
+    def __init__(self, records=()):
+        self.keywords = {}
+        for cat, items in MOCK_CATEGORIES.items():
+            for name, _, _ in items:
+                self.keywords[name.lower()] = cat
+        for cat, words in EXTRA_KEYWORDS.items():
+            for word in words:
+                self.keywords.setdefault(word.lower(), cat)
+
+        self.history = defaultdict(Counter)  # 品項 → 各分類出現次數
+        self._lock = threading.RLock()
+        self.classifier = CategoryClassifier()
+        for word, cat in self.keywords.items():
+            self.classifier.learn_one(word, cat)
+        self.learn(records)
+
+    def learn(self, records):
+        for r in records:
+            self.learn_one(r)
+
+    def learn_one(self, record):
+        """從一筆紀錄學習 品項 → 分類 (新增後呼叫，增量更新)"""
+        item = _normalize(record.get("品項", "")).lower()
+        cat = record.get("分類")
+        if item and cat in CATEGORIES:
+            with self._lock:
+                self.history[item][cat] += 1
+                self.classifier.learn_one(item, cat)
+
+    def suggest_category(self, item):
+        """手動輸入時的預設分類建議"""
+        if not str(item).strip():
+            return None
+        with self._lock:
+            category, confidence = self._classify(_normalize(item))
+        return category if confidence > 0 else None
+
+    def parse(self, text):
+        normalized = _normalize(text)
+        amount, amount_span, amount_conf = self._extract_amount(normalized)
+        item = self._extract_item(normalized, amount_span)
+        with self._lock:
+            category, category_conf = self._classify(item or normalized)
+
+        confidence = 0.0
+        if amount is not None and item:
+            confidence = amount_conf * 0.5 + category_conf * 0.5
+        return {
+            "item": item,
+            "amount": amount if amount is not None else 0,
+            "category": category,
+            "confidence": round(confidence, 2),
+            "source": "local",
+        }
+
+    def _extract_amount(self, text):
+        """回傳 (金額, 在字串中的位置, 信心度)"""
+        candidates = []
+        for m in ARABIC_AMOUNT.finditer(text):
+            value = float(m.group("num").replace(",", ""))
+            has_currency = bool(m.group("prefix") or m.group("suffix"))
+            candidates.append((has_currency, m.start(), value, m.span()))
+        for m in CHINESE_AMOUNT.finditer(text):
+            value = chinese_to_number(m.group("num"))
+            if value is not None:
+                candidates.append((True, m.start(), value, m.span()))
+        if not candidates:
+            return None, None, 0.0
+
+        with_currency = [c for c in candidates if c[0]]
+        if with_currency:
+            _, _, value, span = with_currency[-1]
+            conf = 1.0 if len(with_currency) == 1 else 0.6
+        else:
+            # 沒有單位時取最後一個數字，數字越多越不確定
+            _, _, value, span = candidates[-1]
+            conf = 0.9 if len(candidates) == 1 else 0.5
+        value = int(value) if float(value).is_integer() else value
+        return value, span, conf
+
+    def _extract_item(self, text, amount_span):
+        if amount_span:
+            text = text[:amount_span[0]] + " " + text[amount_span[1]:]
+        for word in FILLER_WORDS:
+            text = text.replace(word, " ")
+        text = re.sub(r"[，,。.!！?？:：;；~～、]", " ", text)
+        return " ".join(text.split())
+
+    def _classify(self, item):
+        """回傳 (分類, 信心度)"""
+        key = item.lower()
+        if key in self.history:
+            cat, count = self.history[key].most_common(1)[0]
+            share = count / sum(self.history[key].values())
+            return cat, 0.7 + 0.3 * share
+        if key in self.keywords:
+            return self.keywords[key], 0.9
+
+        # 最長關鍵字比對：「學餐便當加蛋」→ 學餐便當
+        # 單字關鍵字 (飯 / 麵 / 書 / 鞋 / 藥…) 只用於完全相符，否則「電飯鍋」「書包」都會被誤判；
+        # 部分相符的信心度上限為 PARTIAL_MATCH_MAX，即使金額有單位也不會單獨達到 CONFIDENCE_THRESHOLD
+        best = None
+        for word, cat in self.keywords.items():
+            if len(word) >= 2 and word in key and (best is None or len(word) > len(best[0])):
+                best = (word, cat)
+        for known_item, counter in self.history.items():
+            if len(known_item) >= 2 and known_item in key and (best is None or len(known_item) > len(best[0])):
+                best = (known_item, counter.most_common(1)[0][0])
+        coverage = min(1.0, len(best[0]) / max(len(key), 1)) if best else 0.0
+        match = (best[1], PARTIAL_MATCH_MAX - 0.15 * (1 - coverage)) if best else ("其他", 0.0)
+
+        # 沒有完全相符時再參考分類器，取信心度較高者
+        predicted, proba = self.classifier.predict(key)
+        if proba > match[1]:
+            return predicted, proba * 0.9
+        return match
+
+
+def _normalize(text):
+    return " ".join(unicodedata.normalize("NFKC", str(text)).split())
@@ -0,0 +1,20 @@
+import argparse
+
+from storage import migrate_json_to_sqlite
+
+# 一次性把 data/records.json (含日誌) 與 data/budget.json 匯入 SQLite
+# 匯入後在 .env 設定 STORAGE_BACKEND=sqlite 即可切換後端
+
+parser = argparse.ArgumentParser(description="將 JSON 記帳資料匯入 SQLite")
+parser.add_argument("--data", default="data/records.json")
+parser.add_argument("--budget", default="data/budget.json")
+parser.add_argument("--db", default="data/records.db")
+args = parser.parse_args()
+
+try:
+    n_records, n_budget = migrate_json_to_sqlite(args.data, args.budget, args.db)
+except RuntimeError as e:
+    # 已匯入過：不重複寫入，直接結束
+    print(e)
+else:
+    print(f"已匯入 {n_records} 筆紀錄與 {n_budget} 項預算設定至 {args.db}")
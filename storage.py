@@ -0,0 +1,1226 @@
+import hashlib
+import json
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+import uuid
+from contextlib import closing, suppress
+from datetime import date, timedelta
+
+import arrow_snapshot
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+# ----------------------------------------------------------
+# 記帳資料儲存層
+# ----------------------------------------------------------
+# records.json 作為「快照」(snapshot)，格式與原本完全相同 (list of dict)
+# 每次新增 / 修改 / 刪除只在 journal (JSONL) 尾端追加一行，
+# 累積到一定筆數後再壓縮 (compaction) 回快照，避免每次都重寫整個檔案。
+#
+# 另有 SQLite 後端 (SQLiteStore) 與依月份分片的後端 (ShardedStore，每月一份上述的
+# 快照 + 日誌)，以 .env 的 STORAGE_BACKEND 選擇。
+# 三者提供相同介面；每筆紀錄都有穩定不變的 id (JSON 為新增時產生的隨機字串，
+# 分片再加上「YYYY-MM:」前綴，SQLite 為 rowid)，update / delete 以 id 指定，由 query(keyed=True) 取得。
+#
+# 多個 session / 程序同時寫入時：JSON 後端以建議式檔案鎖 (FileLock) 串行化寫入，
+# 檔案一律寫到暫存檔再 os.replace；update / delete / save_budget 可帶 expected
+# (畫面上看到的舊值)，與目前資料不符就拋出 ConflictError，不會覆蓋別人的修改。
+
+# 小數金額加減後的浮點殘值 (例如 2.8e-17) 視為 0
+AMOUNT_EPSILON = 1e-9
+
+CATEGORIES = ["餐飲食品", "交通運輸", "居家生活", "服飾購物", "休閒娛樂", "醫療保健", "投資儲蓄", "其他"]
+
+
+def month_range(month_str):
+    """'2025-09' → ('2025-09-01', '2025-10-01')，供 query 做月份區間查詢"""
+    year, month = map(int, month_str.split("-"))
+    start = date(year, month, 1)
+    end = date(year + 1, 1, 1) if month == 12 else date(year, month + 1, 1)
+    return str(start), str(end)
+
+
+def to_amount(value):
+    """金額轉成數字 (與頁面上 pd.to_numeric(errors='coerce').fillna(0) 相同規則)"""
+    try:
+        amount = float(value)
+    except (TypeError, ValueError):
+        return 0
+    if amount != amount:  # NaN
+        return 0
+    return int(amount) if amount.is_integer() else amount
+
+
+class ConflictError(Exception):
+    """樂觀並行控制：要修改的資料已被其他 session 變更"""
+
+
+class StoreLockTimeout(TimeoutError):
+    """等待檔案鎖逾時"""
+
+
+def records_equal(a, b):
+    """比較兩筆紀錄內容 (金額、日期正規化後比較，頁面上轉過型別的資料也能比)"""
+    return (
+        (a.get("品項") or "") == (b.get("品項") or "")
+        and a.get("分類", "其他") == b.get("分類", "其他")
+        and to_amount(a.get("金額", 0)) == to_amount(b.get("金額", 0))
+        and str(a.get("日期", ""))[:10] == str(b.get("日期", ""))[:10]
+        and (a.get("備註") or "") == (b.get("備註") or "")
+    )
+
+
+def new_record_id():
+    """新紀錄的 id：隨機 12 碼十六進位，多個程序同時新增也不會重複"""
+    return uuid.uuid4().hex[:12]
+
+
+def legacy_record_id(position, record):
+    """
+    舊資料 (沒有 id) 遷移用：由位置與內容決定 id，
+    每個程序各自載入同一份舊資料時都會算出相同的 id
+    """
+    raw = json.dumps([position, record], ensure_ascii=False, sort_keys=True).encode("utf-8")
+    return hashlib.sha1(raw).hexdigest()[:12]
+
+
+def atomic_write(path, data):
+    """
+    寫到同資料夾的暫存檔、fsync 後以 os.replace 原子替換
+    中途當機只會留下暫存檔，原檔不會被寫壞；暫存檔名唯一，多程序同時寫也不會互相覆蓋
+    """
+    folder = os.path.dirname(path) or "."
+    fd, tmp_path = tempfile.mkstemp(dir=folder, prefix=os.path.basename(path) + ".", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        for attempt in range(50):
+            try:
+                os.replace(tmp_path, path)
+                break
+            except PermissionError:
+                # Windows：目標檔正被其他程序開啟讀取時無法替換，稍候重試
+                if attempt == 49:
+                    raise
+                time.sleep(0.01)
+    except BaseException:
+        with suppress(OSError):
+            os.remove(tmp_path)
+        raise
+
+
+class FileLock:
+    """
+    跨程序的建議式檔案鎖 (advisory lock)
+    - POSIX 用 fcntl.flock，Windows 用 msvcrt.locking
+    - 同一程序內的多個執行緒 (Streamlit session) 另以 RLock 串行化，可重入
+    - 只在寫入期間持有；等待超過 timeout 秒拋出 StoreLockTimeout，不會無限期卡住
+    """
+
+    def __init__(self, path, timeout=10.0, poll=0.005):
+        self.path = path
+        self.timeout = timeout
+        self.poll = poll
+        self._thread_lock = threading.RLock()
+        self._depth = 0
+        self._owner = None
+        self._fd = None
+
+    def held(self):
+        """目前執行緒是否持有鎖"""
+        return self._depth > 0 and self._owner == threading.get_ident()
+
+    def acquire(self):
+        if not self._thread_lock.acquire(timeout=self.timeout):
+            raise StoreLockTimeout(f"等待檔案鎖逾時：{self.path}")
+        if self._depth == 0:
+            try:
+                self._fd = self._lock_file()
+            except BaseException:
+                self._thread_lock.release()
+                raise
+            self._owner = threading.get_ident()
+        self._depth += 1
+
+    def release(self):
+        self._depth -= 1
+        if self._depth == 0:
+            fd, self._fd, self._owner = self._fd, None, None
+            try:
+                if fcntl:
+                    fcntl.flock(fd, fcntl.LOCK_UN)
+                else:
+                    os.lseek(fd, 0, os.SEEK_SET)
+                    msvcrt.locking(fd, msvcrt.LK_UNLCK, 1)
+            finally:
+                os.close(fd)
+        self._thread_lock.release()
+
+    def _lock_file(self):
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        deadline = time.monotonic() + self.timeout
+        while True:
+            try:
+                if fcntl:
+                    fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                else:
+                    os.lseek(fd, 0, os.SEEK_SET)
+                    msvcrt.locking(fd, msvcrt.LK_NBLCK, 1)
+                return fd
+            except OSError:
+                if time.monotonic() >= deadline:
+                    os.close(fd)
+                    raise StoreLockTimeout(f"等待檔案鎖逾時：{self.path}")
+                time.sleep(self.poll)
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+
+
+class Rollup:
+    """
+    每日 / 每月 × 分類 的金額彙總
+    - apply() 在新增 / 修改 / 刪除時以 O(1) 更新
+    - 頁面上的本週 / 本月 / 預算比較 / 圓餅圖直接讀彙總，不必掃描全部紀錄
+    """
+
+    def __init__(self, day=None):
+        self.day = {}    # {"2025-09-01": {"餐飲食品": 164, ...}}
+        self.month = {}  # {"2025-09": {"餐飲食品": 5230, ...}}
+        for d, totals in (day or {}).items():
+            for cat, amount in totals.items():
+                self._add(d, cat, amount)
+
+    @classmethod
+    def from_records(cls, records):
+        rollup = cls()
+        for r in records:
+            rollup.apply(r, 1)
+        return rollup
+
+    def apply(self, record, sign):
+        """sign=1 加入一筆紀錄，sign=-1 扣除一筆紀錄"""
+        self._add(record["日期"], record.get("分類", "其他"), sign * to_amount(record.get("金額", 0)))
+
+    def _add(self, day, cat, amount):
+        for table, key in ((self.day, day), (self.month, day[:7])):
+            totals = table.setdefault(key, {})
+            # 四捨五入去掉浮點累加誤差 (0.1 + 0.2 - 0.1 - 0.2 會剩下 2.8e-17)
+            new_value = round(totals.get(cat, 0) + amount, 6)
+            if new_value:
+                totals[cat] = new_value
+            else:
+                # 歸零就移除，避免圖表出現 0 元的分類
+                totals.pop(cat, None)
+                if not totals:
+                    del table[key]
+
+    def month_totals(self, month_str):
+        return dict(self.month.get(month_str, {}))
+
+    def range_totals(self, start=None, end=None):
+        """日期在 [start, end) 的各分類合計，只走訪區間內的天數"""
+        if not self.day:
+            return {}
+        first, last = min(self.day), max(self.day)
+        start = max(start or first, first)
+        end = min(end, _next_day(last)) if end else _next_day(last)
+        result = {}
+        d = date.fromisoformat(start[:10])
+        end_d = date.fromisoformat(end[:10])
+        while d < end_d:
+            for cat, amount in self.day.get(str(d), {}).items():
+                result[cat] = result.get(cat, 0) + amount
+            d += timedelta(days=1)
+        return result
+
+    def to_dict(self):
+        return {"day": self.day}
+
+
+def _next_day(day_str):
+    return str(date.fromisoformat(day_str) + timedelta(days=1))
+
+
+class BaseStore:
+    """
+    儲存介面
+    - load() / add() / update() / delete() 由各後端實作
+    - query() / months() 預設以全表過濾，後端可覆寫成索引查詢
+    - 預算 (budget) 預設存放於 budget.json
+    """
+
+    budget_path = None
+
+    def load(self):
+        raise NotImplementedError
+
+    def add(self, record):
+        raise NotImplementedError
+
+    def add_many(self, records):
+        """一次新增多筆 (後端可覆寫成單次寫入)"""
+        for r in records:
+            self.add(r)
+
+    def get(self, record_id):
+        """以 id 取得單筆紀錄，不存在時拋出 KeyError"""
+        for r in self.load():
+            if r["id"] == record_id:
+                return r
+        raise KeyError(f"找不到紀錄：{record_id}")
+
+    def update(self, key, record, expected=None):
+        """expected 為修改前看到的內容，與目前資料不符時拋出 ConflictError"""
+        raise NotImplementedError
+
+    def delete(self, key, expected=None):
+        raise NotImplementedError
+
+    def version(self):
+        """資料版本 (檔案 mtime / 大小)，內容有變動時就會不同，供快取失效判斷"""
+        raise NotImplementedError
+
+    def query(self, start=None, end=None, keyed=False):
+        """
+        取出日期在 [start, end) 區間的紀錄 (日期字串 YYYY-MM-DD，None 表示不限)
+        keyed=True 時回傳 (id, record) list，id 可直接給 update / delete 使用
+        """
+        result = []
+        for r in self.load():
+            d = r["日期"]
+            if (start is None or d >= start) and (end is None or d < end):
+                result.append((r["id"], r) if keyed else r)
+        return result
+
+    def months(self):
+        """所有出現過的月份 (YYYY-MM)，降序排列"""
+        return sorted({r["日期"][:7] for r in self.load()}, reverse=True)
+
+    def category_totals(self, start=None, end=None):
+        """日期在 [start, end) 的各分類金額合計 {分類: 金額}"""
+        return Rollup.from_records(self.query(start, end)).range_totals(start, end)
+
+    def month_category_totals(self, month_str):
+        """某月份各分類金額合計 {分類: 金額}"""
+        return self.category_totals(*month_range(month_str))
+
+    def daily_totals(self):
+        """每日各分類金額合計 {日期: {分類: 金額}}"""
+        return Rollup.from_records(self.load()).day
+
+    def arrow_view(self, start=None, end=None, keyed=False):
+        """
+        有欄式快照 (Arrow) 時回傳 (快照路徑, 快照的 hash, 快照之後已修改 / 刪除的 id, 快照之後新增 / 修改且在區間內的紀錄)，
+        供 ledger.load_ledger() 只讀需要的欄位；沒有則回傳 None
+        讀取時檔案若已不是這份快照 (其他程序壓縮後換掉)，後兩項就不適用，呼叫端須改用 query()
+        """
+        return None
+
+    def count(self):
+        """紀錄筆數"""
+        return len(self.load())
+
+    def has_records(self):
+        """是否有任何紀錄 (頁面判斷要不要顯示「沒有資料」)"""
+        return self.count() > 0
+
+    def load_budget(self):
+        if self.budget_path and os.path.exists(self.budget_path):
+            with open(self.budget_path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        return {}
+
+    def save_budget(self, budget, expected=None):
+        """expected 為修改前讀到的預算，與目前檔案內容不符時拋出 ConflictError"""
+        with FileLock(self.budget_path + ".lock"):
+            if expected is not None and self.load_budget() != expected:
+                raise ConflictError("預算設定已被其他視窗修改")
+            atomic_write(self.budget_path, json.dumps(budget, ensure_ascii=False, indent=4).encode("utf-8"))
+
+
+class JournalStore(BaseStore):
+    """
+    快照 + 追加式日誌 (append-only journal) 的記帳儲存
+    - 新增一筆只需 append 一行 → O(1) I/O
+    - 修改 / 刪除也以日誌紀錄，重播 (replay) 後得到最新資料
+    - 日誌第一行記錄對應快照的 hash，壓縮中斷時可判斷日誌是否已併入快照
+    - 分類彙總 (Rollup) 隨每筆操作更新，壓縮時存到 *.rollup.json
+    - 寫入 (含壓縮、重設日誌) 都在檔案鎖內進行，多個程序同時寫入不會遺失資料；
+      讀取不需要鎖
+    - 每筆紀錄帶有 id，另維護 id → list 位置 的索引：修改 / 刪除直接定位。
+      刪除只留下空位 (None)，其他紀錄的位置不變，壓縮時才真正移除
+    - 給 arrow_path (需要 pyarrow) 時，快照另存一份欄式快照 (Arrow IPC)：
+      開啟時若它對應目前的 records.json 就不必解析 JSON，頁面也能只讀需要的欄位
+    """
+
+    def __init__(self, data_path, budget_path=None, journal_path=None, compact_every=1000, arrow_path=None):
+        self.data_path = data_path
+        self.budget_path = budget_path
+        self.journal_path = journal_path or os.path.splitext(data_path)[0] + ".journal.jsonl"
+        self.rollup_path = os.path.splitext(data_path)[0] + ".rollup.json"
+        self.compact_every = compact_every
+        self.arrow_path = arrow_path if arrow_snapshot.available() else None
+
+        self._records = []    # 已刪除的位置為 None
+        self._positions = {}  # id → self._records 中的位置
+        self._snapshot_hash = None
+        self._snapshot_len = 0  # self._records 中前幾筆來自快照
+        self._dirty = set()     # 快照之後被修改 / 刪除的快照紀錄 id
+        self._arrow_hash = None  # 欄式快照對應的快照 hash
+        self._rollup = Rollup()
+        self._journal_entries = 0
+        self._journal_offset = 0
+        self._stat_key = None
+        self._lock = FileLock(self.data_path + ".lock")
+        self._mutex = threading.RLock()  # 保護記憶體中的資料 (同程序多執行緒)
+
+        folder = os.path.dirname(self.data_path)
+        if folder:
+            os.makedirs(folder, exist_ok=True)
+
+        with self._lock, self._mutex:
+            # 若快照不存在就建立空的
+            if not os.path.exists(self.data_path):
+                self._write_snapshot([])
+            self._reload()
+
+    # ------------------------------------------------------
+    # 讀取
+    # ------------------------------------------------------
+    def load(self):
+        """回傳目前所有紀錄 (快照 + 日誌重播後的結果)"""
+        with self._mutex:
+            self._refresh()
+            return [r for r in self._records if r is not None]
+
+    def get(self, record_id):
+        """以 id 取得單筆紀錄 (O(1))，不存在時拋出 KeyError"""
+        with self._mutex:
+            self._refresh()
+            return self._records[self._position(record_id)]
+
+    def version(self):
+        return self._current_stat_key()
+
+    def count(self):
+        with self._mutex:
+            self._refresh()
+            return len(self._positions)
+
+    def category_totals(self, start=None, end=None):
+        with self._mutex:
+            self._refresh()
+            return self._rollup.range_totals(start, end)
+
+    def month_category_totals(self, month_str):
+        with self._mutex:
+            self._refresh()
+            return self._rollup.month_totals(month_str)
+
+    def daily_totals(self):
+        with self._mutex:
+            self._refresh()
+            return {d: dict(totals) for d, totals in self._rollup.day.items()}
+
+    def arrow_view(self, start=None, end=None, keyed=False):
+        with self._mutex:
+            self._refresh()
+            if not self.arrow_path:
+                return None
+            if self._arrow_hash != self._snapshot_hash:
+                # 其他程序壓縮時會接著寫欄式快照，重新看一次是否已經寫好
+                self._arrow_hash = (arrow_snapshot.read_metadata(self.arrow_path) or {}).get("snapshot")
+                if self._arrow_hash != self._snapshot_hash:
+                    return None
+            changed = [r for r in self._records[self._snapshot_len:] if r is not None]
+            changed += [self._records[self._positions[i]] for i in self._dirty if i in self._positions]
+            rows = [
+                (r["id"], r) if keyed else r for r in changed
+                if (start is None or r["日期"] >= start) and (end is None or r["日期"] < end)
+            ]
+            return self.arrow_path, self._snapshot_hash, set(self._dirty), rows
+
+    # ------------------------------------------------------
+    # 寫入 (皆為追加日誌)
+    # ------------------------------------------------------
+    def add(self, record):
+        self._commit({"op": "add", "record": self._with_id(record)})
+
+    def add_many(self, records):
+        # 多筆合成一行日誌，只需一次寫入與 fsync
+        if records:
+            self._commit({"op": "add_many", "records": [self._with_id(r) for r in records]})
+
+    def update(self, record_id, record, expected=None):
+        self._commit({"op": "update", "id": record_id, "record": record}, expected)
+
+    def delete(self, record_id, expected=None):
+        self._commit({"op": "delete", "id": record_id}, expected)
+
+    @staticmethod
+    def _with_id(record):
+        return record if record.get("id") else dict(record, id=new_record_id())
+
+    def compact(self):
+        """把日誌併入快照，並重設日誌"""
+        with self._lock, self._mutex:
+            self._refresh(locked=True)
+            self._set_records([r for r in self._records if r is not None])
+            snapshot_hash = self._write_snapshot(self._records)
+            self._snapshot_hash = snapshot_hash
+            self._write_arrow(snapshot_hash)
+            self._write_rollup(snapshot_hash)
+            self._reset_journal(snapshot_hash)
+            self._journal_entries = 0
+            self._stat_key = self._current_stat_key()
+
+    # ------------------------------------------------------
+    # 內部：檔案同步
+    # ------------------------------------------------------
+    def _current_stat_key(self):
+        snap = os.stat(self.data_path)
+        journal_size = os.path.getsize(self.journal_path) if os.path.exists(self.journal_path) else 0
+        return (snap.st_mtime_ns, snap.st_size, journal_size)
+
+    def _refresh(self, locked=False):
+        """
+        若檔案被其他 session 改動過就重新同步
+        - _stat_key 的日誌大小記的是「已套用到哪裡」(_journal_offset)，不是重播後再 stat 的大小：
+          重播與 stat 之間其他程序追加的日誌才不會被當成已套用而永遠略過
+        - locked=True (寫入 / 壓縮前，已持有檔案鎖)：不看 stat，一律把日誌重播到結尾
+        """
+        key = self._current_stat_key()
+        same_snapshot = self._stat_key is not None and key[:2] == self._stat_key[:2]
+        if same_snapshot and self._journal_offset is not None and key[2] >= self._journal_offset:
+            if locked or key[2] > self._journal_offset:
+                # 快照沒變 → 只重播還沒套用的部分
+                self._replay_from(self._journal_offset)
+                self._stat_key = key[:2] + (self._journal_offset,)
+            return
+        if key == self._stat_key and not self._lock.held():
+            # 日誌先前因不屬於目前快照而被忽略；寫入前 (持有鎖) 才重新載入並重設日誌
+            return
+        self._reload()
+
+    def _set_records(self, records):
+        self._records = records
+        self._positions = {r["id"]: i for i, r in enumerate(records)}
+        self._snapshot_len = len(records)
+        self._dirty = set()
+
+    def _reload(self):
+        # 讀取前先取 stat：讀取期間快照若被換掉，下次 _refresh 會看到不同的 stat 而重新載入
+        key = self._current_stat_key()
+        meta = arrow_snapshot.read_metadata(self.arrow_path) if self.arrow_path else None
+        self._arrow_hash = meta.get("snapshot") if meta else None
+        if meta and meta.get("stat") == self._snapshot_stat():
+            # 欄式快照對應目前的 records.json → 直接由它還原，不必讀取與解析 JSON
+            records = arrow_snapshot.read_records(self.arrow_path)
+            snapshot_hash = self._arrow_hash
+        else:
+            with open(self.data_path, "rb") as f:
+                raw = f.read()
+            records = json.loads(raw.decode("utf-8")) if raw.strip() else []
+            snapshot_hash = hashlib.sha1(raw).hexdigest()
+
+        # 舊版快照沒有 id → 依位置與內容補上 (持有鎖時會在下方壓縮寫回快照)
+        migrated = any("id" not in r for r in records)
+        if migrated:
+            records = [r if "id" in r else dict(r, id=legacy_record_id(i, r)) for i, r in enumerate(records)]
+        self._set_records(records)
+        self._snapshot_hash = snapshot_hash
+        if self.arrow_path and self._arrow_hash != snapshot_hash and not migrated and self._lock.held():
+            # 第一次啟用或欄式快照過期 → 由目前快照匯出 (舊版快照會在下方壓縮時一起寫)
+            self._write_arrow(snapshot_hash)
+
+        # 彙總檔對應同一份快照才沿用，否則從快照重建並存檔
+        self._rollup = self._read_rollup(snapshot_hash)
+        if self._rollup is None:
+            self._rollup = Rollup.from_records(self._records)
+            self._write_rollup(snapshot_hash)
+
+        self._journal_entries = 0
+        self._journal_offset = 0
+        header = self._read_header()
+        if header is None or header.get("snapshot") != snapshot_hash:
+            # 日誌不存在，或屬於舊快照 (已在壓縮時併入) → 重新開一份
+            # 只有持有檔案鎖時才重設；讀取端可能剛好撞上其他程序壓縮到一半，先忽略日誌即可
+            if self._lock.held():
+                self._reset_journal(snapshot_hash)
+            else:
+                self._journal_offset = None
+        else:
+            self._replay_from(0)
+        self._stat_key = key[:2] + (key[2] if self._journal_offset is None else self._journal_offset,)
+
+        if migrated and self._lock.held():
+            self.compact()
+
+    def _read_header(self):
+        if not os.path.exists(self.journal_path):
+            return None
+        with open(self.journal_path, "r", encoding="utf-8") as f:
+            first = f.readline()
+        try:
+            header = json.loads(first)
+        except ValueError:
+            return None
+        return header if header.get("op") == "base" else None
+
+    def _replay_from(self, offset):
+        with open(self.journal_path, "rb") as f:
+            f.seek(offset)
+            for line in f:
+                # 最後一行若寫到一半 (沒有換行) 就當作未完成，不套用
+                if not line.endswith(b"\n"):
+                    break
+                offset += len(line)
+                entry = json.loads(line.decode("utf-8"))
+                self._apply(entry)
+        self._journal_offset = offset
+
+    def _position(self, record_id):
+        position = self._positions.get(record_id)
+        if position is None:
+            raise KeyError(f"找不到紀錄：{record_id}")
+        return position
+
+    def _entry_position(self, entry):
+        if "id" in entry:
+            return self._position(entry["id"])
+        # 舊版日誌以「未刪除紀錄中的第幾筆」指定 (只在重播遷移前的日誌時發生)
+        live = [i for i, r in enumerate(self._records) if r is not None]
+        if not 0 <= entry["index"] < len(live):
+            raise IndexError(f"紀錄索引超出範圍：{entry['index']}")
+        return live[entry["index"]]
+
+    def _append_record(self, record):
+        if "id" not in record:
+            record = dict(record, id=legacy_record_id(len(self._records), record))
+        self._positions[record["id"]] = len(self._records)
+        self._records.append(record)
+        self._rollup.apply(record, 1)
+
+    def _apply(self, entry):
+        op = entry.get("op")
+        if op == "add":
+            self._append_record(entry["record"])
+        elif op == "add_many":
+            for r in entry["records"]:
+                self._append_record(r)
+        elif op == "update":
+            position = self._entry_position(entry)
+            old = self._records[position]
+            if position < self._snapshot_len:
+                self._dirty.add(old["id"])
+            record = dict(entry["record"], id=old["id"])
+            self._rollup.apply(old, -1)
+            self._records[position] = record
+            self._rollup.apply(record, 1)
+        elif op == "delete":
+            position = self._entry_position(entry)
+            old = self._records[position]
+            if position < self._snapshot_len:
+                self._dirty.add(old["id"])
+            # 只留下空位，其他紀錄的位置 (與索引) 不受影響
+            self._records[position] = None
+            del self._positions[old["id"]]
+            self._rollup.apply(old, -1)
+        else:
+            return
+        self._journal_entries += 1
+
+    def _commit(self, entry, expected=None):
+        """
+        在檔案鎖內：同步其他程序的變更 → 檢查 → 寫入一筆日誌 → 套用到記憶體中的資料與彙總
+        """
+        with self._lock, self._mutex:
+            self._refresh(locked=True)
+            if "id" in entry:
+                position = self._position(entry["id"])
+                if expected is not None and not records_equal(self._records[position], expected):
+                    raise ConflictError("這筆紀錄已被其他視窗修改，請重新整理後再試")
+            self._append_entry(entry)
+            self._apply(entry)
+            self._maybe_compact()
+
+    def _append_entry(self, entry):
+        line = json.dumps(entry, ensure_ascii=False) + "\n"
+        with open(self.journal_path, "ab") as f:
+            f.write(line.encode("utf-8"))
+            f.flush()
+            os.fsync(f.fileno())
+        self._journal_offset = os.path.getsize(self.journal_path)
+        self._stat_key = self._current_stat_key()
+
+    def _read_rollup(self, snapshot_hash):
+        if not os.path.exists(self.rollup_path):
+            return None
+        try:
+            with open(self.rollup_path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except ValueError:
+            return None
+        if data.get("snapshot") != snapshot_hash:
+            return None
+        return Rollup(data.get("day"))
+
+    def _write_rollup(self, snapshot_hash):
+        # 壓縮時的彙總 = 快照內容的彙總 (日誌已清空)
+        data = dict(self._rollup.to_dict(), snapshot=snapshot_hash)
+        atomic_write(self.rollup_path, json.dumps(data, ensure_ascii=False).encode("utf-8"))
+
+    def _maybe_compact(self):
+        if self._journal_entries >= self.compact_every:
+            self.compact()
+
+    def _snapshot_stat(self):
+        snap = os.stat(self.data_path)
+        return f"{snap.st_mtime_ns}:{snap.st_size}"
+
+    def _write_arrow(self, snapshot_hash):
+        # 記下快照的 hash 與 stat：stat 相同才代表欄式快照與 records.json 內容一致
+        if not self.arrow_path:
+            return
+        live = [r for r in self._records[:self._snapshot_len] if r is not None]
+        metadata = {"snapshot": snapshot_hash, "stat": self._snapshot_stat()}
+        atomic_write(self.arrow_path, arrow_snapshot.to_ipc_bytes(live, metadata))
+        self._arrow_hash = snapshot_hash
+
+    def _write_snapshot(self, records):
+        raw = json.dumps(records, ensure_ascii=False, indent=4).encode("utf-8")
+        atomic_write(self.data_path, raw)
+        return hashlib.sha1(raw).hexdigest()
+
+    def _reset_journal(self, snapshot_hash):
+        header = (json.dumps({"op": "base", "snapshot": snapshot_hash}) + "\n").encode("utf-8")
+        atomic_write(self.journal_path, header)
+        self._journal_offset = len(header)
+
+
+class ShardedStore(BaseStore):
+    """
+    依月份分片 (shard) 的記帳儲存
+    - 每個月份一個 JournalStore 分片 (shards/2025-09.json + 日誌 + 彙總)
+    - manifest.json 只記錄有哪些月份，只有出現新月份 / 月份清空時才改寫
+    - 新增 / 修改 / 刪除只動到該月份的分片；月份頁面只讀一個分片，
+      歷史資料再多，寫入與單月查詢的成本也只和當月筆數有關
+    - 跨月份查詢 (近 7 / 30 天等) 自動合併涉及的分片
+    - id 為「YYYY-MM:隨機字串」，由 id 即可找到分片；
+      修改日期跨月時紀錄會搬到新月份的分片，id 前綴隨之改變
+    - 寫入一律持有 manifest 的檔案鎖 (再進入分片的鎖)，月份的新增 / 移除與分片寫入不會互相競爭
+    """
+
+    def __init__(self, folder, budget_path=None, legacy_path=None, compact_every=1000):
+        self.folder = folder
+        self.budget_path = budget_path
+        self.manifest_path = os.path.join(folder, "manifest.json")
+        self.compact_every = compact_every
+
+        self._shards = {}  # 月份 → JournalStore (用到才開啟)
+        self._months = []
+        self._manifest_key = None
+        self._lock = FileLock(os.path.join(folder, "manifest.lock"))
+        self._mutex = threading.RLock()
+
+        os.makedirs(folder, exist_ok=True)
+        with self._lock, self._mutex:
+            if not os.path.exists(self.manifest_path):
+                self._migrate(legacy_path)
+
+    # ------------------------------------------------------
+    # 讀取
+    # ------------------------------------------------------
+    def load(self):
+        return self.query()
+
+    def get(self, record_id):
+        month = self._month_of(record_id)
+        if month not in self._read_manifest():
+            raise KeyError(f"找不到紀錄：{record_id}")
+        return self._shard(month).get(record_id)
+
+    def version(self):
+        # manifest + 各分片檔案的 stat，任一月份變動都會不同
+        months = self._read_manifest()
+        return (self._manifest_key,) + tuple(self._shard_stat_key(m) for m in months)
+
+    def query(self, start=None, end=None, keyed=False):
+        result = []
+        for month in self._months_between(start, end):
+            result.extend(self._shard(month).query(start, end, keyed))
+        return result
+
+    def months(self):
+        return sorted(self._read_manifest(), reverse=True)
+
+    def category_totals(self, start=None, end=None):
+        totals = {}
+        for month in self._months_between(start, end):
+            for cat, amount in self._shard(month).category_totals(start, end).items():
+                totals[cat] = totals.get(cat, 0) + amount
+        return {cat: amount for cat, amount in totals.items() if amount}
+
+    def month_category_totals(self, month_str):
+        if month_str not in self._read_manifest():
+            return {}
+        return self._shard(month_str).month_category_totals(month_str)
+
+    def daily_totals(self):
+        day = {}
+        for month in self._read_manifest():
+            day.update(self._shard(month).daily_totals())
+        return day
+
+    def count(self):
+        # 需要開啟所有分片；只想知道有沒有資料時用 has_records()
+        return sum(self._shard(month).count() for month in self._read_manifest())
+
+    def has_records(self):
+        # manifest 只列出有資料的月份 (清空的月份會被移除)，不必開啟任何分片
+        return bool(self._read_manifest())
+
+    # ------------------------------------------------------
+    # 寫入
+    # ------------------------------------------------------
+    def add(self, record):
+        self.add_many([record])
+
+    def add_many(self, records):
+        # 依月份分組，每個分片只寫一行日誌
+        by_month = {}
+        for r in records:
+            month = r["日期"][:7]
+            by_month.setdefault(month, []).append(self._with_id(r, month))
+        with self._lock:
+            for month, group in sorted(by_month.items()):
+                self._ensure_month(month)
+                self._shard(month).add_many(group)
+
+    def update(self, record_id, record, expected=None):
+        month = self._month_of(record_id)
+        new_month = record["日期"][:7]
+        with self._lock:
+            if month not in self._read_manifest():
+                raise KeyError(f"找不到紀錄：{record_id}")
+            shard = self._shard(month)
+            if new_month == month:
+                shard.update(record_id, record, expected)
+                return
+            # 日期改到其他月份 → 搬到新分片 (先寫新分片再刪舊的，中斷時最多重複一筆而不會遺失)
+            current = shard.get(record_id)
+            if expected is not None and not records_equal(current, expected):
+                raise ConflictError("這筆紀錄已被其他視窗修改，請重新整理後再試")
+            moved = dict(record, id=f"{new_month}:{record_id.split(':', 1)[1]}")
+            self._ensure_month(new_month)
+            self._shard(new_month).add(moved)
+            shard.delete(record_id)
+            self._drop_if_empty(month)
+
+    def delete(self, record_id, expected=None):
+        month = self._month_of(record_id)
+        with self._lock:
+            if month not in self._read_manifest():
+                raise KeyError(f"找不到紀錄：{record_id}")
+            self._shard(month).delete(record_id, expected)
+            self._drop_if_empty(month)
+
+    def compact(self):
+        for month in self._read_manifest():
+            self._shard(month).compact()
+
+    @staticmethod
+    def _with_id(record, month):
+        record_id = record.get("id") or new_record_id()
+        if not record_id.startswith(month + ":"):
+            record_id = f"{month}:{record_id.split(':', 1)[-1]}"
+        return dict(record, id=record_id)
+
+    # ------------------------------------------------------
+    # 內部：manifest 與分片
+    # ------------------------------------------------------
+    @staticmethod
+    def _month_of(record_id):
+        month, sep, _ = str(record_id).partition(":")
+        if not sep or len(month) != 7:
+            raise KeyError(f"找不到紀錄：{record_id}")
+        return month
+
+    def _shard_path(self, month):
+        return os.path.join(self.folder, f"{month}.json")
+
+    def _shard(self, month):
+        with self._mutex:
+            shard = self._shards.get(month)
+            if shard is None:
+                shard = JournalStore(self._shard_path(month), compact_every=self.compact_every)
+                self._shards[month] = shard
+            return shard
+
+    def _shard_stat_key(self, month):
+        # 不必開啟分片，直接看檔案 (與 JournalStore.version() 相同的判斷方式)
+        path = self._shard_path(month)
+        journal_path = os.path.splitext(path)[0] + ".journal.jsonl"
+        try:
+            snap = os.stat(path)
+        except FileNotFoundError:
+            return (month, None)
+        journal_size = os.path.getsize(journal_path) if os.path.exists(journal_path) else 0
+        return (month, snap.st_mtime_ns, snap.st_size, journal_size)
+
+    def _read_manifest(self):
+        """目前有資料的月份 (升序)；檔案沒變就沿用上次讀到的內容"""
+        with self._mutex:
+            try:
+                stat = os.stat(self.manifest_path)
+            except FileNotFoundError:
+                return []
+            key = (stat.st_mtime_ns, stat.st_size)
+            if key != self._manifest_key:
+                with open(self.manifest_path, "r", encoding="utf-8") as f:
+                    self._months = sorted(json.load(f).get("months", []))
+                self._manifest_key = key
+            return self._months
+
+    def _write_manifest(self, months):
+        data = {"version": 1, "months": sorted(months)}
+        atomic_write(self.manifest_path, json.dumps(data, ensure_ascii=False, indent=4).encode("utf-8"))
+        self._manifest_key = None
+
+    def _ensure_month(self, month):
+        # 呼叫端已持有 manifest 鎖
+        months = self._read_manifest()
+        if month not in months:
+            self._shard(month)
+            self._write_manifest(months + [month])
+
+    def _drop_if_empty(self, month):
+        # 呼叫端已持有 manifest 鎖，期間不會有其他程序寫入該分片
+        if self._shard(month).count() == 0:
+            self._write_manifest([m for m in self._read_manifest() if m != month])
+
+    def _months_between(self, start=None, end=None):
+        """與日期區間 [start, end) 有交集的月份"""
+        result = []
+        for month in self._read_manifest():
+            month_start, month_end = month_range(month)
+            if (start is None or month_end > start) and (end is None or month_start < end):
+                result.append(month)
+        return result
+
+    def _migrate(self, legacy_path):
+        """第一次開啟時把既有的 records.json (含日誌) 依月份拆成分片，保留原 id 字串"""
+        months = []
+        if legacy_path and os.path.exists(legacy_path):
+            by_month = {}
+            for r in JournalStore(legacy_path).load():
+                month = r["日期"][:7]
+                by_month.setdefault(month, []).append(self._with_id(r, month))
+            for month, group in by_month.items():
+                shard = self._shard(month)
+                if shard.count() == 0:
+                    shard.add_many(group)
+                    shard.compact()
+                months.append(month)
+        self._write_manifest(months)
+
+
+class SQLiteStore(BaseStore):
+    """
+    SQLite 後端
+    - 日期、分類皆建索引，月份 / 近 N 天查詢只讀取需要的列
+    - 紀錄的 id 為 rowid，修改 / 刪除直接定位
+    - 預算存在同一個資料庫的 budget 表
+    - rollup_daily / rollup_monthly 由 trigger 在同一交易內增量維護
+    """
+
+    _SCHEMA = """
+    CREATE TABLE IF NOT EXISTS records (
+        id       INTEGER PRIMARY KEY AUTOINCREMENT,
+        item     TEXT NOT NULL DEFAULT '',
+        category TEXT NOT NULL DEFAULT '其他',
+        amount   NUMERIC NOT NULL DEFAULT 0,
+        date     TEXT NOT NULL,
+        note     TEXT NOT NULL DEFAULT ''
+    );
+    CREATE INDEX IF NOT EXISTS idx_records_date ON records(date);
+    CREATE INDEX IF NOT EXISTS idx_records_category_date ON records(category, date);
+    CREATE TABLE IF NOT EXISTS budget (
+        category TEXT PRIMARY KEY,
+        amount   INTEGER NOT NULL
+    );
+    CREATE TABLE IF NOT EXISTS rollup_daily (
+        date     TEXT NOT NULL,
+        category TEXT NOT NULL,
+        amount   NUMERIC NOT NULL DEFAULT 0,
+        PRIMARY KEY (date, category)
+    );
+    CREATE TABLE IF NOT EXISTS rollup_monthly (
+        month    TEXT NOT NULL,
+        category TEXT NOT NULL,
+        amount   NUMERIC NOT NULL DEFAULT 0,
+        PRIMARY KEY (month, category)
+    );
+    """
+
+    # 新增 / 刪除各對應一次加減，修改 = 先扣舊值再加新值
+    _ROLLUP_SQL = """
+    INSERT INTO rollup_daily (date, category, amount) VALUES ({p}.date, {p}.category, {sign}{p}.amount)
+        ON CONFLICT (date, category) DO UPDATE SET amount = amount + excluded.amount;
+    INSERT INTO rollup_monthly (month, category, amount) VALUES (substr({p}.date, 1, 7), {p}.category, {sign}{p}.amount)
+        ON CONFLICT (month, category) DO UPDATE SET amount = amount + excluded.amount;
+    """
+
+    _TRIGGERS = (
+        "CREATE TRIGGER IF NOT EXISTS trg_records_insert AFTER INSERT ON records BEGIN "
+        + _ROLLUP_SQL.format(p="NEW", sign="") + " END;"
+        "CREATE TRIGGER IF NOT EXISTS trg_records_delete AFTER DELETE ON records BEGIN "
+        + _ROLLUP_SQL.format(p="OLD", sign="-") + " END;"
+        "CREATE TRIGGER IF NOT EXISTS trg_records_update AFTER UPDATE ON records BEGIN "
+        + _ROLLUP_SQL.format(p="OLD", sign="-") + _ROLLUP_SQL.format(p="NEW", sign="") + " END;"
+    )
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        folder = os.path.dirname(self.db_path)
+        if folder:
+            os.makedirs(folder, exist_ok=True)
+        with closing(self._connect()) as conn:
+            has_rollup = conn.execute(
+                "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'rollup_daily'"
+            ).fetchone()
+            conn.executescript(self._SCHEMA + self._TRIGGERS)
+            if not has_rollup:
+                # 舊版資料庫第一次開啟：由現有紀錄回填彙總
+                self._rebuild_rollup(conn)
+
+    @staticmethod
+    def _rebuild_rollup(conn):
+        with conn:
+            conn.execute("DELETE FROM rollup_daily")
+            conn.execute("DELETE FROM rollup_monthly")
+            conn.execute(
+                "INSERT INTO rollup_daily (date, category, amount) "
+                "SELECT date, category, SUM(amount) FROM records GROUP BY date, category"
+            )
+            conn.execute(
+                "INSERT INTO rollup_monthly (month, category, amount) "
+                "SELECT substr(date, 1, 7), category, SUM(amount) FROM records GROUP BY substr(date, 1, 7), category"
+            )
+
+    def _connect(self):
+        # Streamlit 會在不同執行緒呼叫，因此每次操作各自開連線；
+        # 其他程序寫入中時最多等 timeout 秒 (SQLite 自帶檔案鎖)
+        return sqlite3.connect(self.db_path, timeout=10)
+
+    def _check_expected(self, conn, key, expected):
+        row = conn.execute(
+            "SELECT item, category, amount, date, note FROM records WHERE id = ?", (key,)
+        ).fetchone()
+        if row is None:
+            raise KeyError(f"找不到紀錄：{key}")
+        if expected is not None and not records_equal(self._to_record(row), expected):
+            raise ConflictError("這筆紀錄已被其他視窗修改，請重新整理後再試")
+
+    @staticmethod
+    def _to_row(record):
+        return (
+            record.get("品項", ""),
+            record.get("分類", "其他"),
+            record.get("金額", 0),
+            record["日期"],
+            record.get("備註", ""),
+        )
+
+    @staticmethod
+    def _to_record(row):
+        return {"品項": row[0], "分類": row[1], "金額": row[2], "日期": row[3], "備註": row[4]}
+
+    def load(self):
+        return self.query()
+
+    def version(self):
+        # 未開啟 WAL，寫入都會更新主檔的 mtime / 大小
+        st = os.stat(self.db_path)
+        return (st.st_mtime_ns, st.st_size)
+
+    def query(self, start=None, end=None, keyed=False):
+        sql = "SELECT item, category, amount, date, note, id FROM records"
+        conditions, params = [], []
+        if start is not None:
+            conditions.append("date >= ?")
+            params.append(start)
+        if end is not None:
+            conditions.append("date < ?")
+            params.append(end)
+        if conditions:
+            sql += " WHERE " + " AND ".join(conditions)
+        sql += " ORDER BY id"
+
+        with closing(self._connect()) as conn:
+            rows = conn.execute(sql, params).fetchall()
+        records = [dict(self._to_record(row), id=row[5]) for row in rows]
+        if keyed:
+            return [(r["id"], r) for r in records]
+        return records
+
+    def get(self, record_id):
+        with closing(self._connect()) as conn:
+            row = conn.execute(
+                "SELECT item, category, amount, date, note, id FROM records WHERE id = ?", (record_id,)
+            ).fetchone()
+        if row is None:
+            raise KeyError(f"找不到紀錄：{record_id}")
+        return dict(self._to_record(row), id=row[5])
+
+    def months(self):
+        with closing(self._connect()) as conn:
+            rows = conn.execute(
+                "SELECT DISTINCT substr(date, 1, 7) AS m FROM records ORDER BY m DESC"
+            ).fetchall()
+        return [row[0] for row in rows]
+
+    def count(self):
+        with closing(self._connect()) as conn:
+            return conn.execute("SELECT COUNT(*) FROM records").fetchone()[0]
+
+    def category_totals(self, start=None, end=None):
+        sql = "SELECT category, SUM(amount) FROM rollup_daily"
+        conditions, params = [], []
+        if start is not None:
+            conditions.append("date >= ?")
+            params.append(start)
+        if end is not None:
+            conditions.append("date < ?")
+            params.append(end)
+        if conditions:
+            sql += " WHERE " + " AND ".join(conditions)
+        sql += " GROUP BY category"
+        with closing(self._connect()) as conn:
+            rows = conn.execute(sql, params).fetchall()
+        return {cat: amount for cat, amount in rows if abs(amount) > AMOUNT_EPSILON}
+
+    def daily_totals(self):
+        with closing(self._connect()) as conn:
+            rows = conn.execute(
+                "SELECT date, category, amount FROM rollup_daily WHERE ABS(amount) > ?", (AMOUNT_EPSILON,)
+            ).fetchall()
+        result = {}
+        for d, cat, amount in rows:
+            result.setdefault(d, {})[cat] = amount
+        return result
+
+    def month_category_totals(self, month_str):
+        with closing(self._connect()) as conn:
+            rows = conn.execute(
+                "SELECT category, amount FROM rollup_monthly WHERE month = ?", (month_str,)
+            ).fetchall()
+        return {cat: amount for cat, amount in rows if abs(amount) > AMOUNT_EPSILON}
+
+    def add(self, record):
+        with closing(self._connect()) as conn, conn:
+            conn.execute(
+                "INSERT INTO records (item, category, amount, date, note) VALUES (?, ?, ?, ?, ?)",
+                self._to_row(record),
+            )
+
+    def add_many(self, records):
+        with closing(self._connect()) as conn, conn:
+            conn.executemany(
+                "INSERT INTO records (item, category, amount, date, note) VALUES (?, ?, ?, ?, ?)",
+                [self._to_row(r) for r in records],
+            )
+
+    def update(self, key, record, expected=None):
+        with closing(self._connect()) as conn, conn:
+            # BEGIN IMMEDIATE 先取得寫入鎖，檢查與修改之間不會被其他連線插隊
+            conn.execute("BEGIN IMMEDIATE")
+            self._check_expected(conn, key, expected)
+            cur = conn.execute(
+                "UPDATE records SET item = ?, category = ?, amount = ?, date = ?, note = ? WHERE id = ?",
+                self._to_row(record) + (key,),
+            )
+            if cur.rowcount == 0:
+                raise KeyError(f"找不到紀錄：{key}")
+
+    def delete(self, key, expected=None):
+        with closing(self._connect()) as conn, conn:
+            conn.execute("BEGIN IMMEDIATE")
+            self._check_expected(conn, key, expected)
+            cur = conn.execute("DELETE FROM records WHERE id = ?", (key,))
+            if cur.rowcount == 0:
+                raise KeyError(f"找不到紀錄：{key}")
+
+    def load_budget(self):
+        with closing(self._connect()) as conn:
+            rows = conn.execute("SELECT category, amount FROM budget").fetchall()
+        return dict(rows)
+
+    def save_budget(self, budget, expected=None):
+        with closing(self._connect()) as conn, conn:
+            conn.execute("BEGIN IMMEDIATE")
+            if expected is not None and dict(conn.execute("SELECT category, amount FROM budget")) != expected:
+                raise ConflictError("預算設定已被其他視窗修改")
+            conn.execute("DELETE FROM budget")
+            conn.executemany(
+                "INSERT INTO budget (category, amount) VALUES (?, ?)",
+                list(budget.items()),
+            )
+
+
+def open_store(backend, data_path, budget_path, db_path, shard_dir=None, arrow=False):
+    """
+    依設定開啟儲存後端：'json' (預設)、'sqlite' 或 'sharded' (依月份分片)
+    sharded 第一次開啟時會自動把既有的 records.json 拆成分片
+    arrow=True 時 json 後端另存欄式快照 records.arrow (需要 pyarrow，沒有安裝時忽略)
+    """
+    if backend == "sqlite":
+        return SQLiteStore(db_path)
+    if backend == "sharded":
+        shard_dir = shard_dir or os.path.join(os.path.dirname(data_path), "shards")
+        return ShardedStore(shard_dir, budget_path=budget_path, legacy_path=data_path)
+    if backend in ("json", "", None):
+        arrow_path = os.path.splitext(data_path)[0] + ".arrow" if arrow else None
+        return JournalStore(data_path, budget_path=budget_path, arrow_path=arrow_path)
+    raise ValueError(f"未知的 STORAGE_BACKEND：{backend}")
+
+
+def migrate_json_to_sqlite(data_path, budget_path, db_path):
+    """
+    一次性把 records.json (含日誌) 與 budget.json 匯入 SQLite
+    目標資料庫已有資料時拋出 RuntimeError 且不寫入，避免重複匯入
+    """
+    source = JournalStore(data_path, budget_path=budget_path)
+    target = SQLiteStore(db_path)
+
+    with closing(target._connect()) as conn:
+        existing = conn.execute("SELECT COUNT(*) FROM records").fetchone()[0]
+    if existing:
+        raise RuntimeError(f"{db_path} 已有 {existing} 筆資料，略過匯入")
+
+    records = source.load()
+    with closing(target._connect()) as conn, conn:
+        conn.executemany(
+            "INSERT INTO records (item, category, amount, date, note) VALUES (?, ?, ?, ?, ?)",
+            [SQLiteStore._to_row(r) for r in records],
+        )
+
+    budget = source.load_budget()
+    if budget:
+        target.save_budget(budget)
+
+    return len(records), len(budget)